@@ -1,12 +1,30 @@
 import pandas as pd
 import numpy as np
 import xgboost as xgb
-from sklearn.preprocessing import MultiLabelBinarizer, StandardScaler
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import hamming_loss, jaccard_score
-import pickle
+import hashlib
+import time
 import warnings
 import os 
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.scoring_engine import FusedScoringEngine
+from src.model_store import PACK_FILE, load_artifacts, save_packed, save_model_atomic, dump_pickle_atomic
+from src.recommendation_cache import RecommendationCache
+from src.feature_schema import FeatureSchema, scale_inplace
+from src.instrumentation import Metrics
+from src.model_health import validate_models
+from src.eligibility import EligibilityIndex
+from src.boost_rules import USER_TYPES, USER_TYPE_CODES, BoostTables
+from src.explanations import ExplanationTemplates
+from src.results import Recommendation, RecommendationBatch
+from src.evaluation import evaluate_recommender, print_report
+
 warnings.filterwarnings('ignore')
 
 # ========================
@@ -90,6 +108,51 @@ FULL_PRODUCT_CATALOG = {
 }
 
 
+def _feature_column(features_df, name):
+    """Колонка фичи как float-массив (нули, если колонки нет — как row.get(name, 0))"""
+    if name not in features_df.columns:
+        return np.zeros(len(features_df))
+    return pd.to_numeric(features_df[name], errors='coerce').to_numpy(dtype=float)
+
+
+def _label_fingerprint(schema_fingerprint, labels):
+    """Отпечаток меток обучения продукта вместе со схемой фичей"""
+    digest = hashlib.sha256(schema_fingerprint.encode())
+    digest.update(np.ascontiguousarray(labels, dtype=np.uint8).tobytes())
+    return digest.hexdigest()
+
+
+def top_n_indices(scores, top_n):
+    """
+    Индексы top_n колонок каждой строки по убыванию скора.
+    Порядок при равных скорах — как у стабильной sorted(..., reverse=True)
+    """
+    n_rows, n_cols = scores.shape
+    k = min(top_n, n_cols)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.intp)
+
+    if k < n_cols:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidates.sort(axis=1)
+    else:
+        candidates = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    top = np.take_along_axis(candidates, order, axis=1)
+
+    if k < n_cols:
+        # argpartition не гарантирует выбор меньшего индекса среди равных на границе top_n —
+        # такие строки (редкие) досортировываем полностью
+        kth = np.take_along_axis(scores, top[:, -1:], axis=1)
+        boundary_ties = (scores == kth).sum(axis=1) > (candidate_scores == kth).sum(axis=1)
+        for i in np.flatnonzero(boundary_ties):
+            top[i] = np.argsort(-scores[i], kind='stable')[:k]
+
+    return top
+
+
 class MultiProductRecommender:
     """
     Рекомендательная система с поддержкой ВСЕХ 70+ продуктов банка
@@ -101,39 +164,111 @@ class MultiProductRecommender:
         self.models = {}  # Отдельная модель для каждой категории
         self.scaler = StandardScaler()
         self.feature_names = None
-        
-    def _prepare_features(self, features_df):
+        self.feature_schema = None  # FeatureSchema: одно преобразование фичей для train и recommend
+        self.engine = None  # FusedScoringEngine, если включен
+        self.cache = None  # RecommendationCache, если включен
+        self.metrics = None  # Metrics, если включено инструментирование
+        self.fallback_proba = {}  # продукт в карантине -> запасная вероятность (см. model_health)
+        self.positive_rates = {}  # доля положительных примеров при обучении
+        self.health = None  # ModelHealth после load()
+        self.eligibility = None  # EligibilityIndex, если включен допуск по правилам каталога
+        self.prune_candidates = False  # отсечение по верхней границе скора в recommend_batch
+        self.boost_tables = BoostTables()  # правила бустинга по типу и поведению (данные, см. boost_rules)
+        self.explanations = ExplanationTemplates()  # шаблоны объяснений, memoized по корзинам фичей
+        self.label_fingerprints = {}  # продукт -> отпечаток меток обучения и схемы (для дообучения)
+        self.evaluation = None  # результат последней оценки на отложенной выборке (src/evaluation.py)
+        self.models_dir = 'models'  # куда сохраняются артефакты
+
+    @classmethod
+    def load(cls, models_dir='models', strict=True):
         """
-        Подготовка фичей: удаление нечисловых колонок и заполнение пропусков
+        Загрузка обученной системы из папки с моделями (упакованный файл, если он есть).
+        strict=True — падаем со списком продуктов, для которых нет моделей.
+        Каждая модель проверяется один раз: неисправные уходят в карантин с запасной вероятностью
         """
-        print("🔧 Подготавливаем фичи...")
-        
-        # Создаем копию чтобы не менять оригинал
-        df = features_df.copy()
-        
-        # Удаляем явно нечисловые колонки
-        non_numeric_cols = ['user_id', 'target_product']
-        df = df.drop(non_numeric_cols, axis=1, errors='ignore')
-        
-        # Преобразуем все колонки в числовой формат, где возможно
-        for col in df.columns:
-            try:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            except:
-                print(f"⚠️  Не удалось преобразовать колонку {col} в числовой формат")
-                df = df.drop(col, axis=1)
-        
-        # Заполняем пропуски
-        df = df.fillna(0)
-        
-        # Проверяем результат
-        print(f"✅ Осталось {df.shape[1]} числовых колонок")
-        
-        return df
-        
+        recommender = cls()
+        recommender.models_dir = models_dir
+
+        meta, scaler, models = load_artifacts(models_dir, strict=strict)
+        recommender.all_products = meta['all_products']
+        recommender.feature_names = meta['feature_names']
+        recommender.feature_schema = FeatureSchema.from_meta(meta)
+        recommender.product_catalog = meta['product_catalog']
+        recommender.scaler = scaler
+        recommender.positive_rates = meta.get('positive_rates', {})
+        recommender.label_fingerprints = meta.get('label_fingerprints', {})
+        if 'boost_rules' in meta:
+            recommender.boost_tables = BoostTables.from_dict(meta['boost_rules'])
+
+        health = validate_models(
+            models, recommender.feature_names, recommender.product_catalog,
+            meta.get('trained_models', list(models.keys())), recommender.positive_rates
+        )
+        recommender.models = health.models
+        recommender.fallback_proba = health.fallback_proba
+        recommender.health = health
+        if health.quarantined:
+            health.report()
+
+        return recommender
+
+    def close(self):
+        """Закрываем упакованный файл моделей (файл и mmap), если модели загружены из него"""
+        if hasattr(self.models, 'close'):
+            self.models.close()
+
+    def enable_cache(self, max_size=10_000, ttl=300.0):
+        """
+        Включаем кэш рекомендаций (LRU + TTL) перед recommend
+        """
+        self.cache = RecommendationCache(max_size=max_size, ttl=ttl)
+        return self
+
+    def enable_instrumentation(self, sinks=None):
+        """
+        Включаем замеры этапов recommend/train (по умолчанию — в памяти, см. self.metrics.sinks)
+        """
+        self.metrics = Metrics(sinks)
+        return self
+
+    def enable_eligibility(self, prune=True):
+        """
+        Допуск по правилам каталога (min_age, requirements): недопущенные пары не доходят до моделей.
+        prune — в recommend_batch не вызываем модели там, где скор заведомо не попадет в top-N
+        """
+        self.eligibility = EligibilityIndex(self.product_catalog)
+        self.prune_candidates = prune
+        self._invalidate_cache()
+        return self
+
+    def _invalidate_cache(self):
+        """Модели изменились — кэшированные ответы больше не годятся"""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def use_fused_engine(self, fold_scaler=True):
+        """
+        Переключаем скоринг на единый движок (все модели за один вызов).
+        fold_scaler — scaler встраивается в пороги деревьев, фичи идут в движок без масштабирования
+        """
+        self.engine = FusedScoringEngine.from_models(self.models, self.scaler if fold_scaler else None)
+        self._invalidate_cache()
+        print(f"⚡ Единый движок: {len(self.engine.products)} моделей, {self.engine.n_trees} деревьев")
+        return self
+
+    def _model_input(self, X):
+        """
+        Вход моделей из float32-матрицы схемы (X принадлежит вызывающему и меняется на месте):
+        движку со встроенным scaler — как есть, иначе масштабирование в том же буфере
+        """
+        if self.engine is not None and self.engine.scaler_folded:
+            return X
+        return scale_inplace(X, self.scaler)
+
     def create_smart_targets(self, features_df):
         """
         УЛУЧШЕННАЯ версия - максимальная персонализация рекомендаций
+        (построчная эталонная реализация; в train используется create_target_matrix)
         """
         print("🎯 Создаем УМНЫЕ таргеты для всех продуктов...")
         
@@ -243,6 +378,124 @@ class MultiProductRecommender:
         
         return targets
 
+    def create_target_matrix(self, features_df, verbose=True):
+        """
+        Колоночная версия create_smart_targets: те же правила, посчитанные по всему DataFrame.
+        Возвращает матрицу меток uint8 (пользователи × self.all_products)
+        """
+        if verbose:
+            print("🎯 Создаем УМНЫЕ таргеты для всех продуктов...")
+
+        # Основные метрики пользователей
+        market_events = _feature_column(features_df, 'market_events')
+        engagement_ratio = _feature_column(features_df, 'engagement_ratio')
+        offers_engagement = _feature_column(features_df, 'offers_engagement')
+        tech_ratio = _feature_column(features_df, 'tech_interest_ratio')
+        home_ratio = _feature_column(features_df, 'home_interest_ratio')
+        sports_ratio = _feature_column(features_df, 'sports_interest_ratio')
+        diversity_ratio = _feature_column(features_df, 'diversity_ratio')
+        retail_events = _feature_column(features_df, 'retail_events')
+
+        # Определяем типы пользователей
+        user_type = self._detect_user_types(features_df)
+
+        def is_type(*types):
+            return np.isin(user_type, types)
+
+        y = np.zeros((len(features_df), len(self.all_products)), dtype=np.uint8)
+        product_idx = {p: i for i, p in enumerate(self.all_products)}
+
+        def add(mask, *products):
+            for product in products:
+                y[:, product_idx[product]] |= mask
+
+        everyone = np.ones(len(features_df), dtype=bool)
+
+        # === ВКЛАДЫ ===
+        add(is_type('conservative', 'senior', 'family'), 'deposit_savings', 'deposit_pension')
+        add(is_type('saver') | (engagement_ratio < 0.1), 'savings_free', 'deposit_profitable')
+        add((market_events > 100) & (engagement_ratio > 0.15), 'deposit_special')
+
+        # === ПРЕМИУМ (только для VIP) ===
+        vip = is_type('vip')
+        premium_investment = ~vip & (market_events > 150) & (tech_ratio > 0.6)
+        premium_card = ~vip & ~premium_investment & (market_events > 120) & (engagement_ratio > 0.2)
+        add(vip, 'premium_card', 'premium_package', 'premium_investment')
+        add(premium_investment, 'premium_investment')
+        add(premium_card, 'premium_card')
+
+        # === КАРТЫ (персонализированные) ===
+        add(everyone, 'card_cashback')
+        add(is_type('digital'), 'credit_card_180', 'card_psb_iz', 'card_strong_people')
+        add(is_type('sports'), 'sports_card', 'card_sportmaster', 'card_spartak', 'card_cska')
+        add(is_type('senior', 'conservative'), 'pension_card')
+        add(market_events > 50, 'salary_card_pro', 'card_salary_plus')
+        add(tech_ratio > 0.4, 'card_mvideo')
+        add(retail_events > 50, 'card_lenta', 'card_vkusvill', 'card_post_market', 'card_new_world')
+        add(market_events > 30, 'card_resident')
+
+        # === КРЕДИТЫ (по потребностям) ===
+        add(is_type('family'), 'mortgage_family', 'mortgage_new', 'mortgage_secondary')
+        add(is_type('business'), 'consumer_loan', 'refinancing')
+        add(home_ratio > 0.5, 'mortgage_military', 'mortgage_far_east')
+        add((market_events > 80) & (offers_engagement > 10), 'mortgage_alternative', 'mortgage_castle', 'mortgage_easy')
+        add(offers_engagement > 15, 'refinancing')
+
+        # === ИНВЕСТИЦИИ (по профилю риска) ===
+        add(is_type('investor'), 'investment_stocks', 'investment_mixed', 'investment_opportunities')
+        add(is_type('conservative', 'senior'), 'investment_bonds', 'investment_cushion', 'investment_defense')
+        add(tech_ratio > 0.5, 'investment_perspective', 'investment_flow')
+        add(home_ratio > 0.4, 'investment_resources')
+        add(diversity_ratio > 0.3, 'investment_world', 'investment_east')
+        add(market_events > 100, 'investment_dividend', 'investment_stocks')
+
+        # === СТРАХОВАНИЕ (по образу жизни) ===
+        add(everyone, 'insurance_life')
+        add(market_events > 20, 'insurance_osago', 'insurance_card')
+        add(is_type('family'), 'insurance_property', 'insurance_mortgage', 'insurance_emergency')
+        add(is_type('sports'), 'insurance_health', 'insurance_drive', 'insurance_emergency')
+        add(is_type('business'), 'insurance_credit', 'insurance_legal', 'insurance_job_loss')
+        add(home_ratio > 0.6, 'insurance_property', 'insurance_construction')
+        add(sports_ratio > 0.4, 'insurance_drive')
+        add(diversity_ratio > 0.4, 'insurance_travel')
+        add(market_events > 60, 'insurance_deposit')
+
+        return y
+
+    def _detect_user_types(self, features_df):
+        """
+        Колоночная версия _detect_user_type: типы всех пользователей
+        """
+        return np.asarray(USER_TYPES)[self._user_type_codes(features_df)]
+
+    def _user_type_codes(self, features_df):
+        """
+        Коды типов пользователей (индексы в USER_TYPES) через np.select
+        """
+        market_events = _feature_column(features_df, 'market_events')
+        engagement_ratio = _feature_column(features_df, 'engagement_ratio')
+        tech_ratio = _feature_column(features_df, 'tech_interest_ratio')
+        home_ratio = _feature_column(features_df, 'home_interest_ratio')
+        sports_ratio = _feature_column(features_df, 'sports_interest_ratio')
+        offers_engagement = _feature_column(features_df, 'offers_engagement')
+
+        # Порядок условий — как в цепочке if/elif
+        conditions = [
+            (market_events > 200) & (engagement_ratio > 0.2) & (tech_ratio > 0.6),
+            (market_events > 150) & (tech_ratio > 0.5),
+            (market_events > 100) & (offers_engagement > 15),
+            home_ratio > 0.7,
+            sports_ratio > 0.6,
+            (market_events > 120) & (engagement_ratio > 0.15),
+            (market_events < 30) | (home_ratio > 0.8),
+            engagement_ratio < 0.08,
+            market_events > 80,
+        ]
+        choices = [USER_TYPE_CODES[t] for t in
+                   ('vip', 'digital', 'investor', 'family', 'sports', 'business', 'senior', 'conservative', 'active')]
+
+        return np.select(conditions, choices, default=USER_TYPE_CODES['casual'])
+
     def _detect_user_type(self, user_data):
         """
         Определяем тип пользователя для максимальной персонализации
@@ -276,198 +529,353 @@ class MultiProductRecommender:
         else:
             return 'casual'
         
-    def train(self, features_df):
+    def train(self, features_df, n_workers=1, model_n_jobs=None, incremental=False, extra_rounds=20):
         """
-        Обучаем модель с multi-label подходом
+        Обучаем модель с multi-label подходом.
+        n_workers > 1 — продукты обучаются параллельно, model_n_jobs — потоков XGBoost на модель.
+        incremental=True — дообучение загруженной системы: продукты с прежним отпечатком меток и схемы
+        пропускаются, остальные продолжают существующий бустер (extra_rounds деревьев на новых данных);
+        scaler прежний, перезаписываются только изменившиеся артефакты
         """
         print(f"🤖 ОБУЧАЕМ СИСТЕМУ ДЛЯ {len(self.all_products)} ПРОДУКТОВ...")
+        metrics = self.metrics
+        if metrics is not None:
+            mark = time.perf_counter()
         
-        # 1. Подготовка фичей
-        X = self._prepare_features(features_df)
-        self.feature_names = X.columns.tolist()
+        # 1. Подготовка фичей: схема (порядок колонок, float32, заполнение пропусков) сохраняется с моделью
+        print("🔧 Подготавливаем фичи...")
+        schema = FeatureSchema.fit(features_df)
+        if incremental and (not self.models or self.feature_schema is None):
+            print("   ℹ️  Обученных моделей нет — обучаем все продукты с нуля")
+            incremental = False
+        if incremental and schema.fingerprint() != self.feature_schema.fingerprint():
+            print("   ℹ️  Схема фичей изменилась — старые деревья не подходят, обучаем все продукты с нуля")
+            incremental = False
+        self.feature_schema = schema
+        self.feature_names = self.feature_schema.columns
+        X = self.feature_schema.transform(features_df)
         
         print(f"📋 Используется {len(self.feature_names)} числовых признаков")
+        if metrics is not None:
+            mark = metrics.lap('train.prepare', mark)
         
-        # 2. Создаем таргеты
-        targets = self.create_smart_targets(features_df)
+        # 2. Создаем таргеты (сразу матрица меток по self.all_products)
+        y_binary = self.create_target_matrix(features_df)
         
         # Статистика покрытия
-        all_recommended = [p for sublist in targets for p in sublist]
-        unique_products = set(all_recommended)
-        print(f"📊 Покрытие продуктов: {len(unique_products)}/{len(self.all_products)}")
-        print(f"📈 Среднее кол-во продуктов на пользователя: {len(all_recommended)/len(targets):.1f}")
+        product_counts = y_binary.sum(axis=0)
+        print(f"📊 Покрытие продуктов: {(product_counts > 0).sum()}/{len(self.all_products)}")
+        print(f"📈 Среднее кол-во продуктов на пользователя: {product_counts.sum()/len(y_binary):.1f}")
         
-        # 3. Масштабирование
+        if metrics is not None:
+            mark = metrics.lap('train.targets', mark)
+
+        # 3. Масштабирование (при дообучении scaler прежний: пороги старых деревьев заданы в его шкале)
         print("⚖️  Масштабируем фичи...")
-        X_scaled = self.scaler.fit_transform(X)
+        X_scaled = scale_inplace(X, self.scaler if incremental else self.scaler.fit(X))
+        if metrics is not None:
+            mark = metrics.lap('train.scale', mark)
         
-        # 4. Multi-label кодирование
-        print("🔢 Кодируем таргеты...")
-        mlb = MultiLabelBinarizer(classes=self.all_products)
-        y_binary = mlb.fit_transform(targets)
-        
-        # 5. Разделение
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, y_binary, test_size=0.2, random_state=42
+        # 4. Разделение
+        X_train, X_test, y_train, y_test, _, test_idx = train_test_split(
+            X_scaled, y_binary, np.arange(len(X_scaled)), test_size=0.2, random_state=42
         )
         
-        # 6. Обучаем отдельную модель для каждого продукта (One-vs-Rest)
+        # 5. Обучаем отдельную модель для каждого продукта (One-vs-Rest)
         print("🚀 Обучаем модели...")
         
-        trained_models_count = 0
+        # Продукты без примеров или с одним классом пропускаем сразу,
+        # при дообучении — и продукты с прежним отпечатком меток
+        schema_fingerprint = self.feature_schema.fingerprint()
+        fingerprints = {}
+        unchanged = []
+        tasks = []
         for i, product in enumerate(self.all_products):
-            if i % 10 == 0:
-                print(f"   Прогресс: {i}/{len(self.all_products)}")
-            
-            # Пропускаем продукты без примеров или с одним классом
             positive_examples = y_train[:, i].sum()
             negative_examples = len(y_train) - positive_examples
             
             # УМЕНЬШИЛИ ТРЕБОВАНИЯ: минимум 2 примера положительного класса
             if positive_examples < 2:
                 print(f"   ⏭️  Пропускаем {product}: недостаточно данных ({positive_examples}+ примеров)")
+                if metrics is not None:
+                    metrics.count('train.products_skipped')
                 continue
-                
-            try:
-                model = xgb.XGBClassifier(
-                    n_estimators=50,
-                    max_depth=4,
-                    learning_rate=0.1,
-                    random_state=42,
-                    verbosity=0,
-                    scale_pos_weight=negative_examples / (positive_examples + 1)
-                )
-                
-                model.fit(X_train, y_train[:, i])
-                self.models[product] = model
-                trained_models_count += 1
-                print(f"   ✅ Обучили {product}: {positive_examples}+ примеров")
-                
-            except Exception as e:
-                print(f"   ❌ Ошибка при обучении {product}: {e}")
+
+            fingerprints[product] = _label_fingerprint(schema_fingerprint, y_train[:, i])
+            if incremental and product in self.models and self.label_fingerprints.get(product) == fingerprints[product]:
+                unchanged.append(product)
+                if metrics is not None:
+                    metrics.count('train.products_unchanged')
+                continue
+            init_model = self.models.get(product) if incremental else None
+            tasks.append((i, product, positive_examples, negative_examples, init_model))
+            self.positive_rates[product] = float(positive_examples / len(y_train))
+
+        if incremental:
+            print(f"   ♻️  Без изменений {len(unchanged)} продуктов, обучаем {len(tasks)}")
+            if not tasks:
+                print("✅ Все модели актуальны — сохранять нечего")
+                return self
+        else:
+            self.label_fingerprints = {}
+
+        # Параллельно обучаем в потоках: XGBoost отпускает GIL, а X_train общий для всех потоков (без копий).
+        # Потоки внутри каждой модели делим между воркерами, чтобы не переподписывать ядра
+        if n_workers > 1 and model_n_jobs is None:
+            model_n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+
+        def fit(task):
+            i, product, positive_examples, negative_examples, init_model = task
+            scale_pos_weight = negative_examples / (positive_examples + 1)
+            n_estimators = extra_rounds if init_model is not None else 50
+            if metrics is None:
+                return self._fit_product_model(X_train, y_train[:, i], scale_pos_weight, model_n_jobs,
+                                               init_model, n_estimators)
+            fit_start = time.perf_counter()
+            result = self._fit_product_model(X_train, y_train[:, i], scale_pos_weight, model_n_jobs,
+                                             init_model, n_estimators)
+            metrics.observe_model(product, time.perf_counter() - fit_start, 'fit')
+            return result
+
+        start = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+        results = pool.map(fit, tasks) if pool else map(fit, tasks)
+
+        trained_models_count = 0
+        changed = []
+        for k, ((i, product, positive_examples, _, init_model), (model, error)) in enumerate(zip(tasks, results)):
+            if k % 10 == 0:
+                print(f"   Прогресс: {k}/{len(tasks)}")
+
+            if error is not None:
+                print(f"   ❌ Ошибка при обучении {product}: {error}")
+                if metrics is not None:
+                    metrics.count('train.fit_errors')
+                continue
+
+            self.models[product] = model
+            self.fallback_proba.pop(product, None)
+            self.label_fingerprints[product] = fingerprints[product]
+            changed.append(product)
+            trained_models_count += 1
+            action = f"Дообучили (+{extra_rounds} деревьев)" if init_model is not None else "Обучили"
+            print(f"   ✅ {action} {product}: {positive_examples}+ примеров")
+
+        if pool:
+            pool.shutdown()
+        print(f"⏱️  Обучение моделей: {time.perf_counter() - start:.1f} с (воркеров: {n_workers})")
+        if metrics is not None:
+            mark = metrics.lap('train.fit', mark)
         
         print(f"✅ Обучено {trained_models_count} моделей из {len(self.all_products)}")
+
+        # Движок собран из старых моделей — пересобираем, кэш сбрасываем
+        if self.engine is not None:
+            self.use_fused_engine()
+        self._invalidate_cache()
         
-        # 7. Оценка
+        # 6. Оценка
         if trained_models_count > 0:
-            self._evaluate(X_test, y_test, mlb)
+            self._evaluate(features_df.iloc[test_idx], X_test, y_test, n_workers)
+        elif incremental:
+            print("⚠️  Ни одна изменившаяся модель не обучена — сохранять нечего")
+            return self
         else:
             print("❌ Не обучено ни одной модели!")
             return self
+        if metrics is not None:
+            mark = metrics.lap('train.evaluate', mark)
         
-        # 8. Сохранение
-        self._save_models()
+        # 7. Сохранение (при дообучении — только изменившиеся модели, scaler прежний)
+        if incremental:
+            self._save_models(changed=changed, save_scaler=False)
+        else:
+            self._save_models()
+        if metrics is not None:
+            metrics.lap('train.save', mark)
         
         return self
 
-    def _save_models(self):
-        """Сохранение моделей"""
-        import os
-        os.makedirs('models', exist_ok=True)
+    def _fit_product_model(self, X_train, y, scale_pos_weight, n_jobs=None, init_model=None, n_estimators=50):
+        """
+        Обучение модели одного продукта. Возвращает (модель, ошибка).
+        init_model — продолжаем его бустер (n_estimators новых деревьев поверх существующих)
+        """
+        try:
+            model = xgb.XGBClassifier(
+                n_estimators=n_estimators,
+                max_depth=4,
+                learning_rate=0.1,
+                random_state=42,
+                verbosity=0,
+                n_jobs=n_jobs,
+                scale_pos_weight=scale_pos_weight
+            )
+            model.fit(X_train, y, xgb_model=init_model.get_booster() if init_model is not None else None)
+            return model, None
+        except Exception as e:
+            return None, e
+
+    def _save_models(self, changed=None, save_scaler=True):
+        """
+        Сохранение моделей. Каждый файл пишется во временный и атомарно подменяется.
+        changed — сохраняем только эти модели (None — все); метаданные и упакованный файл — всегда
+        """
+        models_dir = self.models_dir
+        os.makedirs(models_dir, exist_ok=True)
         
         # Сохраняем каждую модель
-        for product, model in self.models.items():
-            model.save_model(f'models/model_{product}.json')
+        for product in (self.models if changed is None else changed):
+            save_model_atomic(self.models[product], f'{models_dir}/model_{product}.json')
         
         # Метаданные
-        with open('models/recommender_meta.pkl', 'wb') as f:
-            pickle.dump({
-                'all_products': self.all_products,
-                'feature_names': self.feature_names,
-                'product_catalog': self.product_catalog,
-                'trained_models': list(self.models.keys())
-            }, f)
+        meta = {
+            'all_products': self.all_products,
+            'feature_names': self.feature_names,
+            'feature_schema': self.feature_schema.to_dict(),
+            'product_catalog': self.product_catalog,
+            'trained_models': list(self.models.keys()),
+            'positive_rates': self.positive_rates,
+            'boost_rules': self.boost_tables.to_dict(),
+            'label_fingerprints': self.label_fingerprints
+        }
+        dump_pickle_atomic(meta, f'{models_dir}/recommender_meta.pkl')
         
         # Scaler
-        with open('models/scaler.pkl', 'wb') as f:
-            pickle.dump(self.scaler, f)
+        if save_scaler:
+            dump_pickle_atomic(self.scaler, f'{models_dir}/scaler.pkl')
+
+        # Все вместе одним файлом — для быстрого старта
+        save_packed(f'{models_dir}/{PACK_FILE}', self.models, meta, self.scaler)
         
-        print(f"💾 Модели сохранены в папку models/ ({len(self.models)} моделей)")
+        saved = len(self.models) if changed is None else len(changed)
+        print(f"💾 Сохранено моделей: {saved} из {len(self.models)} в папку {models_dir}/")
     
-    def _evaluate(self, X_test, y_test, mlb):
-        """Оценка качества"""
-        print("\n📊 ОЦЕНКА КАЧЕСТВА:")
-        
-        # Предсказания
-        y_pred = np.zeros_like(y_test)
-        for i, product in enumerate(self.all_products):
-            if product in self.models:
-                y_pred[:, i] = self.models[product].predict(X_test)
-        
-        # Метрики
-        hamming = hamming_loss(y_test, y_pred)
-        jaccard = jaccard_score(y_test, y_pred, average='samples', zero_division=1)
-        
-        print(f"   Hamming Loss: {hamming:.4f}")
-        print(f"   Jaccard Score: {jaccard:.4f}")
-        
-        # Покрытие
-        test_coverage = (y_pred.sum(axis=1) > 0).mean()
-        print(f"   Покрытие тестовой выборки: {test_coverage:.1%}")
-        
-        # Топ продуктов
-        product_predictions = y_pred.sum(axis=0)
-        top_products = sorted(
-            zip(self.all_products, product_predictions), 
-            key=lambda x: x[1], 
-            reverse=True
-        )[:10]
-        
-        print("\n🔝 Топ-10 рекомендуемых продуктов:")
-        for product, count in top_products:
-            print(f"   {product}: {int(count)} раз")
+    def _evaluate(self, test_df, X_test, y_test, n_workers=1):
+        """
+        Оценка качества на отложенной выборке: Hamming/Jaccard по порогу и метрики
+        top-k выдачи с бустингом (precision, recall, NDCG, MAP, покрытие) — src/evaluation.py
+        """
+        self.evaluation = evaluate_recommender(self, test_df, labels=y_test, X=X_test, n_workers=n_workers)
+        print_report(self.evaluation)
+        return self.evaluation
     
-    def recommend(self, user_features, top_n=10, category_filter=None):
+    def recommend(self, user_features, top_n=10, category_filter=None, explain=True):
         """
-        УЛУЧШЕННЫЕ рекомендации с максимальной персонализацией
+        УЛУЧШЕННЫЕ рекомендации с максимальной персонализацией.
+        Возвращает список Recommendation (скор и вероятность — числа, форматирование — при показе).
+        explain=False — без объяснений (их можно получить позже через explain())
         """
         if not self.models:
             print("❌ Модели не обучены!")
             return []
+
+        metrics = self.metrics
+        if metrics is not None:
+            mark = time.perf_counter()
+
+        # Словарь сразу в float32-строку по схеме (она же — ключ кэша)
+        X = self.feature_schema.transform(user_features)
+
+        # Повторный запрос с теми же фичами — ответ из кэша
+        cache_key = None
+        if self.cache is not None:
+            cache_key = RecommendationCache.make_key(
+                user_features.get('user_id'),
+                X[0],
+                category_filter,
+                top_n,
+                explain
+            )
+            cached = self.cache.get(cache_key)
+            if metrics is not None:
+                mark = metrics.lap('recommend.cache', mark)
+            if cached is not None:
+                # Копии: вызывающий код может менять записи, не трогая кэш
+                return [rec.copy() for rec in cached]
         
-        # Подготовка данных
-        user_features_clean = {k: v for k, v in user_features.items() if k in self.feature_names}
-        X = pd.DataFrame([user_features_clean])[self.feature_names].fillna(0)
-        X_scaled = self.scaler.transform(X)
+        # Подготовка данных для моделей
+        X_model = self._model_input(X)
         
         # Определяем тип пользователя для бустинга
         user_type = self._detect_user_type(user_features)
+        if metrics is not None:
+            mark = metrics.lap('recommend.prepare', mark)
+
+        # Единый движок считает все продукты за один вызов
+        engine_proba = self.engine.predict_proba(X_model)[0] if self.engine is not None else None
+        if metrics is not None and engine_proba is not None:
+            mark = metrics.lap('recommend.engine', mark)
         
-        # Предсказания вероятностей с учетом типа пользователя
-        scores = {}
+        # Недопущенные правилами каталога продукты до моделей не доходят
+        ineligible = ()
+        if self.eligibility is not None:
+            candidates = list(self.models) + list(self.fallback_proba)
+            allowed = self.eligibility.mask(user_features, candidates)[0]
+            ineligible = {p for p, ok in zip(candidates, allowed) if not ok}
+
+        # Вероятности: модели (исправность проверена при загрузке), затем запасные для карантина
+        probas = {}
         for product, model in self.models.items():
             if category_filter and self.product_catalog[product]['category'] != category_filter:
+                if metrics is not None:
+                    metrics.count('recommend.models_skipped')
                 continue
-            
-            try:
-                proba = model.predict_proba(X_scaled)[0, 1]
-                
-                # УМНЫЙ БУСТИНГ на основе типа пользователя и приоритета
-                priority = self.product_catalog[product]['priority']
-                category = self.product_catalog[product]['category']
-                
-                # Базовая оценка
-                base_score = proba * (priority / 10.0)
-                
-                # Бустинг по типу пользователя
-                type_boost = self._get_type_boost(user_type, category, product)
-                
-                # Бустинг по поведению
-                behavior_boost = self._get_behavior_boost(user_features, category)
-                
-                # Финальная оценка
-                final_score = base_score * type_boost * behavior_boost
-                
-                scores[product] = {
-                    'score': final_score,
-                    'probability': proba,
-                    'category': category,
-                    'priority': priority,
-                    'type_boost': type_boost,
-                    'behavior_boost': behavior_boost
-                }
-            except Exception as e:
+            if product in ineligible:
+                if metrics is not None:
+                    metrics.count('recommend.models_ineligible')
+                continue
+            if engine_proba is not None:
+                probas[product] = engine_proba[self.engine.product_index[product]]
+            elif metrics is None:
+                probas[product] = model.predict_proba(X_model)[0, 1]
+            else:
+                model_start = time.perf_counter()
+                probas[product] = model.predict_proba(X_model)[0, 1]
+                metrics.observe_model(product, time.perf_counter() - model_start)
+        for product, proba in self.fallback_proba.items():
+            if category_filter and self.product_catalog[product]['category'] != category_filter:
+                continue
+            if product in ineligible:
                 continue
+            probas[product] = proba
+            if metrics is not None:
+                metrics.count('recommend.fallback_used')
+
+        # Бустинги из таблиц: строка типа пользователя и поведение по категориям продуктов
+        categories = [self.product_catalog[product]['category'] for product in probas]
+        type_boosts = self.boost_tables.type_matrix(categories)[USER_TYPE_CODES[user_type]]
+        behavior_boosts = self.boost_tables.behavior_matrix(user_features, categories)[0]
+
+        # Оценки с учетом типа пользователя
+        scores = {}
+        for k, (product, proba) in enumerate(probas.items()):
+            # УМНЫЙ БУСТИНГ на основе типа пользователя и приоритета
+            priority = self.product_catalog[product]['priority']
+            category = categories[k]
+            
+            # Базовая оценка
+            base_score = proba * (priority / 10.0)
+            
+            # Бустинг по типу пользователя
+            type_boost = type_boosts[k]
+            
+            # Бустинг по поведению
+            behavior_boost = behavior_boosts[k]
+            
+            # Финальная оценка
+            final_score = base_score * type_boost * behavior_boost
+            
+            scores[product] = {
+                'score': final_score,
+                'probability': proba,
+                'category': category,
+                'priority': priority,
+                'type_boost': type_boost,
+                'behavior_boost': behavior_boost
+            }
+        if metrics is not None:
+            mark = metrics.lap('recommend.score', mark)
         
         # Ранжирование
         sorted_products = sorted(
@@ -475,101 +883,198 @@ class MultiProductRecommender:
             key=lambda x: x[1]['score'], 
             reverse=True
         )[:top_n]
+        if metrics is not None:
+            mark = metrics.lap('recommend.sort', mark)
         
         # Форматирование
         recommendations = []
+        if explain and sorted_products:
+            activity, flags = self.explanations.buckets(user_features)
         for product_id, data in sorted_products:
-            recommendations.append({
-                'product_id': product_id,
-                'category': data['category'],
-                'score': f"{data['score']:.3f}",
-                'probability': f"{data['probability']:.1%}",
-                'priority': data['priority'],
-                'explanation': self._generate_detailed_explanation(user_features, product_id, user_type)
-            })
+            explanation = None
+            if explain:
+                explanation = self.explanations.text(user_type, data['category'], activity[0], flags[0])
+            recommendations.append(Recommendation(
+                product_id, data['category'], data['score'], data['probability'], data['priority'], explanation
+            ))
+        if metrics is not None:
+            metrics.lap('recommend.format', mark)
+
+        if cache_key is not None:
+            self.cache.put(cache_key, tuple(rec.copy() for rec in recommendations))
         
         return recommendations
 
-    def _get_type_boost(self, user_type, category, product):
+    def recommend_batch(self, features_df, top_n=10, category_filter=None, explain=True, min_score=None):
         """
-        Бустинг на основе типа пользователя
+        Пакетные рекомендации: один проход по всем пользователям.
+        Возвращает RecommendationBatch (колоночно, to_arrow/to_parquet); batch[i] совпадает
+        с recommend() для i-й строки features_df. explain=False — объяснения не строятся вовсе.
+        min_score — в выдачу попадают только скоры строго выше порога (у пользователя может быть меньше top_n)
         """
-        type_boosts = {
-            'vip': {'premium': 2.0, 'investments': 1.5, 'cards': 1.3},
-            'digital': {'cards': 1.8, 'investments': 1.6, 'premium': 1.4},
-            'investor': {'investments': 2.0, 'premium': 1.5},
-            'family': {'loans': 1.8, 'insurance': 1.6, 'savings': 1.4},
-            'sports': {'cards': 1.7, 'insurance': 1.5},
-            'business': {'loans': 1.8, 'premium': 1.6, 'investments': 1.4},
-            'senior': {'savings': 1.8, 'cards': 1.6, 'insurance': 1.4},
-            'conservative': {'savings': 1.7, 'insurance': 1.3}
-        }
-        
-        boost = 1.0
-        if user_type in type_boosts:
-            boosts = type_boosts[user_type]
-            if category in boosts:
-                boost = boosts[category]
-        
-        return boost
+        if not self.models:
+            print("❌ Модели не обучены!")
+            # Пустая выдача того же типа: по пустому списку на пользователя
+            empty = np.empty((len(features_df), 0), dtype=np.float32)
+            return RecommendationBatch.from_top([], self.product_catalog, empty.astype(np.intp), empty, empty)
+
+        metrics = self.metrics
+        if metrics is not None:
+            mark = time.perf_counter()
 
-    def _get_behavior_boost(self, user_features, category):
+        products, proba, scores, user_types = self._score_matrix(features_df, category_filter, top_n)
+        if metrics is not None:
+            mark = metrics.lap('batch.score_matrix', mark)
+        if min_score is not None:
+            scores[scores <= min_score] = -np.inf
+        top = top_n_indices(scores, top_n)
+        if metrics is not None:
+            mark = metrics.lap('batch.sort', mark)
+
+        # Колоночный результат (без словарей на рекомендацию); корзины для объяснений — одним проходом
+        explain_fn = None
+        if explain:
+            activity, flags = self.explanations.buckets(features_df)
+            categories = [self.product_catalog[p]['category'] for p in products]
+
+            def explain_fn(i, j):
+                return self.explanations.text(user_types[i], categories[j], activity[i], flags[i])
+
+        batch_recommendations = RecommendationBatch.from_top(
+            products, self.product_catalog, top, scores, proba, explain_fn
+        )
+        if metrics is not None:
+            metrics.lap('batch.format', mark)
+            metrics.count('batch.users', len(features_df))
+
+        return batch_recommendations
+
+    def _score_matrix(self, features_df, category_filter=None, top_n=None):
         """
-        Бустинг на основе поведения пользователя
+        Матрица финальных скоров пользователи × продукты.
+        Масштабирование выполняется один раз, каждая модель вызывается один раз на весь батч.
+        С eligibility недопущенные пары не доходят до моделей и получают скор -inf;
+        с отсечением и top_n — так же пары, чья верхняя граница скора ниже текущего k-го скора пользователя
         """
-        boost = 1.0
-        
-        market_events = user_features.get('market_events', 0)
-        engagement_ratio = user_features.get('engagement_ratio', 0)
-        tech_ratio = user_features.get('tech_interest_ratio', 0)
-        
-        if category == 'premium' and market_events > 150:
-            boost *= 1.5
-        if category == 'investments' and tech_ratio > 0.6:
-            boost *= 1.4
-        if category == 'cards' and engagement_ratio > 0.15:
-            boost *= 1.3
-        
-        return boost
+        X_model = self._model_input(self.feature_schema.transform(features_df))
+
+        type_codes = self._user_type_codes(features_df)
+
+        models = [(p, m) for p, m in self.models.items()
+                  if not category_filter or self.product_catalog[p]['category'] == category_filter]
+        fallback = [(p, v) for p, v in self.fallback_proba.items()
+                    if not category_filter or self.product_catalog[p]['category'] == category_filter]
+        products = [p for p, _ in models] + [p for p, _ in fallback]
+        n_models = len(models)
+
+        priority_vec, type_boost, behavior_boost = self._boost_matrices(features_df, products, type_codes)
 
-    def _generate_detailed_explanation(self, user_features, product_id, user_type):
+        proba = np.zeros((len(X_model), len(products)), dtype=np.float32)
+        for j, (_, value) in enumerate(fallback, start=n_models):
+            proba[:, j] = value
+
+        eligible = self.eligibility.mask(features_df, products) if self.eligibility is not None else None
+        evaluated = eligible
+        if self.engine is not None:
+            engine_proba = self.engine.predict_proba(X_model)
+            proba[:, :n_models] = engine_proba[:, [self.engine.product_index[p] for p, _ in models]]
+        elif eligible is None:
+            for j, (_, model) in enumerate(models):
+                proba[:, j] = model.predict_proba(X_model)[:, 1]
+        else:
+            evaluated = self._evaluate_eligible(
+                X_model, models, proba, priority_vec, type_boost, behavior_boost,
+                eligible, top_n if self.prune_candidates else None
+            )
+
+        scores = proba * priority_vec
+        scores *= type_boost
+        scores *= behavior_boost
+
+        if evaluated is not None:
+            scores[~evaluated] = -np.inf
+            pairs = len(X_model) * n_models
+            if self.engine is not None:
+                self.eligibility.record(pairs, 0, 0)  # движок все равно считает все деревья
+            else:
+                self.eligibility.record(
+                    pairs, (~eligible[:, :n_models]).sum(), (eligible & ~evaluated)[:, :n_models].sum()
+                )
+
+        return products, proba, scores, np.asarray(USER_TYPES)[type_codes]
+
+    def _boost_matrices(self, features_df, products, type_codes=None):
         """
-        Детальное объяснение рекомендации
+        Множители финального скора для products: приоритет (вектор), бустинг по типу и по поведению
+        (пользователи × products) — в том же порядке и в той же точности, что в recommend
         """
-        reasons = []
-        
-        category = self.product_catalog[product_id]['category']
-        market_events = user_features.get('market_events', 0)
-        engagement_ratio = user_features.get('engagement_ratio', 0)
-        tech_ratio = user_features.get('tech_interest_ratio', 0)
-        home_ratio = user_features.get('home_interest_ratio', 0)
-        
-        # Общие причины
-        if market_events > 100:
-            reasons.append("высокая активность")
-        elif market_events < 30:
-            reasons.append("стабильное поведение")
-        
-        # Причины по типу пользователя
-        if user_type == 'vip':
-            reasons.append("VIP-статус")
-        elif user_type == 'digital':
-            reasons.append("технологическая вовлеченность")
-        elif user_type == 'family':
-            reasons.append("семейный профиль")
-        
-        # Причины по категории продукта
-        if category == 'premium' and engagement_ratio > 0.15:
-            reasons.append("высокая лояльность")
-        if category == 'investments' and tech_ratio > 0.5:
-            reasons.append("интерес к инновациям")
-        if category == 'loans' and home_ratio > 0.6:
-            reasons.append("потребность в финансировании")
-        
-        if not reasons:
-            reasons.append("идеально подходит вашему профилю")
-        
-        return ", ".join(reasons)
+        if type_codes is None:
+            type_codes = self._user_type_codes(features_df)
+        categories = [self.product_catalog[p]['category'] for p in products]
+        unique_categories = list(dict.fromkeys(categories))
+        category_idx = np.array([unique_categories.index(c) for c in categories], dtype=np.intp)
+
+        priority_vec = np.array([self.product_catalog[p]['priority'] / 10.0 for p in products], dtype=np.float32)
+        type_boost = self.boost_tables.type_matrix(categories)[type_codes]
+        behavior_boost = self.boost_tables.behavior_matrix(features_df, unique_categories)[:, category_idx]
+        return priority_vec, type_boost, behavior_boost
+
+    def _evaluate_eligible(self, X_model, models, proba, priority_vec, type_boost, behavior_boost, eligible, top_n=None):
+        """
+        Вызываем модели только на допущенных парах (proba заполняется на месте).
+        top_n — отсечение по верхней границе: proba <= 1, значит скор не больше priority * type * behavior;
+        модель не вызываем, если граница ниже текущего k-го скора пользователя.
+        Продукты идут по убыванию средней границы, чтобы k-й скор рос быстрее. Возвращает маску посчитанных пар
+        """
+        n_users, n_products = proba.shape
+        n_models = len(models)
+        evaluated = eligible.copy()
+
+        if top_n is None:
+            for j, (_, model) in enumerate(models):
+                rows = np.flatnonzero(eligible[:, j])
+                if len(rows):
+                    proba[rows, j] = model.predict_proba(X_model[rows])[:, 1]
+            return evaluated
+
+        def column_scores(j, rows):
+            score = proba[rows, j] * priority_vec[j]
+            score *= type_boost[rows, j]
+            score *= behavior_boost[rows, j]
+            return score
+
+        # Граница с запасом на округление float32
+        bound = priority_vec * type_boost * behavior_boost * (1 + 1e-5)
+
+        # Текущие k лучших скоров пользователя по возрастанию; запасные продукты (карантин) — бесплатно
+        k = min(top_n, n_products)
+        best = np.full((n_users, k), -np.inf, dtype=np.float32)
+        for j in range(n_models, n_products):
+            column = np.full(n_users, -np.inf, dtype=np.float32)
+            rows = np.flatnonzero(eligible[:, j])
+            column[rows] = column_scores(j, rows)
+            best = np.sort(np.column_stack([best, column]), axis=1)[:, 1:]
+
+        order = np.argsort(-np.where(eligible, bound, 0)[:, :n_models].mean(axis=0), kind='stable')
+        for j in order:
+            candidates = eligible[:, j] & (bound[:, j] >= best[:, 0])
+            evaluated[:, j] = candidates
+            rows = np.flatnonzero(candidates)
+            if not len(rows):
+                continue
+            proba[rows, j] = models[j][1].predict_proba(X_model[rows])[:, 1]
+            column = np.full(n_users, -np.inf, dtype=np.float32)
+            column[rows] = column_scores(j, rows)
+            best = np.sort(np.column_stack([best, column]), axis=1)[:, 1:]
+
+        return evaluated
+
+    def explain(self, user_features, product_id):
+        """
+        Объяснение рекомендации по запросу (для результатов, полученных с explain=False)
+        """
+        user_type = self._detect_user_type(user_features)
+        return self.explanations.explain(user_features, user_type, self.product_catalog[product_id]['category'])
 
 
 # ===================
@@ -577,20 +1082,37 @@ class MultiProductRecommender:
 # ===================
 if __name__ == "__main__":
     import os
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Обучение мульти-продуктовой рекомендательной системы')
+    parser.add_argument('--features', help='Parquet с фичами (по умолчанию — первый найденный файл)')
+    parser.add_argument('--chunk-size', type=int,
+                        help='потоковое обучение: читать Parquet чанками и обучать в external memory')
+    parser.add_argument('--workers', type=int, default=1, help='сколько продуктов обучать параллельно')
+    parser.add_argument('--incremental', action='store_true',
+                        help='дообучение моделей из models/: только продукты с изменившимися метками')
+    parser.add_argument('--extra-rounds', type=int, default=20, help='новых деревьев при дообучении')
+    parser.add_argument('--boost-rules', help='JSON с правилами бустинга (type_boosts, behavior_boosts); сохраняется с моделями')
+    args = parser.parse_args()
     
     # 1. Загружаем данные
     print("📥 Загружаем фичи...")
     try:
         # Пробуем разные возможные файлы
-        if os.path.exists('user_features_enhanced.pq'):
-            features_df = pd.read_parquet('user_features_enhanced.pq')
-        elif os.path.exists('train_features.pq'):
-            features_df = pd.read_parquet('train_features.pq')
-        elif os.path.exists('test_features.pq'):
-            features_df = pd.read_parquet('test_features.pq')
-        else:
+        candidates = [args.features] if args.features else [
+            'user_features_enhanced.pq', 'train_features.pq', 'test_features.pq'
+        ]
+        features_path = next((path for path in candidates if os.path.exists(path)), None)
+        if features_path is None:
             print("❌ Файлы с фичами не найдены!")
             exit(1)
+
+        if args.chunk_size:
+            # Вся выборка в память не читается — для примеров берем первый чанк
+            from src.streaming import iter_feature_chunks
+            features_df = next(iter_feature_chunks(features_path, args.chunk_size))
+        else:
+            features_df = pd.read_parquet(features_path)
             
         print(f"📊 Размер данных: {features_df.shape}")
         print(f"📋 Колонки: {features_df.columns.tolist()}")
@@ -600,8 +1122,18 @@ if __name__ == "__main__":
         exit(1)
     
     # 2. Обучаем систему
-    recommender = MultiProductRecommender()
-    recommender.train(features_df)
+    if args.incremental and os.path.exists('models/recommender_meta.pkl'):
+        recommender = MultiProductRecommender.load('models', strict=False)
+    else:
+        recommender = MultiProductRecommender()
+    if args.boost_rules:
+        recommender.boost_tables = BoostTables.from_json(args.boost_rules)
+    if args.chunk_size:
+        from src.streaming import train_out_of_core
+        train_out_of_core(recommender, features_path, chunk_size=args.chunk_size)
+    else:
+        recommender.train(features_df, n_workers=args.workers,
+                          incremental=args.incremental, extra_rounds=args.extra_rounds)
     
     # 3. Тестовые рекомендации
     if recommender.models:
@@ -619,7 +1151,7 @@ if __name__ == "__main__":
             if recs:
                 print(f"   📋 Топ-5 рекомендаций:")
                 for j, rec in enumerate(recs, 1):
-                    print(f"      {j}. {rec['product_id']:30} | {rec['category']:15} | {rec['probability']:6} | {rec['explanation']}")
+                    print(f"      {j}. {rec.product_id:30} | {rec.category:15} | {rec.probability_text:6} | {rec.explanation}")
             else:
                 print("   ❌ Нет рекомендаций")
         
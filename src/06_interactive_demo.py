@@ -1,41 +1,56 @@
 
+import time
 import pandas as pd
 import numpy as np
-import pickle
-import xgboost as xgb
-from sklearn.preprocessing import StandardScaler
+import sys
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.scoring_engine import FusedScoringEngine
+from src.model_store import load_artifacts
+from src.feature_schema import FeatureSchema, scale_inplace
+from src.instrumentation import Metrics
+from src.model_health import validate_models
+from src.results import Recommendation, RecommendationBatch
+from src.multi_product_recommender import top_n_indices
+
+# Сетка кривых покрытия: размер выдачи × порог скора
+COVERAGE_TOP_N = (1, 3, 5, 7, 10)
+COVERAGE_MIN_SCORES = (0.05, 0.1, 0.2, 0.3)
 
 class RecommenderDemo:
     """
     Интерактивное демо для тестирования рекомендаций
     """
     
-    def __init__(self, models_dir='models'):
+    def __init__(self, models_dir='models', use_fused_engine=False):
         print("🔧 Загружаем модели...")
         
-        # Загружаем метаданные
-        with open(f'{models_dir}/recommender_meta.pkl', 'rb') as f:
-            meta = pickle.load(f)
-            self.all_products = meta['all_products']
-            self.feature_names = meta['feature_names']
-            self.product_catalog = meta['product_catalog']
-        
-        # Загружаем scaler
-        with open(f'{models_dir}/scaler.pkl', 'rb') as f:
-            self.scaler = pickle.load(f)
-        
-        # Загружаем модели
-        self.models = {}
-        for product in self.all_products:
-            model_path = f'{models_dir}/model_{product}.json'
-            try:
-                model = xgb.XGBClassifier()
-                model.load_model(model_path)
-                self.models[product] = model
-            except:
-                pass
+        # Метаданные, scaler и модели (упакованный файл, если он есть)
+        meta, self.scaler, self.models = load_artifacts(models_dir)
+        self.all_products = meta['all_products']
+        self.feature_names = meta['feature_names']
+        self.feature_schema = FeatureSchema.from_meta(meta)
+        self.product_catalog = meta['product_catalog']
+
+        # Проверка моделей один раз: неисправные — в карантин, вместо них запасная вероятность
+        self.health = validate_models(
+            self.models, self.feature_names, self.product_catalog,
+            meta.get('trained_models', list(self.models.keys())), meta.get('positive_rates')
+        )
+        self.models = self.health.models
+        self.fallback_proba = self.health.fallback_proba
+        if self.health.quarantined:
+            self.health.report()
         
         print(f"✅ Загружено {len(self.models)} моделей для {len(self.all_products)} продуктов")
+
+        # Единый движок: все модели за один вызов, scaler встроен в пороги деревьев
+        self.engine = FusedScoringEngine.from_models(self.models, self.scaler) if use_fused_engine else None
+
+        # Замеры этапов recommend (None — выключены, см. enable_instrumentation)
+        self.metrics = None
         
         # Загружаем примеры пользователей
         self.sample_users = pd.read_parquet('user_features_enhanced.pq')
@@ -122,37 +137,109 @@ class RecommenderDemo:
         
         return persona
     
+    def enable_instrumentation(self, sinks=None):
+        """Включаем замеры этапов recommend"""
+        self.metrics = Metrics(sinks)
+        return self
+
     def recommend(self, user_features, top_n=10, min_score=0.1):
         """
-        Генерируем рекомендации
+        Генерируем рекомендации (список Recommendation, как у MultiProductRecommender.recommend)
         """
+        metrics = self.metrics
+        if metrics is not None:
+            mark = time.perf_counter()
+
         # Подготовка
-        X = pd.DataFrame([user_features])[self.feature_names].fillna(0)
-        X_scaled = self.scaler.transform(X)
+        X = self.feature_schema.transform(user_features)
+        if self.engine is not None:
+            engine_proba = self.engine.predict_proba(X)[0]
+        else:
+            engine_proba = None
+            X_scaled = scale_inplace(X, self.scaler)
+        if metrics is not None:
+            mark = metrics.lap('demo.prepare', mark)
         
-        # Предсказания
-        scores = {}
+        # Предсказания (модели проверены при загрузке), затем запасные вероятности карантина
+        probas = {}
         for product, model in self.models.items():
-            try:
-                proba = model.predict_proba(X_scaled)[0, 1]
-                priority = self.product_catalog[product]['priority']
-                boosted_score = proba * (priority / 10.0)
-                
-                if boosted_score > min_score:
-                    scores[product] = {
-                        'score': boosted_score,
-                        'probability': proba,
-                        'category': self.product_catalog[product]['category'],
-                        'priority': priority
-                    }
-            except:
-                pass
+            if engine_proba is not None:
+                probas[product] = engine_proba[self.engine.product_index[product]]
+            elif metrics is None:
+                probas[product] = model.predict_proba(X_scaled)[0, 1]
+            else:
+                model_start = time.perf_counter()
+                probas[product] = model.predict_proba(X_scaled)[0, 1]
+                metrics.observe_model(product, time.perf_counter() - model_start)
+        probas.update(self.fallback_proba)
+
+        recommendations = []
+        for product, proba in probas.items():
+            priority = self.product_catalog[product]['priority']
+            boosted_score = proba * (priority / 10.0)
+            
+            if boosted_score > min_score:
+                recommendations.append(Recommendation(
+                    product, self.product_catalog[product]['category'], boosted_score, proba, priority
+                ))
+        if metrics is not None:
+            mark = metrics.lap('demo.score', mark)
         
         # Сортировка
-        sorted_recs = sorted(scores.items(), key=lambda x: x[1]['score'], reverse=True)[:top_n]
+        sorted_recs = sorted(recommendations, key=lambda rec: rec.score, reverse=True)[:top_n]
+        if metrics is not None:
+            metrics.lap('demo.sort', mark)
         
         return sorted_recs
     
+    def score_matrix(self, users):
+        """
+        Скоры пользователи × продукты одним проходом (те же формулы и точность, что в recommend).
+        users — DataFrame или список словарей фичей. Возвращает (продукты, вероятности, скоры)
+        """
+        X = self.feature_schema.transform(users)
+        products = list(self.models) + list(self.fallback_proba)
+        proba = np.empty((len(X), len(products)), dtype=np.float32)
+
+        if self.engine is not None:
+            engine_proba = self.engine.predict_proba(X)
+            proba[:, :len(self.models)] = engine_proba[:, [self.engine.product_index[p] for p in self.models]]
+        else:
+            X_scaled = scale_inplace(X, self.scaler)
+            for j, model in enumerate(self.models.values()):
+                proba[:, j] = model.predict_proba(X_scaled)[:, 1]
+        for j, product in enumerate(self.fallback_proba, start=len(self.models)):
+            proba[:, j] = self.fallback_proba[product]
+
+        priority_vec = np.array([self.product_catalog[p]['priority'] / 10.0 for p in products], dtype=np.float32)
+        return products, proba, proba * priority_vec
+
+    def recommend_batch(self, users, top_n=10, min_score=0.1):
+        """
+        Рекомендации для всех пользователей одним вызовом: RecommendationBatch,
+        batch[i] совпадает с recommend() для i-го пользователя
+        """
+        products, proba, scores = self.score_matrix(users)
+        scores[scores <= min_score] = -np.inf
+        return RecommendationBatch.from_top(products, self.product_catalog, top_n_indices(scores, top_n), scores, proba)
+
+    def coverage_curves(self, scores, top_ns=COVERAGE_TOP_N, min_scores=COVERAGE_MIN_SCORES):
+        """
+        Покрытие каталога для всех пар (top_n, min_score) по одной матрице скоров.
+        Ранг продукта у пользователя считается один раз; продукт попадает в выдачу при top_n и пороге,
+        если его лучший ранг среди пользователей со скором выше порога меньше top_n.
+        Возвращает DataFrame: строки — min_score, колонки — top_n, значения — число продуктов
+        """
+        order = np.argsort(-scores, axis=1, kind='stable')
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(scores.shape[1]), axis=1)
+
+        curves = {}
+        for min_score in min_scores:
+            best_rank = np.where(scores > min_score, ranks, scores.shape[1]).min(axis=0, initial=scores.shape[1])
+            curves[min_score] = [int((best_rank < top_n).sum()) for top_n in top_ns]
+        return pd.DataFrame.from_dict(curves, orient='index', columns=list(top_ns))
+
     def format_recommendations(self, recommendations):
         """
         Красивый вывод рекомендаций
@@ -165,10 +252,8 @@ class RecommenderDemo:
             print("❌ Нет подходящих рекомендаций")
             return
         
-        for i, (product_id, data) in enumerate(recommendations, 1):
-            category = data['category']
-            score = data['score']
-            proba = data['probability']
+        for i, rec in enumerate(recommendations, 1):
+            category = rec.category
             
             # Эмодзи для категорий
             emoji_map = {
@@ -183,30 +268,34 @@ class RecommenderDemo:
             
             emoji = emoji_map.get(category, '📦')
             
-            print(f"\n{i}. {emoji} {product_id.upper()}")
+            print(f"\n{i}. {emoji} {rec.product_id.upper()}")
             print(f"   Категория: {category}")
-            print(f"   Релевантность: {score:.3f}")
-            print(f"   Вероятность: {proba:.1%}")
-            print(f"   Приоритет: {'⭐' * data['priority']}")
+            print(f"   Релевантность: {rec.score_text}")
+            print(f"   Вероятность: {rec.probability_text}")
+            print(f"   Приоритет: {'⭐' * rec.priority}")
     
-    def analyze_coverage(self):
+    def analyze_coverage(self, top_n=7, min_score=0.05):
         """
-        Анализируем покрытие продуктов
+        Анализируем покрытие продуктов по всем пользователям (одна матрица скоров)
+        и кривые покрытия по top_n × min_score
         """
         print("\n" + "="*80)
         print("📊 АНАЛИЗ ПОКРЫТИЯ ПРОДУКТОВ")
         print("="*80)
         
-        # Тестируем на случайных пользователях
-        sample_size = min(100, len(self.sample_users))
-        all_recommended = set()
+        # Все пользователи одним вызовом
+        products, _, scores = self.score_matrix(self.sample_users)
+        curves = self.coverage_curves(scores, sorted(set(COVERAGE_TOP_N) | {top_n}),
+                                      sorted(set(COVERAGE_MIN_SCORES) | {min_score}))
         
-        for i in range(sample_size):
-            user = self.sample_users.iloc[i].to_dict()
-            recs = self.recommend(user, top_n=7, min_score=0.05)
-            all_recommended.update([r[0] for r in recs])
+        # Выдача при top_n и min_score: продукт покрыт, если хоть раз попал в top_n выше порога
+        masked = np.where(scores > min_score, scores, -np.inf)
+        top = top_n_indices(masked, top_n)
+        served = np.take_along_axis(masked, top, axis=1) != -np.inf
+        all_recommended = {products[j] for j in np.unique(top[served])}
         
-        print(f"\n✅ Покрытие: {len(all_recommended)}/{len(self.all_products)} продуктов")
+        print(f"\n✅ Покрытие ({len(self.sample_users):,} пользователей): "
+              f"{len(all_recommended)}/{len(self.all_products)} продуктов")
         print(f"   ({len(all_recommended)/len(self.all_products)*100:.1f}%)")
         
         # Распределение по категориям
@@ -219,16 +308,24 @@ class RecommenderDemo:
         for cat, count in sorted(category_counts.items(), key=lambda x: x[1], reverse=True):
             print(f"   {cat:20} : {count:3} продуктов")
         
+        # Кривые покрытия
+        print("\n📈 Покрытие каталога (продуктов) по top_n × min_score:")
+        print("   min_score \\ top_n " + "".join(f"{n:>6}" for n in curves.columns))
+        for threshold, row in curves.iterrows():
+            print(f"   {threshold:>17.2f} " + "".join(f"{count:>6}" for count in row))
+        
         # Не рекомендуемые продукты
         not_recommended = set(self.all_products) - all_recommended
         if not_recommended:
             print(f"\n⚠️ Не рекомендуются ({len(not_recommended)}):")
             for product in sorted(not_recommended)[:10]:
                 print(f"   - {product}")
+        
+        return all_recommended, curves
     
     def compare_personas(self):
         """
-        Сравниваем рекомендации для разных персон
+        Сравниваем рекомендации для разных персон (все персоны — одним пакетным вызовом)
         """
         print("\n" + "="*80)
         print("👥 СРАВНЕНИЕ РЕКОМЕНДАЦИЙ ДЛЯ РАЗНЫХ ПЕРСОН")
@@ -243,18 +340,19 @@ class RecommenderDemo:
             'спортсмен'
         ]
         
-        for persona_name in personas:
-            user = self.create_user_persona(persona_name)
-            recs = self.recommend(user, top_n=5, min_score=0.1)
-            
+        batch = self.recommend_batch([self.create_user_persona(name) for name in personas], top_n=5, min_score=0.1)
+        
+        for persona_name, recs in zip(personas, batch):
             print(f"\n🎭 {persona_name.upper().replace('_', ' ')}")
             print("-" * 80)
             
             if recs:
-                for i, (product, data) in enumerate(recs, 1):
-                    print(f"   {i}. {product:30} | {data['category']:15} | {data['probability']:.1%}")
+                for i, rec in enumerate(recs, 1):
+                    print(f"   {i}. {rec.product_id:30} | {rec.category:15} | {rec.probability_text}")
             else:
                 print("   ❌ Нет рекомендаций")
+        
+        return batch
     
     def test_specific_user(self, user_id=None):
         """
@@ -1,329 +1,471 @@
 # src/07_visualization_report.py
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # без дисплея: графики только в файлы (в том числе из процессов-воркеров)
 import matplotlib.pyplot as plt
 import seaborn as sns
-from collections import Counter
 import pickle
+import hashlib
+import json
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.multi_product_recommender import MultiProductRecommender
+from src.report_summary import RecommendationSummary, segment_summary
+from src.results import RecommendationBatch
 
 plt.rcParams['figure.figsize'] = (14, 8)
 plt.rcParams['font.size'] = 10
 sns.set_style("whitegrid")
 
+# Рекомендатель процесса-воркера: модели загружаются один раз при старте воркера
+_worker_recommender = None
+
+# Графики отчета (файл — <имя>.png) и файл с хэшами их входных агрегатов
+PLOTS = ('product_coverage', 'user_segments', 'recommendation_quality')
+HASH_FILE = '.report_hashes.json'
+
+# Какие поля RecommendationSummary.to_dict() читает каждый график (user_segments — агрегаты сегментов)
+PLOT_FIELDS = {
+    'product_coverage': ('product_counts', 'category_counts'),
+    'recommendation_quality': ('recs_per_user_counts', 'mean_recs', 'score_hist', 'score_edges', 'score_stats',
+                               'category_mean_score', 'diversity_hist', 'diversity_edges', 'mean_diversity'),
+}
+
+
+# ===================
+# ОТРИСОВКА ПО АГРЕГАТАМ
+# ===================
+def _render_product_coverage(data, path, dpi):
+    """
+    График покрытия продуктов
+    """
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
+    
+    # График 1: Топ-30 продуктов (product_counts уже по убыванию)
+    top_products = list(data['product_counts'].items())[:30]
+    names = [p[0][:25] for p in top_products]
+    counts = [p[1] for p in top_products]
+    
+    bars = ax1.barh(range(len(names)), counts, color='steelblue')
+    ax1.set_yticks(range(len(names)))
+    ax1.set_yticklabels(names, fontsize=8)
+    ax1.set_xlabel('Количество рекомендаций', fontsize=11)
+    ax1.set_title('📊 Топ-30 рекомендуемых продуктов', fontsize=13, fontweight='bold')
+    ax1.invert_yaxis()
+    
+    # Добавляем значения
+    for i, bar in enumerate(bars):
+        width = bar.get_width()
+        ax1.text(width + 0.5, bar.get_y() + bar.get_height()/2, 
+                f'{int(width)}', ha='left', va='center', fontsize=8)
+    
+    # График 2: Распределение по категориям
+    categories = list(data['category_counts'].keys())
+    cat_counts = list(data['category_counts'].values())
+    
+    colors = plt.cm.Set3(range(len(categories)))
+    wedges, texts, autotexts = ax2.pie(
+        cat_counts, 
+        labels=categories,
+        autopct='%1.1f%%',
+        startangle=90,
+        colors=colors
+    )
+    
+    for text in texts:
+        text.set_fontsize(10)
+    for autotext in autotexts:
+        autotext.set_fontsize(9)
+        autotext.set_fontweight('bold')
+    
+    ax2.set_title('📈 Распределение по категориям', fontsize=13, fontweight='bold')
+    
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def _render_user_segments(data, path, dpi):
+    """
+    Сегментация пользователей («ящики» — по готовым статистикам, рассеяние — по выборке точек)
+    """
+    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    
+    # 1. Распределение активности
+    ax1 = axes[0, 0]
+    bars = ax1.bar(list(data['activity'].keys()), list(data['activity'].values()), color='coral')
+    ax1.set_xlabel('Уровень активности', fontsize=11)
+    ax1.set_ylabel('Количество пользователей', fontsize=11)
+    ax1.set_title('👥 Распределение по активности', fontsize=12, fontweight='bold')
+    
+    for bar in bars:
+        height = bar.get_height()
+        ax1.text(bar.get_x() + bar.get_width()/2., height,
+                f'{int(height)}',
+                ha='center', va='bottom', fontsize=10)
+    
+    # 2. Интересы пользователей
+    ax2 = axes[0, 1]
+    ax2.bxp(data['interests'], patch_artist=True)
+    ax2.set_ylabel('Уровень интереса', fontsize=11)
+    ax2.set_title('🎯 Распределение интересов', fontsize=12, fontweight='bold')
+    ax2.set_xticklabels([stats['label'] for stats in data['interests']], rotation=15, ha='right')
+    
+    # 3. Вовлеченность
+    ax3 = axes[1, 0]
+    bp = ax3.bxp(data['engagement'], patch_artist=True)
+    
+    for patch in bp['boxes']:
+        patch.set_facecolor('lightblue')
+    
+    ax3.set_ylabel('Коэффициент вовлеченности', fontsize=11)
+    ax3.set_title('💡 Вовлеченность пользователей', fontsize=12, fontweight='bold')
+    ax3.set_xticklabels([stats['label'] for stats in data['engagement']], rotation=15, ha='right')
+    
+    # 4. Корреляция активности и вовлеченности (выбросы отфильтрованы в segment_summary)
+    ax4 = axes[1, 1]
+    scatter = ax4.scatter(
+        data['scatter']['x'],
+        data['scatter']['y'],
+        c=data['scatter']['c'],
+        cmap='viridis',
+        alpha=0.6,
+        s=30
+    )
+    
+    ax4.set_xlabel('Активность в маркетплейсе', fontsize=11)
+    ax4.set_ylabel('Вовлеченность в офферы', fontsize=11)
+    ax4.set_title('🔗 Корреляция активности', fontsize=12, fontweight='bold')
+    
+    plt.colorbar(scatter, ax=ax4, label='Engagement Ratio')
+    
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def _render_recommendation_quality(data, path, dpi):
+    """
+    Качество рекомендаций (гистограммы — по уже посчитанным корзинам сводки)
+    """
+    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    
+    # 1. Распределение количества рекомендаций на пользователя
+    ax1 = axes[0, 0]
+    rec_counts = data['recs_per_user_counts']
+    
+    ax1.hist(np.arange(len(rec_counts)), bins=range(1, 12), weights=rec_counts,
+             color='skyblue', edgecolor='black', alpha=0.7)
+    ax1.set_xlabel('Количество рекомендаций', fontsize=11)
+    ax1.set_ylabel('Количество пользователей', fontsize=11)
+    ax1.set_title('📊 Распределение рекомендаций', fontsize=12, fontweight='bold')
+    ax1.axvline(data['mean_recs'], color='red', linestyle='--', 
+               label=f"Среднее: {data['mean_recs']:.1f}")
+    ax1.legend()
+    
+    # 2. Распределение скоров
+    ax2 = axes[0, 1]
+    edges = data['score_edges']
+    
+    ax2.hist(edges[:-1], bins=edges, weights=data['score_hist'],
+             color='lightcoral', edgecolor='black', alpha=0.7)
+    ax2.set_xlabel('Скор рекомендации', fontsize=11)
+    ax2.set_ylabel('Частота', fontsize=11)
+    ax2.set_title('🎯 Распределение скоров', fontsize=12, fontweight='bold')
+    ax2.axvline(data['score_stats']['median'], color='green', linestyle='--',
+               label=f"Медиана: {data['score_stats']['median']:.2f}")
+    ax2.legend()
+    
+    # 3. Топ категорий по скорам
+    ax3 = axes[1, 0]
+    categories = list(data['category_mean_score'].keys())
+    avg_scores = list(data['category_mean_score'].values())
+    
+    bars = ax3.barh(categories, avg_scores, color='mediumseagreen')
+    ax3.set_xlabel('Средний скор', fontsize=11)
+    ax3.set_title('📈 Средний скор по категориям', fontsize=12, fontweight='bold')
+    
+    for i, bar in enumerate(bars):
+        width = bar.get_width()
+        ax3.text(width + 0.01, bar.get_y() + bar.get_height()/2,
+                f'{width:.2f}',
+                ha='left', va='center', fontsize=9)
+    
+    # 4. Diversity Score
+    ax4 = axes[1, 1]
+    edges = data['diversity_edges']
+    
+    ax4.hist(edges[:-1], bins=edges, weights=data['diversity_hist'],
+             color='plum', edgecolor='black', alpha=0.7)
+    ax4.set_xlabel('Diversity Score', fontsize=11)
+    ax4.set_ylabel('Количество пользователей', fontsize=11)
+    ax4.set_title('🌈 Разнообразие рекомендаций', fontsize=12, fontweight='bold')
+    ax4.axvline(data['mean_diversity'], color='darkviolet', linestyle='--',
+               label=f"Среднее: {data['mean_diversity']:.2f}")
+    ax4.legend()
+    
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+_RENDERERS = {
+    'product_coverage': _render_product_coverage,
+    'user_segments': _render_user_segments,
+    'recommendation_quality': _render_recommendation_quality,
+}
+
+
+def _render(name, data, path, dpi):
+    _RENDERERS[name](data, path, dpi)
+    return path
+
+
+def _inputs_hash(data, dpi):
+    """Хэш входных агрегатов графика (и dpi): не изменился — картинку можно не перерисовывать"""
+    payload = json.dumps({'data': data, 'dpi': dpi}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
 class RecommenderVisualizer:
     """
-    Визуализация результатов рекомендательной системы
+    Визуализация результатов рекомендательной системы.
+    Графики рисуются только по агрегатам (RecommendationSummary и сегменты пользователей),
+    в output_dir; render_report — параллельно в процессах с пропуском неизменившихся графиков
     """
     
-    def __init__(self, features_df, models_dir='models'):
+    def __init__(self, features_df, models_dir='models', output_dir='.', dpi=300):
         self.features_df = features_df
+        self.output_dir = output_dir
+        self.dpi = dpi
         
         # Загружаем метаданные
         with open(f'{models_dir}/recommender_meta.pkl', 'rb') as f:
             meta = pickle.load(f)
             self.product_catalog = meta['product_catalog']
-    
-    def plot_product_coverage(self, recommendations_list):
+
+        self.summary = None  # агрегаты последней выдачи (RecommendationSummary)
+        self._summary_source = None
+        self._segments = None  # агрегаты сегментов: features_df не меняется — считаем один раз
+
+    def summarize(self, recommendations, n_users=None):
+        """
+        Считаем все агрегаты отчета один раз. recommendations — RecommendationBatch,
+        Arrow-таблица/DataFrame (user_id, rank, product_id, category, score) или список списков Recommendation
+        """
+        self.summary = RecommendationSummary.from_recommendations(recommendations, len(self.product_catalog), n_users)
+        self._summary_source = recommendations
+        return self.summary
+
+    def _get_summary(self, recommendations=None):
+        """Агрегаты для графика: готовая сводка, кэш для той же выдачи или новый подсчет"""
+        if isinstance(recommendations, RecommendationSummary):
+            return recommendations
+        if recommendations is None or recommendations is self._summary_source:
+            if self.summary is None:
+                raise ValueError("Нет данных для отчета: сначала вызовите summarize(recommendations)")
+            return self.summary
+        return self.summarize(recommendations)
+
+    def segments(self):
+        if self._segments is None:
+            self._segments = segment_summary(self.features_df)
+        return self._segments
+
+    def plot_inputs(self, names=PLOTS, recommendations=None):
+        """Входные агрегаты графиков: имя -> JSON-совместимый словарь"""
+        inputs = {}
+        summary = None
+        for name in names:
+            if name == 'user_segments':
+                inputs[name] = self.segments()
+                continue
+            if summary is None:
+                summary = self._get_summary(recommendations).to_dict()
+            inputs[name] = {field: summary[field] for field in PLOT_FIELDS[name]}
+        return inputs
+
+    def _plot_path(self, name):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f'{name}.png')
+
+    def _plot(self, name, recommendations=None):
+        data = self.plot_inputs([name], recommendations)[name]
+        path = _render(name, data, self._plot_path(name), self.dpi)
+        print(f"💾 Сохранено: {path}")
+
+    def plot_product_coverage(self, recommendations=None):
         """
         График покрытия продуктов
         """
-        # Собираем все рекомендации
-        all_products = [p for recs in recommendations_list for p, _ in recs]
-        product_counts = Counter(all_products)
-        
-        # Сортируем
-        products_sorted = sorted(product_counts.items(), key=lambda x: x[1], reverse=True)
-        
-        # Рисуем
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
-        
-        # График 1: Топ-30 продуктов
-        top_products = products_sorted[:30]
-        names = [p[0][:25] for p in top_products]
-        counts = [p[1] for p in top_products]
-        
-        bars = ax1.barh(range(len(names)), counts, color='steelblue')
-        ax1.set_yticks(range(len(names)))
-        ax1.set_yticklabels(names, fontsize=8)
-        ax1.set_xlabel('Количество рекомендаций', fontsize=11)
-        ax1.set_title('📊 Топ-30 рекомендуемых продуктов', fontsize=13, fontweight='bold')
-        ax1.invert_yaxis()
-        
-        # Добавляем значения
-        for i, bar in enumerate(bars):
-            width = bar.get_width()
-            ax1.text(width + 0.5, bar.get_y() + bar.get_height()/2, 
-                    f'{int(width)}', ha='left', va='center', fontsize=8)
-        
-        # График 2: Распределение по категориям
-        category_counts = {}
-        for product, count in product_counts.items():
-            cat = self.product_catalog[product]['category']
-            category_counts[cat] = category_counts.get(cat, 0) + count
-        
-        categories = list(category_counts.keys())
-        cat_counts = list(category_counts.values())
-        
-        colors = plt.cm.Set3(range(len(categories)))
-        wedges, texts, autotexts = ax2.pie(
-            cat_counts, 
-            labels=categories,
-            autopct='%1.1f%%',
-            startangle=90,
-            colors=colors
-        )
-        
-        for text in texts:
-            text.set_fontsize(10)
-        for autotext in autotexts:
-            autotext.set_fontsize(9)
-            autotext.set_fontweight('bold')
-        
-        ax2.set_title('📈 Распределение по категориям', fontsize=13, fontweight='bold')
-        
-        plt.tight_layout()
-        plt.savefig('product_coverage.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        print("💾 Сохранено: product_coverage.png")
-    
+        self._plot('product_coverage', recommendations)
+
     def plot_user_segments(self):
         """
         Сегментация пользователей
         """
-        fig, axes = plt.subplots(2, 2, figsize=(14, 10))
-        
-        # 1. Распределение активности
-        ax1 = axes[0, 0]
-        activity_levels = pd.cut(
-            self.features_df['market_events'],
-            bins=[0, 30, 80, 150, 1000],
-            labels=['Низкая', 'Средняя', 'Высокая', 'Очень высокая']
-        )
-        activity_counts = activity_levels.value_counts()
-        
-        bars = ax1.bar(activity_counts.index, activity_counts.values, color='coral')
-        ax1.set_xlabel('Уровень активности', fontsize=11)
-        ax1.set_ylabel('Количество пользователей', fontsize=11)
-        ax1.set_title('👥 Распределение по активности', fontsize=12, fontweight='bold')
-        
-        for bar in bars:
-            height = bar.get_height()
-            ax1.text(bar.get_x() + bar.get_width()/2., height,
-                    f'{int(height)}',
-                    ha='center', va='bottom', fontsize=10)
-        
-        # 2. Интересы пользователей
-        ax2 = axes[0, 1]
-        interests = pd.DataFrame({
-            'Технологии': self.features_df['tech_interest_ratio'],
-            'Спорт': self.features_df['sports_interest_ratio'],
-            'Недвижимость': self.features_df['home_interest_ratio']
-        })
-        
-        interests.boxplot(ax=ax2, patch_artist=True)
-        ax2.set_ylabel('Уровень интереса', fontsize=11)
-        ax2.set_title('🎯 Распределение интересов', fontsize=12, fontweight='bold')
-        ax2.set_xticklabels(interests.columns, rotation=15, ha='right')
-        
-        # 3. Вовлеченность
-        ax3 = axes[1, 0]
-        engagement_data = [
-            self.features_df['engagement_ratio'].dropna(),
-            self.features_df['offers_engagement_ratio'].dropna(),
-            self.features_df['retail_purchase_intent'].dropna()
-        ]
-        
-        bp = ax3.boxplot(engagement_data, labels=['Маркетплейс', 'Офферы', 'Покупки'],
-                        patch_artist=True)
-        
-        for patch in bp['boxes']:
-            patch.set_facecolor('lightblue')
-        
-        ax3.set_ylabel('Коэффициент вовлеченности', fontsize=11)
-        ax3.set_title('💡 Вовлеченность пользователей', fontsize=12, fontweight='bold')
-        ax3.set_xticklabels(['Маркетплейс', 'Офферы', 'Покупки'], rotation=15, ha='right')
-        
-        # 4. Корреляция активности и вовлеченности
-        ax4 = axes[1, 1]
-        
-        # Фильтруем выбросы
-        data = self.features_df[
-            (self.features_df['market_events'] < 200) &
-            (self.features_df['offers_engagement'] < 20)
-        ]
-        
-        scatter = ax4.scatter(
-            data['market_events'],
-            data['offers_engagement'],
-            c=data['engagement_ratio'],
-            cmap='viridis',
-            alpha=0.6,
-            s=30
-        )
-        
-        ax4.set_xlabel('Активность в маркетплейсе', fontsize=11)
-        ax4.set_ylabel('Вовлеченность в офферы', fontsize=11)
-        ax4.set_title('🔗 Корреляция активности', fontsize=12, fontweight='bold')
-        
-        plt.colorbar(scatter, ax=ax4, label='Engagement Ratio')
-        
-        plt.tight_layout()
-        plt.savefig('user_segments.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        print("💾 Сохранено: user_segments.png")
-    
-    def plot_recommendation_quality(self, recommendations_list):
+        self._plot('user_segments')
+
+    def plot_recommendation_quality(self, recommendations=None):
         """
         Качество рекомендаций
         """
-        fig, axes = plt.subplots(2, 2, figsize=(14, 10))
-        
-        # 1. Распределение количества рекомендаций на пользователя
-        ax1 = axes[0, 0]
-        rec_counts = [len(recs) for recs in recommendations_list]
-        
-        ax1.hist(rec_counts, bins=range(1, 12), color='skyblue', edgecolor='black', alpha=0.7)
-        ax1.set_xlabel('Количество рекомендаций', fontsize=11)
-        ax1.set_ylabel('Количество пользователей', fontsize=11)
-        ax1.set_title('📊 Распределение рекомендаций', fontsize=12, fontweight='bold')
-        ax1.axvline(np.mean(rec_counts), color='red', linestyle='--', 
-                   label=f'Среднее: {np.mean(rec_counts):.1f}')
-        ax1.legend()
-        
-        # 2. Распределение скоров
-        ax2 = axes[0, 1]
-        all_scores = [score for recs in recommendations_list for _, data in recs for score in [data['score']]]
-        
-        ax2.hist(all_scores, bins=30, color='lightcoral', edgecolor='black', alpha=0.7)
-        ax2.set_xlabel('Скор рекомендации', fontsize=11)
-        ax2.set_ylabel('Частота', fontsize=11)
-        ax2.set_title('🎯 Распределение скоров', fontsize=12, fontweight='bold')
-        ax2.axvline(np.median(all_scores), color='green', linestyle='--',
-                   label=f'Медиана: {np.median(all_scores):.2f}')
-        ax2.legend()
-        
-        # 3. Топ категорий по скорам
-        ax3 = axes[1, 0]
-        category_scores = {}
-        for recs in recommendations_list:
-            for product, data in recs:
-                cat = data['category']
-                if cat not in category_scores:
-                    category_scores[cat] = []
-                category_scores[cat].append(data['score'])
-        
-        categories = list(category_scores.keys())
-        avg_scores = [np.mean(category_scores[cat]) for cat in categories]
-        
-        bars = ax3.barh(categories, avg_scores, color='mediumseagreen')
-        ax3.set_xlabel('Средний скор', fontsize=11)
-        ax3.set_title('📈 Средний скор по категориям', fontsize=12, fontweight='bold')
-        
-        for i, bar in enumerate(bars):
-            width = bar.get_width()
-            ax3.text(width + 0.01, bar.get_y() + bar.get_height()/2,
-                    f'{width:.2f}',
-                    ha='left', va='center', fontsize=9)
-        
-        # 4. Diversity Score
-        ax4 = axes[1, 1]
-        user_diversity = []
-        
-        for recs in recommendations_list:
-            categories_in_recs = set(data['category'] for _, data in recs)
-            diversity = len(categories_in_recs) / max(1, len(recs))
-            user_diversity.append(diversity)
-        
-        ax4.hist(user_diversity, bins=20, color='plum', edgecolor='black', alpha=0.7)
-        ax4.set_xlabel('Diversity Score', fontsize=11)
-        ax4.set_ylabel('Количество пользователей', fontsize=11)
-        ax4.set_title('🌈 Разнообразие рекомендаций', fontsize=12, fontweight='bold')
-        ax4.axvline(np.mean(user_diversity), color='darkviolet', linestyle='--',
-                   label=f'Среднее: {np.mean(user_diversity):.2f}')
-        ax4.legend()
-        
-        plt.tight_layout()
-        plt.savefig('recommendation_quality.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        print("💾 Сохранено: recommendation_quality.png")
+        self._plot('recommendation_quality', recommendations)
+
+    def render_report(self, names=PLOTS, workers=1, force=False):
+        """
+        Все графики отчета: входы хэшируются, графики с прежним хэшем (и существующим файлом)
+        пропускаются, остальные рисуются параллельно в процессах (backend Agg).
+        Возвращает {имя: путь} перерисованных графиков
+        """
+        inputs = self.plot_inputs(names)
+        hash_path = os.path.join(self.output_dir, HASH_FILE)
+        hashes = {}
+        if not force and os.path.exists(hash_path):
+            with open(hash_path, encoding='utf-8') as f:
+                hashes = json.load(f)
+
+        todo = {}
+        for name, data in inputs.items():
+            digest = _inputs_hash(data, self.dpi)
+            if hashes.get(name) == digest and os.path.exists(self._plot_path(name)):
+                print(f"⏭️  Без изменений: {self._plot_path(name)}")
+                continue
+            todo[name] = digest
+
+        rendered = {}
+        args = [(name, inputs[name], self._plot_path(name), self.dpi) for name in todo]
+        if workers > 1 and len(args) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(args))) as pool:
+                paths = list(pool.map(_render, *zip(*args)))
+        else:
+            paths = [_render(*arg) for arg in args]
+        for name, path in zip(todo, paths):
+            rendered[name] = path
+            hashes[name] = todo[name]
+            print(f"💾 Сохранено: {path}")
+
+        if rendered:
+            tmp_path = hash_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(hashes, f, indent=2)
+            os.replace(tmp_path, hash_path)
+        return rendered
+
+    def export_aggregates(self, fmt='json'):
+        """
+        Агрегаты отчета вместо картинок (для дашбордов): fmt='json' — один report_aggregates.json,
+        fmt='csv' — по файлу на таблицу. Возвращает список путей
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary = self._get_summary().to_dict()
+        segments = self.segments()
+
+        if fmt == 'json':
+            path = os.path.join(self.output_dir, 'report_aggregates.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'recommendations': summary, 'segments': segments}, f, ensure_ascii=False, indent=2)
+            paths = [path]
+        elif fmt == 'csv':
+            tables = {
+                'summary': pd.DataFrame([{
+                    key: summary[key] for key in ('n_users', 'catalog_size', 'total_recs', 'unique_products',
+                                                  'mean_recs', 'mean_diversity')
+                } | summary['score_stats']]),
+                'product_counts': pd.DataFrame(list(summary['product_counts'].items()), columns=['product_id', 'count']),
+                'category_stats': pd.DataFrame({
+                    'category': list(summary['category_counts']),
+                    'count': list(summary['category_counts'].values()),
+                    'mean_score': [summary['category_mean_score'][c] for c in summary['category_counts']],
+                }),
+                'recs_per_user': pd.DataFrame({
+                    'recommendations': range(len(summary['recs_per_user_counts'])),
+                    'users': summary['recs_per_user_counts'],
+                }),
+                'score_hist': pd.DataFrame({
+                    'left': summary['score_edges'][:-1], 'right': summary['score_edges'][1:], 'count': summary['score_hist'],
+                }),
+                'diversity_hist': pd.DataFrame({
+                    'left': summary['diversity_edges'][:-1], 'right': summary['diversity_edges'][1:],
+                    'count': summary['diversity_hist'],
+                }),
+                'activity': pd.DataFrame(list(segments['activity'].items()), columns=['activity', 'users']),
+            }
+            paths = []
+            for table_name, table in tables.items():
+                path = os.path.join(self.output_dir, f'{table_name}.csv')
+                table.to_csv(path, index=False)
+                paths.append(path)
+        else:
+            raise ValueError(f"Неизвестный формат экспорта: {fmt} (json или csv)")
+
+        for path in paths:
+            print(f"💾 Сохранено: {path}")
+        return paths
     
-    def generate_summary_report(self, recommendations_list):
+    def generate_summary_report(self, recommendations=None):
         """
-        Генерируем итоговый отчет
+        Генерируем итоговый отчет (по агрегатам сводки)
         """
+        summary = self._get_summary(recommendations)
+        total_recs = summary.total_recs
+        stats = summary.score_stats
+
         print("\n" + "="*80)
         print("📋 ИТОГОВЫЙ ОТЧЕТ ПО РЕКОМЕНДАТЕЛЬНОЙ СИСТЕМЕ")
         print("="*80)
         
         # 1. Общая статистика
-        total_users = len(self.features_df)
-        total_recs = sum(len(recs) for recs in recommendations_list)
-        avg_recs = total_recs / total_users
-        
         print(f"\n📊 ОБЩАЯ СТАТИСТИКА:")
-        print(f"   Пользователей проанализировано: {total_users:,}")
+        print(f"   Пользователей проанализировано: {summary.n_users:,}")
         print(f"   Всего рекомендаций выдано: {total_recs:,}")
-        print(f"   Среднее на пользователя: {avg_recs:.2f}")
+        print(f"   Среднее на пользователя: {summary.mean_recs:.2f}")
         
         # 2. Покрытие продуктов
-        all_products = [p for recs in recommendations_list for p, _ in recs]
-        unique_products = set(all_products)
-        total_available = len(self.product_catalog)
+        coverage = summary.unique_products / max(summary.catalog_size, 1)
         
         print(f"\n🎯 ПОКРЫТИЕ ПРОДУКТОВ:")
-        print(f"   Уникальных продуктов рекомендовано: {len(unique_products)}/{total_available}")
-        print(f"   Процент покрытия: {len(unique_products)/total_available*100:.1f}%")
+        print(f"   Уникальных продуктов рекомендовано: {summary.unique_products}/{summary.catalog_size}")
+        print(f"   Процент покрытия: {coverage*100:.1f}%")
         
         # 3. Топ продуктов
-        product_counts = Counter(all_products)
-        top_10 = product_counts.most_common(10)
-        
         print(f"\n🔝 ТОП-10 РЕКОМЕНДУЕМЫХ ПРОДУКТОВ:")
-        for i, (product, count) in enumerate(top_10, 1):
+        top_10 = summary.product_counts[summary.product_counts > 0].iloc[:10]
+        for i, (product, count) in enumerate(top_10.items(), 1):
             pct = count / total_recs * 100
             print(f"   {i:2}. {product:35} : {count:5} ({pct:5.2f}%)")
         
         # 4. Распределение по категориям
-        category_counts = {}
-        for product, count in product_counts.items():
-            cat = self.product_catalog[product]['category']
-            category_counts[cat] = category_counts.get(cat, 0) + count
-        
         print(f"\n📈 РАСПРЕДЕЛЕНИЕ ПО КАТЕГОРИЯМ:")
-        for cat, count in sorted(category_counts.items(), key=lambda x: x[1], reverse=True):
+        for cat, count in summary.category_counts[summary.category_counts > 0].items():
             pct = count / total_recs * 100
             print(f"   {cat:20} : {count:6} ({pct:5.2f}%)")
         
         # 5. Качество
-        all_scores = [score for recs in recommendations_list for _, data in recs for score in [data['score']]]
-        
         print(f"\n⭐ КАЧЕСТВО РЕКОМЕНДАЦИЙ:")
-        print(f"   Средний скор: {np.mean(all_scores):.3f}")
-        print(f"   Медианный скор: {np.median(all_scores):.3f}")
-        print(f"   Мин/Макс скор: {np.min(all_scores):.3f} / {np.max(all_scores):.3f}")
+        print(f"   Средний скор: {stats['mean']:.3f}")
+        print(f"   Медианный скор: {stats['median']:.3f}")
+        print(f"   Мин/Макс скор: {stats['min']:.3f} / {stats['max']:.3f}")
         
         # 6. Diversity
-        user_diversity = []
-        for recs in recommendations_list:
-            categories_in_recs = set(data['category'] for _, data in recs)
-            diversity = len(categories_in_recs) / max(1, len(recs))
-            user_diversity.append(diversity)
-        
         print(f"\n🌈 РАЗНООБРАЗИЕ:")
-        print(f"   Средний Diversity Score: {np.mean(user_diversity):.3f}")
+        print(f"   Средний Diversity Score: {summary.mean_diversity:.3f}")
         print(f"   (1.0 = максимальное разнообразие)")
         
         # 7. Бизнес-метрики
         print(f"\n💼 БИЗНЕС-ЦЕННОСТЬ:")
-        print(f"   ✅ Система покрывает {len(unique_products)/total_available*100:.0f}% каталога")
-        print(f"   ✅ Средняя релевантность: {np.mean(all_scores):.1%}")
-        print(f"   ✅ Разнообразие категорий: {np.mean(user_diversity):.1%}")
-        
-        high_quality = sum(1 for s in all_scores if s > 0.3) / len(all_scores) * 100
-        print(f"   ✅ Доля высококачественных рекомендаций (>0.3): {high_quality:.1f}%")
+        print(f"   ✅ Система покрывает {coverage*100:.0f}% каталога")
+        print(f"   ✅ Средняя релевантность: {stats['mean']:.1%}")
+        print(f"   ✅ Разнообразие категорий: {summary.mean_diversity:.1%}")
+        print(f"   ✅ Доля высококачественных рекомендаций (>0.3): {stats['high_quality_share']*100:.1f}%")
         
         print("\n" + "="*80)
 
@@ -331,67 +473,84 @@ class RecommenderVisualizer:
 # ===================
 # ЗАПУСК ВИЗУАЛИЗАЦИИ
 # ===================
+def _init_worker(models_dir):
+    global _worker_recommender
+    if _worker_recommender is not None:
+        _worker_recommender.close()
+    _worker_recommender = MultiProductRecommender.load(models_dir)
+    _worker_recommender.use_fused_engine()
+
+
+def _score_shard(features_df, top_n, min_score):
+    return _worker_recommender.recommend_batch(features_df, top_n=top_n, explain=False, min_score=min_score)
+
+
+def score_sample(features_df, models_dir='models', top_n=7, min_score=0.05, workers=1):
+    """
+    Рекомендации для выборки одним пакетным вызовом; workers > 1 — выборка делится на шарды
+    по процессам (модели загружаются один раз на воркер), результаты склеиваются в исходном порядке
+    """
+    if workers <= 1 or len(features_df) < 2 * workers:
+        _init_worker(models_dir)
+        return _score_shard(features_df, top_n, min_score)
+
+    bounds = np.linspace(0, len(features_df), workers + 1).astype(int)
+    shards = [features_df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(models_dir,)) as pool:
+        batches = list(pool.map(_score_shard, shards, [top_n] * workers, [min_score] * workers))
+    return RecommendationBatch.concat(batches)
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Визуализации и итоговый отчет по выдаче рекомендаций')
+    parser.add_argument('--features', default='user_features_enhanced.pq')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--sample-size', type=int, default=500, help='пользователей в отчете (0 — все)')
+    parser.add_argument('--top-n', type=int, default=7)
+    parser.add_argument('--min-score', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=1, help='процессов для скоринга выборки')
+    parser.add_argument('--output-dir', default='.', help='куда сохранять графики и агрегаты')
+    parser.add_argument('--format', choices=['png', 'json', 'csv'], default='png',
+                        help='png — графики, json/csv — только агрегаты для дашбордов')
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--render-workers', type=int, default=1, help='процессов для отрисовки графиков')
+    parser.add_argument('--force', action='store_true', help='перерисовать графики без проверки хэшей')
+    args = parser.parse_args()
+
     print("📊 ГЕНЕРАЦИЯ ВИЗУАЛИЗАЦИЙ И ОТЧЕТОВ")
     print("="*80)
     
     # Загружаем данные
-    features_df = pd.read_parquet('user_features_enhanced.pq')
+    features_df = pd.read_parquet(args.features)
     
-    visualizer = RecommenderVisualizer(features_df)
+    visualizer = RecommenderVisualizer(features_df, args.models_dir, args.output_dir, args.dpi)
     
-    # Генерируем тестовые рекомендации
+    # Генерируем рекомендации: вся выборка — одним пакетным вызовом (или по шардам в процессах)
     print("\n🔄 Генерируем рекомендации для анализа...")
+    sample_size = len(features_df) if args.sample_size <= 0 else min(args.sample_size, len(features_df))
+    sample_df = features_df.iloc[:sample_size]
+    
+    start = time.perf_counter()
+    recommendations = score_sample(sample_df, args.models_dir, args.top_n, args.min_score, args.workers)
+    print(f"✅ Сгенерировано рекомендаций для {sample_size:,} пользователей "
+          f"за {time.perf_counter() - start:.1f} с (процессов: {max(args.workers, 1)})")
+    
+    # Агрегаты — один раз, графики и отчет читают их из сводки
+    visualizer.summarize(recommendations, n_users=sample_size)
     
-    from src.src.src_05_multi_product_recommender import MultiProductRecommender
-    recommender = MultiProductRecommender()
-    
-    # Загружаем модели (упрощенно)
-    with open('models/recommender_meta.pkl', 'rb') as f:
-        meta = pickle.load(f)
-    recommender.all_products = meta['all_products']
-    recommender.feature_names = meta['feature_names']
-    recommender.product_catalog = meta['product_catalog']
-    
-    with open('models/scaler.pkl', 'rb') as f:
-        recommender.scaler = pickle.load(f)
-    
-    # Загружаем модели
-    import xgboost as xgb
-    recommender.models = {}
-    for product in recommender.all_products:
-        try:
-            model = xgb.XGBClassifier()
-            model.load_model(f'models/model_{product}.json')
-            recommender.models[product] = model
-        except:
-            pass
-    
-    # Генерируем рекомендации
-    sample_size = min(500, len(features_df))
-    recommendations_list = []
-    
-    for i in range(sample_size):
-        user = features_df.iloc[i].to_dict()
-        recs = recommender.recommend(user, top_n=7, min_score=0.05)
-        recommendations_list.append(recs)
-    
-    print(f"✅ Сгенерировано рекомендаций для {sample_size} пользователей")
-    
-    # Визуализации
-    print("\n📊 Создаем графики...")
-    visualizer.plot_product_coverage(recommendations_list)
-    visualizer.plot_user_segments()
-    visualizer.plot_recommendation_quality(recommendations_list)
+    # Визуализации (или только агрегаты)
+    if args.format == 'png':
+        print("\n📊 Создаем графики...")
+        visualizer.render_report(workers=args.render_workers, force=args.force)
+    else:
+        print(f"\n📄 Сохраняем агрегаты ({args.format})...")
+        visualizer.export_aggregates(args.format)
     
     # Отчет
-    visualizer.generate_summary_report(recommendations_list)
+    visualizer.generate_summary_report()
     
-    print("\n✅ ВСЕ ВИЗУАЛИЗАЦИИ ГОТОВЫ!")
-    print("   - product_coverage.png")
-    print("   - user_segments.png")
-    print("   - recommendation_quality.png")
+    print(f"\n✅ ВСЕ ВИЗУАЛИЗАЦИИ ГОТОВЫ! (папка {args.output_dir})")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,374 @@
+# src/08_benchmark.py
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib
+import contextlib
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.multi_product_recommender import MultiProductRecommender
+from src.scoring_engine import FusedScoringEngine
+from src.model_store import PACK_FILE, pack_models_dir
+from src.feature_schema import scale_inplace
+
+
+def make_synthetic_users(base_df, n_users, seed=42):
+    """
+    Синтетическая выборка нужного размера (сэмплирование строк с возвращением)
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(base_df), size=n_users)
+    return base_df.iloc[idx].reset_index(drop=True)
+
+
+def bench_recommend_batch(recommender, base_df, sizes=(10_000, 100_000, 1_000_000), top_n=5, loop_sample=500):
+    """
+    Сравнение recommend() в цикле и recommend_batch() на разных объемах.
+    Время цикла на больших объемах экстраполируется по выборке из loop_sample пользователей
+    """
+    print("\n" + "="*80)
+    print("⏱️  БЕНЧМАРК: recommend() в цикле vs recommend_batch()")
+    print("="*80)
+
+    # Поштучный режим: измеряем на небольшой выборке
+    sample = make_synthetic_users(base_df, loop_sample).to_dict('records')
+    start = time.perf_counter()
+    for user in sample:
+        recommender.recommend(user, top_n=top_n)
+    per_user = (time.perf_counter() - start) / len(sample)
+
+    results = []
+    for n_users in sizes:
+        users_df = make_synthetic_users(base_df, n_users)
+
+        start = time.perf_counter()
+        recommender.recommend_batch(users_df, top_n=top_n)
+        batch_time = time.perf_counter() - start
+
+        loop_time = per_user * n_users
+        results.append({
+            'users': n_users,
+            'loop_sec': loop_time,
+            'batch_sec': batch_time,
+            'speedup': loop_time / batch_time
+        })
+        print(f"   {n_users:>9,} польз. | цикл ~{loop_time:9.1f} с | батч {batch_time:8.2f} с | ускорение x{loop_time / batch_time:.0f}")
+
+    print(f"\n   (время цикла экстраполировано по {loop_sample} пользователям: {per_user * 1000:.2f} мс/польз.)")
+    return results
+
+
+def bench_single_user_latency(recommender, base_df, n_requests=1000, top_n=5):
+    """
+    Латентность одного запроса recommend(): по моделям и через единый движок (p50/p99)
+    """
+    print("\n" + "="*80)
+    print("⏱️  БЕНЧМАРК: латентность одного пользователя")
+    print("="*80)
+
+    users = make_synthetic_users(base_df, n_requests).to_dict('records')
+    engine = recommender.engine
+
+    results = {}
+    for mode, mode_engine in [('models', None), ('fused', engine or FusedScoringEngine.from_models(recommender.models))]:
+        recommender.engine = mode_engine
+        latencies = []
+        for user in users:
+            start = time.perf_counter()
+            recommender.recommend(user, top_n=top_n)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        results[mode] = {'p50_ms': p50, 'p99_ms': p99}
+        print(f"   {mode:8} | p50 {p50:7.2f} мс | p99 {p99:7.2f} мс")
+
+    recommender.engine = engine
+    return results
+
+
+def bench_cold_start(models_dir='models', features_path='user_features_enhanced.pq'):
+    """
+    Холодный старт: загрузка артефактов + первый запрос, JSON-модели vs упакованный файл
+    """
+    print("\n" + "="*80)
+    print("⏱️  БЕНЧМАРК: холодный старт")
+    print("="*80)
+
+    user = pd.read_parquet(features_path).iloc[0].to_dict()
+    pack_path = os.path.join(models_dir, PACK_FILE)
+
+    results = {}
+    for mode in ['json', 'pack']:
+        if mode == 'pack' and not os.path.exists(pack_path):
+            pack_models_dir(models_dir)
+        hidden = f'{pack_path}.hidden'
+        if mode == 'json' and os.path.exists(pack_path):
+            os.replace(pack_path, hidden)
+        try:
+            start = time.perf_counter()
+            recommender = MultiProductRecommender.load(models_dir)
+            load_ms = (time.perf_counter() - start) * 1000
+            recommender.recommend(user, top_n=5)
+            first_ms = (time.perf_counter() - start) * 1000
+            recommender.close()
+        finally:
+            if os.path.exists(hidden):
+                os.replace(hidden, pack_path)
+        results[mode] = {'load_ms': load_ms, 'first_request_ms': first_ms}
+        print(f"   {mode:5} | загрузка {load_ms:7.1f} мс | до первого ответа {first_ms:7.1f} мс")
+
+    return results
+
+
+def _legacy_prepare_features(features_df, feature_names):
+    """Прежняя подготовка фичей: копия DataFrame, pd.to_numeric по колонкам, fillna"""
+    X = features_df.copy()
+    for col in X.columns:
+        X[col] = pd.to_numeric(X[col], errors='coerce')
+    return X.reindex(columns=feature_names).fillna(0)
+
+
+def bench_feature_preparation(recommender, base_df, n_rows=100_000, repeats=3):
+    """
+    Подготовка фичей: прежний путь через DataFrame vs FeatureSchema.transform
+    для DataFrame, Arrow-таблицы и списка словарей. Время и пик выделенной памяти на 1000 строк
+    """
+    print("\n" + "="*80)
+    print("⏱️  БЕНЧМАРК: подготовка фичей (на 1000 строк)")
+    print("="*80)
+
+    users_df = make_synthetic_users(base_df, n_rows)
+    schema = recommender.feature_schema
+    cases = [
+        ('legacy DataFrame', lambda: _legacy_prepare_features(users_df, recommender.feature_names)),
+        ('schema DataFrame', lambda: schema.transform(users_df)),
+        ('schema Arrow', lambda: schema.transform(table)),
+        ('schema records', lambda: schema.transform(records)),
+    ]
+    table = pa.Table.from_pandas(users_df, preserve_index=False)
+    records = users_df.iloc[:10_000].to_dict('records')
+
+    results = {}
+    for name, prepare in cases:
+        rows = len(records) if name == 'schema records' else n_rows
+        start = time.perf_counter()
+        for _ in range(repeats):
+            prepare()
+        elapsed = (time.perf_counter() - start) / repeats
+
+        tracemalloc.start()
+        prepare()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        per_1k_ms = elapsed * 1000 / rows * 1000
+        per_1k_kb = peak / rows * 1000 / 1024
+        results[name] = {'ms_per_1k': per_1k_ms, 'peak_kb_per_1k': per_1k_kb}
+        print(f"   {name:17} | {per_1k_ms:8.3f} мс | пик памяти {per_1k_kb:8.1f} КБ")
+
+    return results
+
+
+# ===================
+# НАБОР БЕНЧМАРКОВ С БАЗОВОЙ ЛИНИЕЙ
+# ===================
+def make_schema_users(n_users, schema_path='test_features.csv', seed=42):
+    """
+    Синтетические пользователи по схеме test_features.csv: те же числовые колонки,
+    целые — равномерно в [min, max] колонки, дробные — равномерно в [min, max]
+    """
+    template = pd.read_csv(schema_path)
+    rng = np.random.default_rng(seed)
+
+    columns = {'user_id': np.arange(1, n_users + 1, dtype=np.int64)}
+    for column in template.columns:
+        values = template[column]
+        if column == 'user_id' or not pd.api.types.is_numeric_dtype(values):
+            continue
+        low, high = values.min(), values.max()
+        if pd.api.types.is_integer_dtype(values):
+            columns[column] = rng.integers(low, high + 1, size=n_users)
+        else:
+            columns[column] = rng.uniform(low, high, size=n_users)
+    return pd.DataFrame(columns)
+
+
+def _timed(fn, repeats):
+    """Время каждого из repeats вызовов, мс"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _summary(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'n': len(samples), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'mean_ms': float(np.mean(samples))}
+
+
+def run_suite(models_dir='models', scale=2000, seed=42, repeats=20):
+    """
+    Горячие пути системы на синтетических данных масштаба scale.
+    Возвращает {'meta': ..., 'results': {кейс: {p50_ms, p95_ms, p99_ms, ...}}}
+    """
+    users_df = make_schema_users(scale, seed=seed)
+    records = users_df.to_dict('records')
+    rng = np.random.default_rng(seed)
+    sample = [records[i] for i in rng.integers(0, len(records), size=min(500, len(records)))]
+
+    recommender = MultiProductRecommender.load(models_dir)
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    samples = {}
+
+    print(f"⏱️  Набор бенчмарков: {scale:,} синтетических пользователей, {repeats} повторов")
+
+    # Подготовка фичей (бывший _prepare_features) и таргеты
+    samples['feature_schema.transform'] = _timed(lambda: recommender.feature_schema.transform(users_df), repeats)
+    head = users_df.iloc[:min(500, scale)]
+    with quiet:
+        samples['create_smart_targets[500]'] = _timed(lambda: recommender.create_smart_targets(head), max(3, repeats // 4))
+        samples['create_target_matrix'] = _timed(lambda: recommender.create_target_matrix(users_df), repeats)
+
+    # Обучение: по одной модели на продукт, время каждого продукта — отдельный замер
+    X = scale_inplace(recommender.feature_schema.transform(users_df), recommender.scaler)
+    y = recommender.create_target_matrix(users_df, verbose=False)
+    fit_samples = []
+    for i in range(len(recommender.all_products)):
+        positive = int(y[:, i].sum())
+        if positive < 2:
+            continue
+        start = time.perf_counter()
+        recommender._fit_product_model(X, y[:, i], (len(y) - positive) / (positive + 1))
+        fit_samples.append((time.perf_counter() - start) * 1000)
+    samples['train.per_product'] = fit_samples
+
+    # Онлайн-рекомендации одного пользователя
+    for name, category in [('recommend', None), ('recommend.category', 'cards')]:
+        samples[name] = [t for user in sample for t in _timed(lambda: recommender.recommend(user, 5, category), 1)]
+    with quiet:
+        recommender.use_fused_engine()
+    samples['recommend.fused'] = [t for user in sample for t in _timed(lambda: recommender.recommend(user, 5), 1)]
+
+    # Загрузка моделей демо и цикл main() визуализации
+    demo_module = importlib.import_module('src.06_interactive_demo')
+    visual_module = importlib.import_module('src.07_visualization_report')
+    with quiet:
+        samples['demo.load'] = _timed(lambda: demo_module.RecommenderDemo(models_dir), max(3, repeats // 4))
+        demo = demo_module.RecommenderDemo(models_dir)
+        visualizer = visual_module.RecommenderVisualizer(users_df, models_dir)
+        samples['visualization.recommend'] = [
+            t for user in sample for t in _timed(lambda: demo.recommend(user, top_n=7, min_score=0.05), 1)
+        ]
+        recommendations_list = [demo.recommend(user, top_n=7, min_score=0.05) for user in sample]
+        samples['visualization.report'] = _timed(
+            lambda: visualizer.generate_summary_report(visualizer.summarize(recommendations_list)), max(3, repeats // 4)
+        )
+
+    results = {name: _summary(values) for name, values in samples.items() if values}
+    for name, result in results.items():
+        print(f"   {name:28} | p50 {result['p50_ms']:9.3f} мс | p95 {result['p95_ms']:9.3f} мс | p99 {result['p99_ms']:9.3f} мс")
+
+    meta = {
+        'scale': scale,
+        'seed': seed,
+        'repeats': repeats,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'xgboost': importlib.import_module('xgboost').__version__,
+        'cpu_count': os.cpu_count(),
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare_to_baseline(current, baseline, tolerance=0.5, min_delta_ms=1.0, metric='p50_ms'):
+    """
+    Регрессии относительно базовой линии: кейсы, где metric вырос больше чем на tolerance (доля)
+    и больше чем на min_delta_ms (шум субмиллисекундных замеров не считаем)
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result[metric] / max(base[metric], 1e-9)
+        if ratio > 1 + tolerance and result[metric] - base[metric] > min_delta_ms:
+            regressions.append({'case': name, 'baseline': base[metric], 'current': result[metric], 'ratio': ratio})
+    return regressions
+
+
+def main_suite(args):
+    current = run_suite(args.models_dir, scale=args.scale, seed=args.seed, repeats=args.repeats)
+
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"💾 Результаты: {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"📌 Базовая линия обновлена: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"⚠️  Базовой линии {args.baseline} нет — запустите с --update-baseline")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['meta']['scale'] != current['meta']['scale']:
+        print(f"❌ Базовая линия снята на масштабе {baseline['meta']['scale']:,}, текущий — {current['meta']['scale']:,}")
+        return 1
+
+    regressions = compare_to_baseline(current, baseline, args.tolerance, args.min_delta_ms)
+    if not regressions:
+        print(f"✅ Регрессий нет (порог +{args.tolerance:.0%} к p50)")
+        return 0
+
+    print(f"❌ РЕГРЕССИИ (порог +{args.tolerance:.0%} к p50):")
+    for r in regressions:
+        print(f"   {r['case']:28} | {r['baseline']:9.3f} -> {r['current']:9.3f} мс (x{r['ratio']:.2f})")
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Бенчмарк рекомендательной системы')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--features', default='user_features_enhanced.pq')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='объемы пользователей через запятую')
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--suite', action='store_true',
+                        help='набор бенчмарков на синтетике: JSON с p50/p95/p99 и сравнение с базовой линией')
+    parser.add_argument('--scale', type=int, default=2000, help='пользователей в синтетике (--suite)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='допустимый рост p50 (доля)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='минимальный рост p50 в мс для регрессии')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    if args.suite:
+        sys.exit(main_suite(args))
+
+    bench_cold_start(args.models_dir, args.features)
+
+    recommender = MultiProductRecommender.load(args.models_dir)
+    base_df = pd.read_parquet(args.features)
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    bench_feature_preparation(recommender, base_df)
+    bench_single_user_latency(recommender, base_df, top_n=args.top_n)
+    bench_recommend_batch(recommender, base_df, sizes=sizes, top_n=args.top_n)
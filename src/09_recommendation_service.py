@@ -0,0 +1,339 @@
+# src/09_recommendation_service.py
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.multi_product_recommender import MultiProductRecommender
+from src.instrumentation import PrometheusSink
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+MAX_BODY_BYTES = 1_000_000
+
+
+class QueueFullError(Exception):
+    """Очередь запросов заполнена — клиенту отвечаем 503"""
+
+
+class MicroBatcher:
+    """
+    Собирает одновременные запросы в микробатчи (не больше max_batch_size, ожидание не дольше max_wait_ms)
+    и скорит каждый батч одним векторизованным проходом recommend_batch в рабочем потоке.
+    Пока батч считается, следующие запросы копятся в очереди — под нагрузкой батчи растут сами
+    """
+
+    def __init__(self, recommender, max_batch_size=64, max_wait_ms=5.0, max_queue=1024):
+        self.recommender = recommender
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        # Один поток: модели не делят ядра между батчами, а event loop остается свободным
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scoring')
+        self._worker = None
+
+        self.requests = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.scoring_seconds = 0.0
+
+    def start(self):
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, user_features, top_n=10, category_filter=None, timeout=2.0, explain=True):
+        """
+        Рекомендации для одного пользователя через очередь.
+        QueueFullError — очередь заполнена, asyncio.TimeoutError — не уложились в timeout
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((user_features, top_n, category_filter, future, explain))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError()
+        self.requests += 1
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    async def _collect(self):
+        """Первый запрос ждем сколько угодно, остальные — до max_wait после него"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Запросы, которые уже отвалились по таймауту, не считаем
+            batch = [item for item in batch if not item[3].done()]
+            if not batch:
+                continue
+
+            # Фичи, которых нет в запросе, — 0, как user_features.get(f, 0) в recommend
+            # (from_records оставил бы NaN, и тип и поведение пользователя считались бы иначе)
+            defaults = dict.fromkeys(self.recommender.feature_names, 0)
+
+            # Разные top_n / фильтры / explain — отдельные проходы внутри одного батча
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[1], item[2], item[4]), []).append(item)
+
+            start = time.perf_counter()
+            for (top_n, category_filter, explain), items in groups.items():
+                try:
+                    results = await self._score(items, defaults, top_n, category_filter, explain)
+                except Exception:
+                    # Группа упала — по одному запросу, чтобы ошибка досталась только виновному
+                    for item in items:
+                        try:
+                            result = (await self._score([item], defaults, top_n, category_filter, explain))[0]
+                        except Exception as e:
+                            if not item[3].done():
+                                item[3].set_exception(e)
+                            continue
+                        if not item[3].done():
+                            item[3].set_result(result)
+                    continue
+
+                for item, recommendations in zip(items, results):
+                    if not item[3].done():
+                        item[3].set_result(recommendations)
+
+            self.scoring_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.batched_requests += len(batch)
+
+    async def _score(self, items, defaults, top_n, category_filter, explain):
+        """Один проход recommend_batch по запросам группы в рабочем потоке"""
+        features_df = pd.DataFrame.from_records([{**defaults, **item[0]} for item in items])
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.recommender.recommend_batch, features_df, top_n, category_filter, explain
+        )
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'batches': self.batches,
+            'avg_batch_size': self.batched_requests / self.batches if self.batches else 0.0,
+            'queue_size': self.queue.qsize(),
+            'scoring_seconds': self.scoring_seconds,
+        }
+
+
+class RecommendationService:
+    """
+    HTTP-сервис на asyncio (только стандартная библиотека), keep-alive соединения.
+    POST /recommend  {"user": {...фичи...}, "top_n": 5, "category": "cards", "explain": false}
+    GET  /health, GET /stats, GET /metrics (Prometheus, если у рекомендателя включено инструментирование)
+    """
+
+    def __init__(self, recommender, max_batch_size=64, max_wait_ms=5.0, max_queue=1024, request_timeout=2.0):
+        self.recommender = recommender
+        self.batcher = MicroBatcher(recommender, max_batch_size, max_wait_ms, max_queue)
+        self.request_timeout = request_timeout
+        self.started_at = time.time()
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'malformed request line'}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'malformed Content-Length'}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {'error': 'body too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._route(method, path.split('?', 1)[0], body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok', 'models': len(self.recommender.models)}
+        if path == '/stats':
+            return 200, dict(self.batcher.stats(), uptime_seconds=time.time() - self.started_at)
+        if path == '/metrics':
+            metrics = self.recommender.metrics
+            sink = metrics.find_sink(PrometheusSink) if metrics is not None else None
+            if sink is None:
+                return 404, {'error': 'instrumentation is disabled (start with --metrics)'}
+            return 200, sink.render()
+        if path != '/recommend':
+            return 404, {'error': f'unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+
+        try:
+            request = json.loads(body)
+            user = request['user']
+            top_n = int(request.get('top_n', 10))
+            category_filter = request.get('category')
+            explain = bool(request.get('explain', True))
+            if not isinstance(user, dict):
+                raise TypeError('user must be an object')
+            if top_n < 1:
+                raise ValueError('top_n must be positive')
+            if category_filter is not None and not isinstance(category_filter, str):
+                raise TypeError('category must be a string')
+            bad = [name for name in self.recommender.feature_names
+                   if name in user and not isinstance(user[name], (int, float))]
+            if bad:
+                raise TypeError(f"non-numeric features: {', '.join(bad)}")
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': f'bad request: {e}'}
+
+        try:
+            recommendations = await self.batcher.submit(user, top_n, category_filter, self.request_timeout, explain)
+        except QueueFullError:
+            return 503, {'error': 'queue is full, retry later'}
+        except asyncio.TimeoutError:
+            return 504, {'error': f'timed out after {self.request_timeout} s'}
+        except Exception as e:
+            return 500, {'error': f'scoring failed: {type(e).__name__}: {e}'}
+
+        return 200, {'user_id': user.get('user_id'), 'recommendations': [rec.to_dict() for rec in recommendations]}
+
+    async def _respond(self, writer, status, payload, keep_alive=True):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8'), 'application/json; charset=utf-8'
+        headers = [
+            f'HTTP/1.1 {status} {STATUS_TEXT[status]}',
+            f'Content-Type: {content_type}',
+            f'Content-Length: {len(body)}',
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            headers.append('Retry-After: 1')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(args):
+    recommender = MultiProductRecommender.load(args.models_dir)
+    if not args.no_fused_engine:
+        recommender.use_fused_engine()
+    if args.metrics:
+        recommender.enable_instrumentation([PrometheusSink()])
+
+    service = RecommendationService(
+        recommender,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue=args.max_queue,
+        request_timeout=args.timeout
+    )
+    port = await service.start(args.host, args.port)
+    print(f"🌐 Сервис рекомендаций: http://{args.host}:{port} "
+          f"(батч до {args.max_batch_size}, ожидание {args.max_wait_ms} мс, очередь {args.max_queue})")
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HTTP-сервис рекомендаций с микробатчингом')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--max-queue', type=int, default=1024)
+    parser.add_argument('--timeout', type=float, default=2.0, help='таймаут запроса, с')
+    parser.add_argument('--no-fused-engine', action='store_true')
+    parser.add_argument('--metrics', action='store_true', help='замеры этапов и эндпоинт /metrics')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n👋 Сервис остановлен")
@@ -0,0 +1,140 @@
+# src/10_load_test.py
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+async def _request(reader, writer, host, body):
+    writer.write(
+        f'POST /recommend HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _client(host, port, bodies, deadline, latencies, statuses):
+    """Один клиент с keep-alive соединением: запросы подряд до deadline"""
+    reader, writer = await asyncio.open_connection(host, port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status = await _request(reader, writer, host, bodies[i % len(bodies)])
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] += 1
+            i += 1
+    finally:
+        writer.close()
+
+
+async def _wait_ready(host, port, timeout=60.0, server=None):
+    """Ждем, пока GET /health не ответит 200; прекращаем, если запущенный сервис завершился"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server is not None and server.returncode is not None:
+            return False
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                writer.write(f'GET /health HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+                await writer.drain()
+                if int((await reader.readline()).split()[1]) == 200:
+                    return True
+            finally:
+                writer.close()
+        except (OSError, IndexError, ValueError):
+            pass
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def run_load_test(host, port, users, concurrency=32, duration=10.0, top_n=5):
+    """
+    Нагрузка на /recommend: concurrency клиентов в течение duration секунд.
+    Возвращает пропускную способность, перцентили латентности и коды ответов
+    """
+    bodies = [json.dumps({'user': user, 'top_n': top_n}, default=float).encode('utf-8') for user in users]
+    latencies, statuses = [], Counter()
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        _client(host, port, bodies[k::concurrency] or bodies, deadline, latencies, statuses)
+        for k in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'statuses': dict(statuses),
+    }
+
+
+async def main(args):
+    features_df = pd.read_parquet(args.features)
+    users = features_df.sample(min(args.users, len(features_df)), random_state=42).to_dict('records')
+
+    server = None
+    if args.spawn:
+        # Поднимаем локальный экземпляр сервиса, не блокируя цикл событий
+        server = await asyncio.create_subprocess_exec(
+            sys.executable, 'src/09_recommendation_service.py',
+            '--host', args.host, '--port', str(args.port),
+            '--max-batch-size', str(args.max_batch_size), '--max-wait-ms', str(args.max_wait_ms)
+        )
+
+    try:
+        if not await _wait_ready(args.host, args.port, server=server):
+            print(f"❌ Сервис на {args.host}:{args.port} не отвечает")
+            return
+
+        print(f"🔥 Нагрузка: {args.concurrency} клиентов, {args.duration:.0f} с, http://{args.host}:{args.port}/recommend")
+        result = await run_load_test(args.host, args.port, users, args.concurrency, args.duration, args.top_n)
+
+        print(f"   Запросов: {result['requests']:,} | {result['throughput_rps']:,.0f} запр./с")
+        print(f"   Латентность: p50 {result['p50_ms']:.1f} мс | p95 {result['p95_ms']:.1f} мс | p99 {result['p99_ms']:.1f} мс")
+        print(f"   Коды ответов: {result['statuses']}")
+    finally:
+        if server is not None and server.returncode is None:
+            server.terminate()
+            await server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Нагрузочный тест сервиса рекомендаций')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--features', default='user_features_enhanced.pq')
+    parser.add_argument('--users', type=int, default=1000, help='сколько разных пользователей в запросах')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0, help='длительность, с')
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--spawn', action='store_true', help='запустить локальный сервис на время теста')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
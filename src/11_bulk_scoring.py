@@ -0,0 +1,286 @@
+# src/11_bulk_scoring.py
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.multi_product_recommender import MultiProductRecommender
+from src.model_store import load_artifacts
+
+# Рекомендатель процесса-воркера: модели загружаются один раз при старте воркера
+_worker_recommender = None
+
+
+def _init_worker(models_dir, use_fused_engine):
+    global _worker_recommender
+    if _worker_recommender is not None:
+        _worker_recommender.close()  # повторная инициализация в том же процессе — старый файл моделей закрываем
+    _worker_recommender = MultiProductRecommender.load(models_dir)
+    if use_fused_engine:
+        _worker_recommender.use_fused_engine()
+
+
+def _score_batch(features_df, user_ids, top_n, category_filter):
+    """Границы выдачи по пользователям (offsets) и Arrow-таблица top-N пачки"""
+    batch = _worker_recommender.recommend_batch(features_df, top_n, category_filter, explain=False)
+    return batch.offsets, batch.to_arrow(user_ids)
+
+
+class _InlineResult:
+    """Результат без пула процессов (workers=1) — тот же интерфейс, что у Future"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def _feature_names(models_dir):
+    """Фичи моделей из метаданных (для процесса, который сам не скорит); упакованный файл сразу закрываем"""
+    meta, _, models = load_artifacts(models_dir, strict=False)
+    if hasattr(models, 'close'):
+        models.close()
+    return meta['feature_names']
+
+
+def iter_record_batches(path, batch_size=10_000, skip=0, feature_names=()):
+    """
+    Пачки записей с фичами из JSONL (по объекту на строку, можно {"user": {...}}) или Parquet.
+    skip — сколько записей пропустить (уже обработаны до сбоя). Отдает (смещение первой записи, DataFrame).
+    Фичи из feature_names, которых нет в записи (или колонки нет в файле), — 0, как user_features.get(f, 0)
+    в recommend: иначе from_records оставил бы NaN, и тип и поведение пользователя считались бы иначе
+    """
+    defaults = dict.fromkeys(feature_names, 0)
+    offset = skip
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        records, seen = [], 0
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                seen += 1
+                if seen <= skip:
+                    continue
+                record = json.loads(line)
+                records.append({**defaults, **record.get('user', record)})
+                if len(records) == batch_size:
+                    yield offset, pd.DataFrame.from_records(records)
+                    offset += len(records)
+                    records = []
+        if records:
+            yield offset, pd.DataFrame.from_records(records)
+    else:
+        seen = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            seen += batch.num_rows
+            if seen <= skip:
+                continue
+            features_df = batch.to_pandas()
+            missing = [name for name in defaults if name not in features_df.columns]
+            if missing:
+                features_df = features_df.assign(**dict.fromkeys(missing, 0))
+            if seen - batch.num_rows < skip:
+                features_df = features_df.iloc[skip - (seen - batch.num_rows):].reset_index(drop=True)
+            yield offset, features_df
+            offset += len(features_df)
+
+
+def _user_ids(features_df, offset):
+    """
+    user_id записей как во входе (целые или строки); номер записи во входном файле (стабильный ключ) —
+    только если колонки user_id нет или у записи id не указан
+    """
+    fallback = pd.Series(np.arange(offset, offset + len(features_df)), index=features_df.index)
+    if 'user_id' not in features_df.columns:
+        return fallback.to_numpy()
+    ids = features_df['user_id']
+    if pd.api.types.is_numeric_dtype(ids):
+        return ids.fillna(fallback).to_numpy().astype(np.int64)
+    return ids.where(ids.notna(), fallback).astype(str).to_numpy()
+
+
+class JsonlWriter:
+    """
+    Одна строка на входного пользователя: {"user_id": ..., "recommendations": [...]} в порядке входа
+    (пользователь без рекомендаций — с пустым списком)
+    """
+
+    def __init__(self, path, checkpoint):
+        self.path = path
+        resume_bytes = checkpoint['output_bytes']
+        self.file = open(path, 'r+b' if resume_bytes and os.path.exists(path) else 'wb')
+        # Хвост, дописанный после последнего чекпоинта, отбрасываем
+        self.file.seek(resume_bytes)
+        self.file.truncate()
+
+    def write(self, batch_index, user_ids, offsets, table):
+        columns = table.to_pydict()
+        recs = [self._rec(columns, i) for i in range(table.num_rows)]
+        lines = [
+            {'user_id': user_id, 'recommendations': recs[start:end]}
+            for user_id, start, end in zip(np.asarray(user_ids).tolist(), offsets[:-1], offsets[1:])
+        ]
+        self.file.write(''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines).encode('utf-8'))
+
+    @staticmethod
+    def _rec(columns, i):
+        return {
+            'rank': columns['rank'][i],
+            'product_id': columns['product_id'][i],
+            'category': columns['category'][i],
+            'score': round(columns['score'][i], 6),
+            'probability': round(columns['probability'][i], 6),
+        }
+
+    def position(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetPartsWriter:
+    """Папка с part-файлами по пачкам: part-000000.parquet, ... (готовая пачка не переписывается)"""
+
+    def __init__(self, path, checkpoint):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Части после чекпоинта (недописанные или от прошлого запуска) удаляем
+        for name in os.listdir(path):
+            if name.startswith('part-') and int(name[5:11]) >= checkpoint['batches_done']:
+                os.remove(os.path.join(path, name))
+
+    def write(self, batch_index, user_ids, offsets, table):
+        part = os.path.join(self.path, f'part-{batch_index:06d}.parquet')
+        pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)
+
+    def position(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def _load_checkpoint(path, settings):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['settings'] != settings:
+        raise ValueError(f"Чекпоинт {path} создан с другими параметрами: {checkpoint['settings']} (используйте --restart)")
+    return checkpoint
+
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def bulk_score(input_path, output_path, models_dir='models', top_n=10, category_filter=None,
+               batch_size=10_000, workers=None, use_fused_engine=True, restart=False):
+    """
+    Массовый скоринг: пачки записей -> пул процессов -> top-N -> запись в порядке входа.
+    После каждой записанной пачки сохраняется чекпоинт (записи и байты вывода) — после сбоя
+    повторный запуск продолжает с него
+    """
+    workers = workers or os.cpu_count() or 1
+    checkpoint_path = output_path.rstrip('/') + '.checkpoint.json'
+    settings = {'input': os.path.abspath(input_path), 'batch_size': batch_size, 'top_n': top_n, 'category': category_filter}
+
+    checkpoint = None if restart else _load_checkpoint(checkpoint_path, settings)
+    if checkpoint is None:
+        checkpoint = {'settings': settings, 'records_done': 0, 'batches_done': 0, 'output_bytes': 0, 'complete': False}
+    if checkpoint['complete']:
+        print(f"✅ {output_path} уже готов ({checkpoint['records_done']:,} записей), --restart для пересчета")
+        return checkpoint['records_done']
+    if checkpoint['records_done']:
+        print(f"↩️  Продолжаем с записи {checkpoint['records_done']:,} (пачка {checkpoint['batches_done']})")
+
+    writer_cls = ParquetPartsWriter if output_path.endswith('.parquet') or output_path.endswith('.pq') else JsonlWriter
+    writer = writer_cls(output_path, checkpoint)
+
+    print(f"📦 Массовый скоринг {input_path} -> {output_path} (пачка {batch_size:,}, воркеров {workers})")
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(models_dir, use_fused_engine))
+    else:
+        _init_worker(models_dir, use_fused_engine)
+    feature_names = _worker_recommender.feature_names if pool is None else _feature_names(models_dir)
+
+    start = time.perf_counter()
+    resumed_from = checkpoint['records_done']
+    pending = deque()
+
+    def write_next():
+        batch_index, user_ids, result = pending.popleft()
+        writer.write(batch_index, user_ids, *result.result())
+        checkpoint['records_done'] += len(user_ids)
+        checkpoint['batches_done'] = batch_index + 1
+        checkpoint['output_bytes'] = writer.position()
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+        done = checkpoint['records_done'] - resumed_from
+        elapsed = time.perf_counter() - start
+        print(f"   Обработано {checkpoint['records_done']:,} записей ({done / max(elapsed, 1e-9):,.0f} зап./с)")
+
+    try:
+        batches = iter_record_batches(input_path, batch_size, skip=checkpoint['records_done'],
+                                      feature_names=feature_names)
+        for batch_index, (offset, features_df) in enumerate(batches, start=checkpoint['batches_done']):
+            user_ids = _user_ids(features_df, offset)
+            args = (features_df, user_ids, top_n, category_filter)
+            result = pool.submit(_score_batch, *args) if pool else _InlineResult(_score_batch(*args))
+            pending.append((batch_index, user_ids, result))
+
+            # Не больше 2 пачек на воркера в работе — память ограничена, порядок вывода сохраняется
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+    finally:
+        writer.close()
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    checkpoint['complete'] = True
+    _save_checkpoint(checkpoint_path, checkpoint)
+
+    total = checkpoint['records_done'] - resumed_from
+    elapsed = time.perf_counter() - start
+    print(f"✅ Готово: {total:,} записей за {elapsed:.1f} с ({total / max(elapsed, 1e-9):,.0f} зап./с)")
+    return checkpoint['records_done']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Массовый скоринг JSONL/Parquet с фичами пользователей')
+    parser.add_argument('input', help='JSONL (объект фичей на строку) или Parquet')
+    parser.add_argument('output', help='.jsonl — строка на пользователя, .parquet — папка part-файлов')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--category')
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--workers', type=int, default=None, help='процессов (по умолчанию — число ядер)')
+    parser.add_argument('--no-fused-engine', action='store_true')
+    parser.add_argument('--restart', action='store_true', help='игнорировать чекпоинт и начать заново')
+    args = parser.parse_args()
+
+    bulk_score(args.input, args.output, models_dir=args.models_dir, top_n=args.top_n,
+               category_filter=args.category, batch_size=args.batch_size, workers=args.workers,
+               use_fused_engine=not args.no_fused_engine, restart=args.restart)
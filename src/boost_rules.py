@@ -0,0 +1,106 @@
+# src/boost_rules.py
+import json
+
+import numpy as np
+import pandas as pd
+
+# Типы пользователей; код типа — индекс в этом кортеже (casual — тип по умолчанию)
+USER_TYPES = ('vip', 'digital', 'investor', 'family', 'sports', 'business', 'senior', 'conservative', 'active', 'casual')
+USER_TYPE_CODES = {user_type: code for code, user_type in enumerate(USER_TYPES)}
+
+# Бустинг по типу пользователя: тип -> категория -> множитель (нет в таблице — 1.0)
+TYPE_BOOSTS = {
+    'vip': {'premium': 2.0, 'investments': 1.5, 'cards': 1.3},
+    'digital': {'cards': 1.8, 'investments': 1.6, 'premium': 1.4},
+    'investor': {'investments': 2.0, 'premium': 1.5},
+    'family': {'loans': 1.8, 'insurance': 1.6, 'savings': 1.4},
+    'sports': {'cards': 1.7, 'insurance': 1.5},
+    'business': {'loans': 1.8, 'premium': 1.6, 'investments': 1.4},
+    'senior': {'savings': 1.8, 'cards': 1.6, 'insurance': 1.4},
+    'conservative': {'savings': 1.7, 'insurance': 1.3}
+}
+
+# Бустинг по поведению: (категория, фича, порог, множитель) — множитель применяется, если фича > порога
+BEHAVIOR_BOOSTS = [
+    ('premium', 'market_events', 150, 1.5),
+    ('investments', 'tech_interest_ratio', 0.6, 1.4),
+    ('cards', 'engagement_ratio', 0.15, 1.3),
+]
+
+
+def feature_values(data, name):
+    """Фича как float-массив: для DataFrame — колонка, для словаря — одно значение (нет — 0, как row.get(name, 0))"""
+    if isinstance(data, dict):
+        return np.array([data.get(name, 0)], dtype=float)
+    if name not in data.columns:
+        return np.zeros(len(data))
+    return pd.to_numeric(data[name], errors='coerce').to_numpy(dtype=float)
+
+
+class BoostTables:
+    """
+    Правила бустинга как данные (таблица тип × категория и пороговые правила поведения),
+    развернутые в матрицы: (тип × продукт) по кодам типов и (пользователи × категории) для батча.
+    Финальный скор: proba * priority / 10 * type_matrix[код типа] * behavior[:, индекс категории]
+    """
+
+    def __init__(self, type_boosts=None, behavior_boosts=None):
+        self.type_boosts = TYPE_BOOSTS if type_boosts is None else type_boosts
+        self.behavior_boosts = [tuple(rule) for rule in (BEHAVIOR_BOOSTS if behavior_boosts is None else behavior_boosts)]
+
+        unknown = set(self.type_boosts) - set(USER_TYPES)
+        if unknown:
+            raise ValueError(f"Неизвестные типы пользователей в правилах бустинга: {sorted(unknown)}")
+
+        # Правила поведения по категориям — в порядке таблицы (порядок множителей сохраняется)
+        self._behavior_by_category = {}
+        for category, feature, threshold, factor in self.behavior_boosts:
+            self._behavior_by_category.setdefault(category, []).append((feature, threshold, factor))
+        self._type_matrices = {}  # tuple(категории продуктов) -> матрица
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('type_boosts'), data.get('behavior_boosts'))
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        return {
+            'type_boosts': self.type_boosts,
+            'behavior_boosts': [list(rule) for rule in self.behavior_boosts],
+        }
+
+    def type_matrix(self, categories):
+        """
+        Бустинг по типу (len(USER_TYPES) × продукты) для категорий продуктов, float32.
+        Считается один раз на набор категорий
+        """
+        key = tuple(categories)
+        matrix = self._type_matrices.get(key)
+        if matrix is None:
+            matrix = np.array([
+                [self.type_boosts.get(user_type, {}).get(category, 1.0) for category in key]
+                for user_type in USER_TYPES
+            ], dtype=np.float32).reshape(len(USER_TYPES), len(key))
+            self._type_matrices[key] = matrix
+        return matrix
+
+    def behavior_matrix(self, data, categories):
+        """
+        Бустинг по поведению (пользователи × categories), float32.
+        data — DataFrame или словарь одного пользователя; каждая фича читается один раз на батч
+        """
+        n_users = 1 if isinstance(data, dict) else len(data)
+        boost = np.ones((n_users, len(categories)))
+
+        values = {}
+        for j, category in enumerate(categories):
+            for feature, threshold, factor in self._behavior_by_category.get(category, ()):
+                if feature not in values:
+                    values[feature] = feature_values(data, feature)
+                boost[values[feature] > threshold, j] *= factor
+
+        return boost.astype(np.float32)
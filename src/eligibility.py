@@ -0,0 +1,120 @@
+# src/eligibility.py
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .bank_podukts import BANK_PRODUCTS_FULL
+
+# Числовые требования из BANK_PRODUCTS_FULL: требование -> (фича, сравнение с порогом).
+# Качественные флаги (consistent_behavior, low_engagement, ...) не формализованы и не проверяются
+REQUIREMENT_RULES = {
+    'min_activity': ('market_events', '>='),
+    'max_activity': ('market_events', '<='),
+    'tech_interest': ('tech_interest_ratio', '>='),
+    'sports_interest': ('sports_interest_ratio', '>='),
+    'home_interest': ('home_interest_ratio', '>='),
+    'diversity_ratio': ('diversity_ratio', '>='),
+    'engagement_ratio': ('engagement_ratio', '>='),
+    'market_engagement': ('engagement_ratio', '>='),
+    'offers_engagement': ('offers_engagement', '>='),
+}
+
+# Колонка возраста; min_age из каталога проверяется, только если она есть в данных
+AGE_COLUMN = 'age'
+
+
+def _column(data, name):
+    """Фича как float-массив: для DataFrame — колонка, для словаря — одно значение; нет/не число -> 0"""
+    if isinstance(data, dict):
+        try:
+            value = np.array([float(data.get(name, 0))])
+        except (TypeError, ValueError):
+            return np.zeros(1)
+    elif name in data.columns:
+        value = pd.to_numeric(data[name], errors='coerce').to_numpy(dtype=float)
+    else:
+        return np.zeros(len(data))
+    return np.nan_to_num(value, nan=0.0)
+
+
+class EligibilityIndex:
+    """
+    Правила допуска продуктов (min_age каталога и числовые requirements из BANK_PRODUCTS_FULL),
+    собранные в пороговые векторы по продуктам: маска пользователи × продукты считается
+    одним сравнением на правило для всего батча.
+    Там же — счетчики сэкономленных вызовов моделей (недопущенные и отсеянные верхней границей пары)
+    """
+
+    def __init__(self, product_catalog, bank_products=BANK_PRODUCTS_FULL):
+        self.product_catalog = product_catalog
+        self.bank_products = bank_products
+        self._lock = threading.Lock()
+        self._rules = {}  # tuple(products) -> правила
+        self.reset_stats()
+
+    def rules_for(self, products):
+        """
+        [(фича, сравнение, пороги по продуктам)]; NaN — у продукта нет такого правила
+        """
+        key = tuple(products)
+        if key not in self._rules:
+            self._rules[key] = self._build_rules(products)
+        return self._rules[key]
+
+    def _build_rules(self, products):
+        rules = {}
+        for j, product in enumerate(products):
+            requirements = self.bank_products.get(product, {}).get('requirements', {})
+            for requirement, threshold in requirements.items():
+                if requirement not in REQUIREMENT_RULES or isinstance(threshold, bool):
+                    continue
+                key = REQUIREMENT_RULES[requirement]
+                if key not in rules:
+                    rules[key] = np.full(len(products), np.nan)
+                rules[key][j] = threshold
+
+        min_age = np.array([self.product_catalog[p].get('min_age', np.nan) for p in products], dtype=float)
+        rules[(AGE_COLUMN, '>=')] = min_age
+        return [(feature, op, thresholds) for (feature, op), thresholds in rules.items()]
+
+    def mask(self, data, products):
+        """
+        Маска допуска (пользователи × products). data — DataFrame или словарь одного пользователя
+        """
+        n_users = 1 if isinstance(data, dict) else len(data)
+        eligible = np.ones((n_users, len(products)), dtype=bool)
+        has_age = AGE_COLUMN in data if isinstance(data, dict) else AGE_COLUMN in data.columns
+
+        for feature, op, thresholds in self.rules_for(products):
+            if feature == AGE_COLUMN and not has_age:
+                continue
+            ruled = ~np.isnan(thresholds)
+            if not ruled.any():
+                continue
+            values = _column(data, feature)[:, None]
+            if op == '>=':
+                passed = values >= thresholds[ruled]
+            else:
+                passed = values <= thresholds[ruled]
+            eligible[:, ruled] &= passed
+
+        return eligible
+
+    def record(self, pairs, ineligible, pruned):
+        with self._lock:
+            self.stats['pairs'] += int(pairs)
+            self.stats['ineligible'] += int(ineligible)
+            self.stats['pruned'] += int(pruned)
+
+    def reset_stats(self):
+        self.stats = {'pairs': 0, 'ineligible': 0, 'pruned': 0}
+
+    def report(self):
+        """Сколько вызовов моделей (пар пользователь × продукт) удалось не делать"""
+        pairs = self.stats['pairs']
+        avoided = self.stats['ineligible'] + self.stats['pruned']
+        print(f"✂️  Пар пользователь × продукт: {pairs:,}, без вызова модели: {avoided:,} "
+              f"({avoided / max(pairs, 1):.1%}): недопущено {self.stats['ineligible']:,}, "
+              f"отсеяно верхней границей {self.stats['pruned']:,}")
+        return dict(self.stats, avoided=avoided)
@@ -0,0 +1,248 @@
+# src/evaluation.py
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .feature_schema import scale_inplace
+
+# Порог вероятности для классификационных метрик (как у XGBClassifier.predict)
+PREDICT_THRESHOLD = 0.5
+
+# Метрики ранжирования на пользователя; recall/ndcg/map — только по пользователям, у которых есть релевантные продукты
+RANKING_METRICS = ('precision', 'recall', 'ndcg', 'map')
+
+
+def probability_matrix(recommender, X, products, n_workers=1):
+    """
+    Вероятности пользователи × products: каждая модель вызывается один раз на всю выборку,
+    модели — параллельно в потоках (XGBoost отпускает GIL, X общий). X — масштабированные фичи.
+    Продукты в карантине получают запасную вероятность
+    """
+    proba = np.zeros((len(X), len(products)), dtype=np.float32)
+
+    def fill(j):
+        product = products[j]
+        if product in recommender.models:
+            proba[:, j] = recommender.models[product].predict_proba(X)[:, 1]
+        else:
+            proba[:, j] = recommender.fallback_proba[product]
+
+    if n_workers > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            list(pool.map(fill, range(len(products))))
+    else:
+        for j in range(len(products)):
+            fill(j)
+    return proba
+
+
+def ranking_metrics(relevant, top, served, n_relevant):
+    """
+    Метрики top-k на пользователя одной матричной операцией на метрику.
+    relevant — метки пользователи × продукты (bool), top — индексы выдачи (пользователи × k),
+    served — маска реально выданных позиций top (скор не -inf), n_relevant — число релевантных
+    продуктов пользователя во всем каталоге (недоступные модели продукты тоже считаются).
+    Возвращает {метрика: значения по пользователям}; NaN — у пользователя нет релевантных продуктов
+    """
+    k = top.shape[1]
+    hits = np.take_along_axis(relevant, top, axis=1) & served
+    n_hits = hits.sum(axis=1)
+    has_relevant = n_relevant > 0
+    ideal_hits = np.minimum(n_relevant, k)
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal_dcg = np.concatenate([[0.0], np.cumsum(discounts)])[ideal_hits]
+    precision_at = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'precision': n_hits / max(k, 1),
+            'recall': np.where(has_relevant, n_hits / n_relevant, np.nan),
+            'ndcg': np.where(has_relevant, hits @ discounts / ideal_dcg, np.nan),
+            'map': np.where(has_relevant, (precision_at * hits).sum(axis=1) / ideal_hits, np.nan),
+        }
+
+
+def stratified_sample(strata, sample_size, seed=42):
+    """
+    Индексы подвыборки (по возрастанию) с пропорциональным размещением по стратам
+    (у каждой непустой страты — хотя бы один пользователь)
+    """
+    strata = np.asarray(strata)
+    if sample_size is None or sample_size >= len(strata):
+        return np.arange(len(strata))
+
+    rng = np.random.default_rng(seed)
+    values, counts = np.unique(strata, return_counts=True)
+    quotas = np.maximum(1, np.round(counts * sample_size / len(strata)).astype(int))
+    picked = [
+        rng.choice(np.flatnonzero(strata == value), size=min(quota, count), replace=False)
+        for value, count, quota in zip(values, counts, quotas)
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def bootstrap_ci(per_user, incidence, n_products, n_bootstrap, confidence=0.95, seed=42):
+    """
+    Бутстрэп-интервалы по пользователям: выборка с возвращением задается весами (сколько раз
+    взят пользователь), средние — взвешенные, покрытие каталога — по взвешенной матрице выдачи.
+    per_user — {метрика: значения по пользователям (NaN — не учитывается)}
+    """
+    rng = np.random.default_rng(seed)
+    n_users = len(incidence)
+    valid = {name: ~np.isnan(values) for name, values in per_user.items()}
+    filled = {name: np.nan_to_num(values) for name, values in per_user.items()}
+
+    samples = {name: np.empty(n_bootstrap) for name in per_user}
+    samples['coverage'] = np.empty(n_bootstrap)
+    for b in range(n_bootstrap):
+        weights = np.bincount(rng.integers(0, n_users, n_users), minlength=n_users)
+        for name in per_user:
+            samples[name][b] = weights @ filled[name] / max(weights @ valid[name], 1)
+        samples['coverage'][b] = (weights @ incidence > 0).sum() / n_products
+
+    tail = (1 - confidence) / 2 * 100
+    return {name: tuple(np.percentile(values, [tail, 100 - tail]).tolist()) for name, values in samples.items()}
+
+
+def evaluate_recommender(recommender, features_df, k=(5, 10), labels=None, X=None, sample_size=None,
+                         n_bootstrap=0, confidence=0.95, n_workers=1, seed=42):
+    """
+    Оценка того, что реально выдается: вероятности всех продуктов считаются один раз,
+    из них — скоры с бустингом (как в recommend_batch, с учетом допуска) и метрики top-k
+    (precision, recall, NDCG, MAP, покрытие каталога), плюс Hamming/Jaccard по порогу 0.5.
+    labels — метки пользователи × recommender.all_products (по умолчанию — create_target_matrix),
+    X — уже масштабированные фичи (по умолчанию считаются из features_df).
+    sample_size — стратифицированная по типу пользователя подвыборка, n_bootstrap — интервалы
+    """
+    from .multi_product_recommender import top_n_indices
+
+    if sample_size is not None and sample_size < len(features_df):
+        idx = stratified_sample(recommender._user_type_codes(features_df), sample_size, seed)
+        features_df = features_df.iloc[idx]
+        labels = labels[idx] if labels is not None else None
+        X = X[idx] if X is not None else None
+    if labels is None:
+        labels = recommender.create_target_matrix(features_df, verbose=False)
+    if X is None:
+        X = scale_inplace(recommender.feature_schema.transform(features_df), recommender.scaler)
+    labels = np.asarray(labels).astype(bool)
+
+    # Продукты в порядке recommend_batch: сначала модели, затем запасные (карантин)
+    products = list(recommender.models) + list(recommender.fallback_proba)
+    proba = probability_matrix(recommender, X, products, n_workers)
+    priority_vec, type_boost, behavior_boost = recommender._boost_matrices(features_df, products)
+    scores = proba * priority_vec
+    scores *= type_boost
+    scores *= behavior_boost
+    if recommender.eligibility is not None:
+        scores[~recommender.eligibility.mask(features_df, products)] = -np.inf
+
+    # Метки в порядке products; продукты вне all_products никому не релевантны
+    column = {p: i for i, p in enumerate(recommender.all_products)}
+    relevant = np.zeros((len(X), len(products)), dtype=bool)
+    for j, product in enumerate(products):
+        if product in column:
+            relevant[:, j] = labels[:, column[product]]
+    n_relevant = labels.sum(axis=1)
+    n_catalog = len(recommender.all_products)
+
+    # Классификационные метрики (модели без запасных продуктов, как predict)
+    predicted = np.zeros_like(labels)
+    for j, product in enumerate(recommender.models):
+        if product in column:
+            predicted[:, column[product]] = proba[:, j] > PREDICT_THRESHOLD
+    union = (predicted | labels).sum(axis=1)
+    intersection = (predicted & labels).sum(axis=1)
+
+    result = {
+        'n_users': len(X),
+        'n_products': n_catalog,
+        'hamming_loss': float((predicted != labels).mean()) if labels.size else 0.0,
+        'jaccard': float(np.where(union > 0, intersection / np.maximum(union, 1), 1.0).mean()),
+        'test_coverage': float(predicted.any(axis=1).mean()),
+        'metrics': {},
+        'confidence_intervals': {},
+    }
+
+    rows = np.arange(len(X))[:, None]
+    for top_k in sorted(set(k)):
+        top = top_n_indices(scores, top_k)
+        served = scores[rows, top] != -np.inf
+        per_user = ranking_metrics(relevant, top, served, n_relevant)
+
+        incidence = np.zeros((len(X), len(products)), dtype=bool)
+        incidence[np.broadcast_to(rows, top.shape)[served], top[served]] = True
+        metrics = {name: float(np.nanmean(values)) if (~np.isnan(values)).any() else 0.0
+                   for name, values in per_user.items()}
+        metrics['coverage'] = float(incidence.any(axis=0).sum() / n_catalog)
+        result['metrics'][top_k] = metrics
+
+        if n_bootstrap:
+            result['confidence_intervals'][top_k] = bootstrap_ci(
+                per_user, incidence, n_catalog, n_bootstrap, confidence, seed
+            )
+        if top_k == max(k):
+            counts = incidence.sum(axis=0)
+            order = np.argsort(-counts, kind='stable')[:10]
+            result['top_products'] = [(products[j], int(counts[j])) for j in order if counts[j] > 0]
+
+    return result
+
+
+def print_report(result, confidence=0.95):
+    """Отчет об оценке в консоль"""
+    print("\n📊 ОЦЕНКА КАЧЕСТВА:")
+    print(f"   Пользователей: {result['n_users']:,}, продуктов в каталоге: {result['n_products']}")
+    print(f"   Hamming Loss: {result['hamming_loss']:.4f}")
+    print(f"   Jaccard Score: {result['jaccard']:.4f}")
+    print(f"   Покрытие тестовой выборки: {result['test_coverage']:.1%}")
+
+    print("\n🏆 Метрики выдачи (скоры с бустингом):")
+    for top_k, metrics in result['metrics'].items():
+        intervals = result['confidence_intervals'].get(top_k, {})
+        parts = []
+        for name in RANKING_METRICS + ('coverage',):
+            text = f"{name}@{top_k}: {metrics[name]:.4f}"
+            if name in intervals:
+                low, high = intervals[name]
+                text += f" [{low:.4f}; {high:.4f}]"
+            parts.append(text)
+        print("   " + ", ".join(parts))
+    if result['confidence_intervals']:
+        print(f"   (в скобках — бутстрэп-интервал {confidence:.0%})")
+
+    print("\n🔝 Топ-10 рекомендуемых продуктов:")
+    for product, count in result.get('top_products', []):
+        print(f"   {product}: {count} раз")
+
+
+if __name__ == "__main__":
+    import argparse
+    import pandas as pd
+    from .multi_product_recommender import MultiProductRecommender
+
+    parser = argparse.ArgumentParser(description='Оценка сохраненных моделей на Parquet-файле с фичами')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--test', default='test_features.pq')
+    parser.add_argument('--k', default='5,10', help='значения k через запятую')
+    parser.add_argument('--sample', type=int, help='размер стратифицированной подвыборки')
+    parser.add_argument('--bootstrap', type=int, default=0, help='число бутстрэп-выборок для интервалов')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', help='JSON с результатом')
+    args = parser.parse_args()
+
+    recommender = MultiProductRecommender.load(args.models_dir)
+    features_df = pd.read_parquet(args.test)
+    result = evaluate_recommender(
+        recommender, features_df, k=[int(v) for v in args.k.split(',')], sample_size=args.sample,
+        n_bootstrap=args.bootstrap, confidence=args.confidence, n_workers=args.workers
+    )
+    print_report(result, args.confidence)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результат сохранен: {args.output}")
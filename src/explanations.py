@@ -0,0 +1,92 @@
+# src/explanations.py
+import threading
+
+import numpy as np
+
+from .boost_rules import feature_values
+
+# Общие причины по активности (market_events): выше HIGH — высокая, ниже LOW — стабильное поведение
+ACTIVITY_HIGH, ACTIVITY_LOW = 100, 30
+ACTIVITY_REASONS = {'high': "высокая активность", 'low': "стабильное поведение"}
+
+# Причины по типу пользователя
+TYPE_REASONS = {
+    'vip': "VIP-статус",
+    'digital': "технологическая вовлеченность",
+    'family': "семейный профиль",
+}
+
+# Причины по категории продукта: (категория, фича, порог, причина) — если фича > порога
+CATEGORY_REASONS = [
+    ('premium', 'engagement_ratio', 0.15, "высокая лояльность"),
+    ('investments', 'tech_interest_ratio', 0.5, "интерес к инновациям"),
+    ('loans', 'home_interest_ratio', 0.6, "потребность в финансировании"),
+]
+
+DEFAULT_REASON = "идеально подходит вашему профилю"
+
+
+class ExplanationTemplates:
+    """
+    Объяснения рекомендаций: текст зависит только от типа пользователя, категории продукта
+    и того, по какую сторону порогов лежат несколько фичей. Пользователь сводится к корзинам
+    (активность + битовая маска порогов категорий, векторно для батча), текст собирается
+    один раз на ключ (тип, категория, корзины) и дальше берется из словаря
+    """
+
+    def __init__(self):
+        self._texts = {}
+        self._lock = threading.Lock()
+        # Бит порога в маске и пороги каждой категории
+        self._category_bits = {}
+        for bit, (category, _, _, reason) in enumerate(CATEGORY_REASONS):
+            self._category_bits.setdefault(category, []).append((bit, reason))
+        self._category_masks = {
+            category: sum(1 << bit for bit, _ in rules) for category, rules in self._category_bits.items()
+        }
+
+    def buckets(self, data):
+        """
+        Корзины пользователей: (активность — 'high'/'mid'/'low', битовая маска порогов CATEGORY_REASONS).
+        data — DataFrame или словарь одного пользователя
+        """
+        market_events = feature_values(data, 'market_events')
+        activity = np.where(market_events > ACTIVITY_HIGH, 'high', np.where(market_events < ACTIVITY_LOW, 'low', 'mid'))
+
+        flags = np.zeros(len(market_events), dtype=np.int64)
+        for bit, (_, feature, threshold, _) in enumerate(CATEGORY_REASONS):
+            flags |= (feature_values(data, feature) > threshold).astype(np.int64) << bit
+        return activity, flags
+
+    def text(self, user_type, category, activity, flags):
+        """Объяснение по корзинам пользователя (memoized)"""
+        key = (user_type if user_type in TYPE_REASONS else None, category, str(activity),
+               int(flags) & self._category_masks.get(category, 0))
+        text = self._texts.get(key)
+        if text is None:
+            text = self._render(*key)
+            with self._lock:
+                self._texts[key] = text
+        return text
+
+    def explain(self, user_features, user_type, category):
+        """Объяснение для одного пользователя"""
+        activity, flags = self.buckets(user_features)
+        return self.text(user_type, category, activity[0], flags[0])
+
+    def _render(self, user_type, category, activity, flags):
+        reasons = []
+        if activity in ACTIVITY_REASONS:
+            reasons.append(ACTIVITY_REASONS[activity])
+        if user_type is not None:
+            reasons.append(TYPE_REASONS[user_type])
+        for bit, reason in self._category_bits.get(category, ()):
+            if flags >> bit & 1:
+                reasons.append(reason)
+
+        if not reasons:
+            reasons.append(DEFAULT_REASON)
+        return ", ".join(reasons)
+
+    def __len__(self):
+        return len(self._texts)
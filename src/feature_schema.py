@@ -0,0 +1,120 @@
+# src/feature_schema.py
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+NON_FEATURE_COLUMNS = ('user_id', 'target_product')
+
+
+class FeatureSchema:
+    """
+    Схема фичей, сохраняемая вместе с моделью: порядок колонок, тип (float32) и значения для пропусков.
+    Превращает DataFrame, Arrow-таблицу, список словарей или один словарь
+    сразу в непрерывную float32-матрицу — одинаково при обучении и в проде
+    """
+
+    def __init__(self, columns, fill_values=None):
+        self.columns = list(columns)
+        self.dtype = np.float32
+        if fill_values is None:
+            fill_values = [0.0] * len(self.columns)
+        self.fill_values = np.asarray(fill_values, dtype=self.dtype)
+        self._index = {c: j for j, c in enumerate(self.columns)}
+
+    @classmethod
+    def fit(cls, features_df, exclude=NON_FEATURE_COLUMNS):
+        """
+        Все колонки, кроме служебных; нечисловые значения станут пропусками (как pd.to_numeric(errors='coerce')),
+        пропуски заполняются нулем
+        """
+        columns = [c for c in features_df.columns if c not in exclude]
+        return cls(columns)
+
+    def transform(self, data):
+        """
+        Данные -> np.ndarray (n, len(columns)) float32, C-порядок, пропуски заполнены
+        """
+        if isinstance(data, pd.DataFrame):
+            out = self._from_columns(len(data), lambda c: data[c] if c in data.columns else None)
+        elif isinstance(data, (pa.Table, pa.RecordBatch)):
+            names = set(data.schema.names)
+            out = self._from_columns(data.num_rows, lambda c: data.column(c) if c in names else None)
+        elif isinstance(data, dict):
+            out = self._from_records([data])
+        else:
+            out = self._from_records(data)
+
+        # Пропуски -> значения заполнения (на месте, без новой матрицы)
+        missing = np.isnan(out)
+        if missing.any():
+            np.copyto(out, np.broadcast_to(self.fill_values, out.shape), where=missing)
+        return out
+
+    def _from_columns(self, n_rows, get_column):
+        out = np.empty((n_rows, len(self.columns)), dtype=self.dtype)
+        for j, column in enumerate(self.columns):
+            values = get_column(column)
+            if values is None:
+                out[:, j] = self.fill_values[j]
+                continue
+            if isinstance(values, (pa.ChunkedArray, pa.Array)):
+                if pa.types.is_integer(values.type) or pa.types.is_floating(values.type):
+                    # Arrow-буфер без нулей читается без копии, приведение к float32 — сразу в out
+                    out[:, j] = values.to_numpy(zero_copy_only=False)
+                    continue
+                values = values.to_pandas()
+
+            if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iuf':
+                out[:, j] = values.to_numpy(copy=False)
+            else:
+                # Строки, bool, nullable-типы: как pd.to_numeric(errors='coerce')
+                numeric = pd.to_numeric(values, errors='coerce')
+                out[:, j] = numeric.to_numpy(dtype=self.dtype, na_value=np.nan)
+        return out
+
+    def _from_records(self, records):
+        records = list(records)
+        out = np.empty((len(records), len(self.columns)), dtype=self.dtype)
+        for i, record in enumerate(records):
+            out[i] = [_to_float(record.get(c, np.nan)) for c in self.columns]
+        return out
+
+    def to_dict(self):
+        return {'columns': self.columns, 'dtype': 'float32', 'fill_values': self.fill_values.tolist()}
+
+    @classmethod
+    def from_dict(cls, params):
+        return cls(params['columns'], params['fill_values'])
+
+    @classmethod
+    def from_meta(cls, meta):
+        """Схема из метаданных модели (у старых моделей есть только feature_names)"""
+        if 'feature_schema' in meta:
+            return cls.from_dict(meta['feature_schema'])
+        return cls(meta['feature_names'])
+
+    def fingerprint(self):
+        """Отпечаток схемы: меняется при смене колонок, их порядка, типа или значений заполнения"""
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
+
+
+def scale_inplace(X, scaler):
+    """
+    StandardScaler.transform на месте, в том же float32-буфере: те же операции, что в scaler.transform
+    (mean_/scale_ приводятся к типу X), но без копии матрицы
+    """
+    if scaler.with_mean:
+        X -= scaler.mean_.astype(X.dtype)
+    if scaler.with_std:
+        X /= scaler.scale_.astype(X.dtype)
+    return X
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,201 @@
+# src/instrumentation.py
+import sys
+import json
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм, секунды (от 10 мкс до 10 с)
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Семейства метрик: время этапов, время модели продукта, счетчики событий
+STAGE, MODEL, EVENT = 'stage', 'model', 'event'
+
+
+class Metrics:
+    """
+    Инструментирование горячих путей: время этапов, гистограммы времени моделей по продуктам, счетчики.
+    Пишет во все подключенные приемники (sinks). Выключенное состояние — metrics = None у рекомендателя:
+    в коде стоят проверки `if metrics is not None`, без вызовов и замеров времени
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks) if sinks is not None else [InMemorySink()]
+
+    def lap(self, stage, since):
+        """Время этапа с момента since; возвращает текущий момент — начало следующего этапа"""
+        now = time.perf_counter()
+        for sink in self.sinks:
+            sink.record(STAGE, (stage,), now - since)
+        return now
+
+    def observe_model(self, product, seconds, op='predict'):
+        for sink in self.sinks:
+            sink.record(MODEL, (product, op), seconds)
+
+    def count(self, event, n=1):
+        for sink in self.sinks:
+            sink.record(EVENT, (event,), n)
+
+    def find_sink(self, sink_cls):
+        for sink in self.sinks:
+            if isinstance(sink, sink_cls):
+                return sink
+        return None
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как в Prometheus)"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return low + (high - low) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+
+class InMemorySink:
+    """Агрегаты в памяти процесса: гистограммы этапов и моделей, счетчики событий"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}  # (семейство, метки) -> Histogram
+        self.counters = {}    # метки -> значение
+        self._lock = threading.Lock()
+
+    def record(self, kind, labels, value):
+        with self._lock:
+            if kind == EVENT:
+                self.counters[labels] = self.counters.get(labels, 0) + value
+                return
+            histogram = self.histograms.get((kind, labels))
+            if histogram is None:
+                histogram = self.histograms[(kind, labels)] = Histogram(self.buckets)
+            histogram.add(value)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """Сводка: {'stages': {...}, 'models': {...}, 'events': {...}}, время в миллисекундах"""
+        with self._lock:
+            summary = {'stages': {}, 'models': {}, 'events': {labels[0]: n for labels, n in self.counters.items()}}
+            for (kind, labels), h in self.histograms.items():
+                stats = {
+                    'count': h.count,
+                    'mean_ms': h.sum / h.count * 1000,
+                    'p50_ms': h.quantile(0.5) * 1000,
+                    'p95_ms': h.quantile(0.95) * 1000,
+                    'p99_ms': h.quantile(0.99) * 1000,
+                    'max_ms': h.max * 1000,
+                }
+                if kind == STAGE:
+                    summary['stages'][labels[0]] = stats
+                else:
+                    summary['models'].setdefault(labels[0], {})[labels[1]] = stats
+            return summary
+
+
+class PrometheusSink(InMemorySink):
+    """Те же агрегаты, отдаются в текстовом формате Prometheus"""
+
+    def __init__(self, prefix='recommender', buckets=DEFAULT_BUCKETS):
+        super().__init__(buckets)
+        self.prefix = prefix
+
+    def render(self):
+        with self._lock:
+            lines = []
+            families = [
+                (STAGE, f'{self.prefix}_stage_seconds', 'Время этапа', ('stage',)),
+                (MODEL, f'{self.prefix}_model_seconds', 'Время модели продукта', ('product', 'op')),
+            ]
+            for kind, name, help_text, label_names in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (h_kind, labels), h in sorted(self.histograms.items()):
+                    if h_kind != kind:
+                        continue
+                    label_text = ','.join(f'{k}="{v}"' for k, v in zip(label_names, labels))
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], h.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{label_text}}} {h.sum}')
+                    lines.append(f'{name}_count{{{label_text}}} {h.count}')
+
+            name = f'{self.prefix}_events_total'
+            lines.append(f'# HELP {name} Счетчики событий')
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in sorted(self.counters.items()):
+                lines.append(f'{name}{{event="{labels[0]}"}} {value}')
+            return '\n'.join(lines) + '\n'
+
+
+class JsonLogSink:
+    """Каждое измерение — строка JSON в поток или файл (для разбора логов)"""
+
+    def __init__(self, stream=None):
+        self.stream = open(stream, 'a', encoding='utf-8') if isinstance(stream, str) else (stream or sys.stderr)
+        self._lock = threading.Lock()
+
+    def record(self, kind, labels, value):
+        entry = {'ts': time.time(), 'kind': kind}
+        if kind == STAGE:
+            entry.update(stage=labels[0], seconds=value)
+        elif kind == MODEL:
+            entry.update(product=labels[0], op=labels[1], seconds=value)
+        else:
+            entry.update(event=labels[0], n=value)
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + '\n')
+
+
+def start_metrics_server(sink, port=9100, host='127.0.0.1'):
+    """
+    HTTP-эндпоинт /metrics для PrometheusSink в фоновом потоке (для train и скриптов без своего сервера)
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = sink.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
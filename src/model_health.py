@@ -0,0 +1,104 @@
+# src/model_health.py
+import json
+
+import numpy as np
+
+# Запасная вероятность продукта без исправной модели (если при обучении не сохранили долю положительных).
+# Финальный скор дальше умножается на приоритет из каталога — карантинные продукты ранжируются по нему
+FALLBACK_PROBABILITY = 0.05
+
+
+class ModelHealth:
+    """
+    Результат проверки моделей при загрузке: исправные модели, карантин (продукт -> причина)
+    и запасные вероятности для продуктов в карантине
+    """
+
+    def __init__(self, models, quarantined, fallback_proba):
+        self.models = models
+        self.quarantined = quarantined
+        self.fallback_proba = fallback_proba
+
+    def report(self):
+        """Отчет о продуктах в карантине"""
+        if not self.quarantined:
+            print(f"🩺 Все {len(self.models)} моделей исправны")
+            return
+        print(f"🩺 В карантине {len(self.quarantined)} из {len(self.models) + len(self.quarantined)} моделей "
+              f"(вместо модели — запасная вероятность):")
+        for product, reason in self.quarantined.items():
+            fallback = self.fallback_proba.get(product)
+            fallback_text = f"{fallback:.1%}" if fallback is not None else "нет в каталоге — не рекомендуется"
+            print(f"   ⚠️  {product}: {reason} ({fallback_text})")
+
+    def as_dict(self):
+        return {
+            'healthy': list(self.models),
+            'quarantined': dict(self.quarantined),
+            'fallback_proba': {p: float(v) for p, v in self.fallback_proba.items()},
+        }
+
+
+def check_model(model, n_features):
+    """
+    Проверка одной модели: число признаков, цель и пробное предсказание.
+    Возвращает None для исправной модели, иначе причину
+    """
+    booster = model.get_booster()
+    if booster.num_features() != n_features:
+        return f"модель ожидает {booster.num_features()} признаков, в схеме {n_features}"
+
+    objective = json.loads(booster.save_config())['learner']['objective']['name']
+    if objective != 'binary:logistic':
+        return f"неподдерживаемая цель {objective}"
+
+    proba = model.predict_proba(np.zeros((1, n_features), dtype=np.float32))
+    if proba.shape != (1, 2) or not np.isfinite(proba).all() or not 0.0 <= proba[0, 1] <= 1.0:
+        return f"некорректный ответ predict_proba: {proba!r}"
+    return None
+
+
+def validate_models(models, feature_names, product_catalog, expected_products=None, positive_rates=None):
+    """
+    Проверяем каждую модель один раз при загрузке. Неисправные (и отсутствующие из expected_products)
+    уходят в карантин и в горячем пути не вызываются; для них — запасная вероятность:
+    доля положительных при обучении (positive_rates) или FALLBACK_PROBABILITY.
+    Упакованные модели (PackedModels) проверяются по записанному при упаковке и остаются ленивыми:
+    из отображения только убираются модели в карантине
+    """
+    expected_products = list(expected_products if expected_products is not None else models.keys())
+    positive_rates = positive_rates or {}
+    packed = hasattr(models, 'stored_check')
+
+    healthy, quarantined = [], {}
+    for product in expected_products:
+        if product not in product_catalog:
+            quarantined[product] = "продукта нет в каталоге"
+            continue
+        if product not in models:
+            quarantined[product] = "нет файла модели"
+            continue
+        try:
+            if packed:
+                reason = models.stored_check(product, len(feature_names))
+            else:
+                reason = check_model(models[product], len(feature_names))
+        except Exception as e:
+            reason = f"{type(e).__name__}: {e}"
+        if reason is None:
+            healthy.append(product)
+        else:
+            quarantined[product] = reason
+
+    if packed:
+        for product in set(models) - set(healthy):
+            del models[product]
+        healthy = models
+    else:
+        healthy = {product: models[product] for product in healthy}
+
+    fallback_proba = {
+        product: np.float32(positive_rates.get(product, FALLBACK_PROBABILITY))
+        for product in quarantined if product in product_catalog
+    }
+    return ModelHealth(healthy, quarantined, fallback_proba)
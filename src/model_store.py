@@ -0,0 +1,291 @@
+# src/model_store.py
+import os
+import json
+import mmap
+import hashlib
+import time
+import pickle
+import struct
+import sys
+import weakref
+from collections.abc import MutableMapping
+
+import numpy as np
+import xgboost as xgb
+from sklearn.preprocessing import StandardScaler
+
+from .model_health import check_model
+
+PACK_FILE = 'recommender.pack'
+PACK_MAGIC = b'RECPACK1'
+
+
+class MissingModelsError(RuntimeError):
+    """Для части обученных продуктов нет моделей"""
+
+    def __init__(self, missing, models_dir):
+        self.missing = sorted(missing)
+        super().__init__(
+            f"В {models_dir} нет моделей для {len(self.missing)} обученных продуктов: {', '.join(self.missing)}"
+        )
+
+
+def source_fingerprint(models_dir, products):
+    """
+    Отпечаток JSON/pickle-артефактов папки (имя, размер и mtime файлов) — по нему видно,
+    что их переписали после упаковки
+    """
+    digest = hashlib.sha256()
+    for name in ['recommender_meta.pkl', 'scaler.pkl'] + [f'model_{product}.json' for product in products]:
+        path = os.path.join(models_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+        else:
+            digest.update(f'{name}:-;'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_packed(path, models, meta, scaler):
+    """
+    Один файл со всеми артефактами: заголовок (метаданные + параметры scaler) и бинарные UBJ-бустеры.
+    Формат: PACK_MAGIC | длина заголовка (uint64) | JSON-заголовок | блоки бустеров.
+    В заголовке — отпечаток JSON/pickle-артефактов папки на момент упаковки (пишется после них),
+    контрольные суммы блоков и результаты check_model: при загрузке бустеры не разбираются ради проверки
+    """
+    n_features = len(meta['feature_names'])
+    blobs = []
+    index = {}
+    checks = {}
+    offset = 0
+    for product, model in models.items():
+        raw = bytes(model.get_booster().save_raw('ubj'))
+        index[product] = [offset, len(raw), hashlib.sha256(raw).hexdigest()]
+        try:
+            checks[product] = check_model(model, n_features)
+        except Exception as e:
+            checks[product] = f"{type(e).__name__}: {e}"
+        blobs.append(raw)
+        offset += len(raw)
+
+    header = dict(meta)
+    header['trained_models'] = list(models.keys())
+    header['scaler'] = _scaler_to_dict(scaler)
+    header['models'] = index
+    header['n_features'] = n_features
+    header['checks'] = checks
+    header['sources'] = source_fingerprint(os.path.dirname(path) or '.', header['trained_models'])
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    # Пишем во временный файл и атомарно подменяем
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PACK_MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for raw in blobs:
+            f.write(raw)
+    os.replace(tmp_path, path)
+
+
+def save_model_atomic(model, path):
+    """Модель в JSON через временный файл того же формата и атомарную подмену"""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f'.{name}.tmp.json')
+    model.save_model(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def dump_pickle_atomic(obj, path):
+    """pickle через временный файл и атомарную подмену"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+class PackedModels(MutableMapping):
+    """
+    Модели из упакованного файла: файл отображается в память (mmap),
+    бустер разбирается только при первом обращении к продукту (и для проверки тоже — см. stored_check)
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        # Файл и отображение закрываются в close() (with) или когда объект собран сборщиком мусора
+        self._finalizer = weakref.finalize(self, _close_pack, self._mmap, self._file)
+
+        if self._mmap[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError(f"{path}: не упакованный файл моделей")
+        (header_len,) = struct.unpack('<Q', self._mmap[8:16])
+        self.header = json.loads(self._mmap[16:16 + header_len].decode('utf-8'))
+        self._data_start = 16 + header_len
+
+        self._index = self.header['models']
+        self._loaded = {}
+
+    def __getitem__(self, product):
+        if product not in self._loaded:
+            offset, length = self._index[product][:2]
+            start = self._data_start + offset
+            model = xgb.XGBClassifier()
+            model.load_model(bytearray(self._mmap[start:start + length]))
+            self._loaded[product] = model
+        return self._loaded[product]
+
+    def __setitem__(self, product, model):
+        self._loaded[product] = model
+        if product not in self._index:
+            self._index[product] = None
+
+    def __delitem__(self, product):
+        self._loaded.pop(product, None)
+        del self._index[product]
+
+    def __contains__(self, product):
+        # Без __getitem__ из Mapping — проверка наличия не разбирает бустер
+        return product in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def stored_check(self, product, n_features):
+        """
+        Проверка модели без разбора бустера: контрольная сумма блока и результат check_model при упаковке.
+        Если записи нет (старый файл, другое число признаков, модель заменена) — полная проверка
+        """
+        checks = self.header.get('checks', {})
+        entry = self._index[product]
+        if product in self._loaded or product not in checks or self.header.get('n_features') != n_features:
+            return check_model(self[product], n_features)
+        offset, length, checksum = entry
+        start = self._data_start + offset
+        if hashlib.sha256(self._mmap[start:start + length]).hexdigest() != checksum:
+            return "контрольная сумма блока не совпадает с записанной при упаковке"
+        return checks[product]
+
+    def close(self):
+        self._loaded.clear()
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _close_pack(pack_mmap, pack_file):
+    pack_mmap.close()
+    pack_file.close()
+
+
+def _pack_is_stale(models_dir, header):
+    """
+    Упакованный файл устарел: JSON/pickle-артефакты есть и изменились после упаковки
+    (или у старого файла нет отпечатка, и сверить нечем)
+    """
+    if not os.path.exists(os.path.join(models_dir, 'recommender_meta.pkl')):
+        return False
+    return header.get('sources') != source_fingerprint(models_dir, header.get('trained_models', header['models']))
+
+
+def load_artifacts(models_dir='models', strict=True):
+    """
+    Загрузка метаданных, scaler и моделей.
+    Если есть актуальный упакованный файл — читаем его (быстрый путь), иначе JSON-модели из папки
+    (упакованный файл, устаревший относительно них, пропускаем с предупреждением).
+    strict=True — исключение MissingModelsError, если у обученного продукта нет модели
+    """
+    start = time.perf_counter()
+    pack_path = os.path.join(models_dir, PACK_FILE)
+
+    models = PackedModels(pack_path) if os.path.exists(pack_path) else None
+    if models is not None and _pack_is_stale(models_dir, models.header):
+        print(f"⚠️  {pack_path} старше JSON-артефактов — загружаем JSON (обновите: python -m src.model_store {models_dir})")
+        models.close()
+        models = None
+
+    if models is not None:
+        meta = models.header
+        scaler = _scaler_from_dict(meta['scaler'])
+        missing = []
+        source = PACK_FILE
+    else:
+        with open(f'{models_dir}/recommender_meta.pkl', 'rb') as f:
+            meta = pickle.load(f)
+        with open(f'{models_dir}/scaler.pkl', 'rb') as f:
+            scaler = pickle.load(f)
+
+        models = {}
+        missing = []
+        for product in meta.get('trained_models', meta['all_products']):
+            model_path = f'{models_dir}/model_{product}.json'
+            if not os.path.exists(model_path):
+                missing.append(product)
+                continue
+            model = xgb.XGBClassifier()
+            model.load_model(model_path)
+            models[product] = model
+        source = 'JSON'
+
+    if missing:
+        error = MissingModelsError(missing, models_dir)
+        if strict:
+            raise error
+        print(f"⚠️  {error}")
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"📦 Артефакты загружены из {source} за {elapsed_ms:.0f} мс ({len(models)} моделей)")
+
+    return meta, scaler, models
+
+
+def pack_models_dir(models_dir='models'):
+    """
+    Упаковываем существующую папку с JSON-моделями в один файл
+    """
+    meta, scaler, models = load_artifacts(models_dir)
+    pack_path = os.path.join(models_dir, PACK_FILE)
+    meta = {k: v for k, v in meta.items() if k not in ('scaler', 'models')}
+    save_packed(pack_path, models, meta, scaler)
+    if hasattr(models, 'close'):
+        models.close()
+    print(f"💾 Упаковано {len(models)} моделей в {pack_path} ({os.path.getsize(pack_path) / 1024:.0f} КБ)")
+    return pack_path
+
+
+def _scaler_to_dict(scaler):
+    params = {
+        'mean': scaler.mean_.tolist(),
+        'scale': scaler.scale_.tolist(),
+        'var': scaler.var_.tolist(),
+        'n_samples_seen': int(np.max(scaler.n_samples_seen_)),
+    }
+    if hasattr(scaler, 'feature_names_in_'):
+        params['feature_names_in'] = scaler.feature_names_in_.tolist()
+    return params
+
+
+def _scaler_from_dict(params):
+    scaler = StandardScaler()
+    scaler.mean_ = np.asarray(params['mean'])
+    scaler.scale_ = np.asarray(params['scale'])
+    scaler.var_ = np.asarray(params['var'])
+    scaler.n_samples_seen_ = params['n_samples_seen']
+    scaler.n_features_in_ = len(scaler.mean_)
+    if 'feature_names_in' in params:
+        scaler.feature_names_in_ = np.asarray(params['feature_names_in'], dtype=object)
+    return scaler
+
+
+if __name__ == "__main__":
+    pack_models_dir(sys.argv[1] if len(sys.argv) > 1 else 'models')
@@ -0,0 +1,12 @@
+# src/multi_product_recommender.py
+"""
+Импортируемая точка входа для 05_multi_product_recommender.py
+(имя модуля, начинающееся с цифры, нельзя импортировать обычным import)
+"""
+import importlib
+
+_impl = importlib.import_module('.05_multi_product_recommender', __package__)
+
+FULL_PRODUCT_CATALOG = _impl.FULL_PRODUCT_CATALOG
+MultiProductRecommender = _impl.MultiProductRecommender
+top_n_indices = _impl.top_n_indices
@@ -0,0 +1,85 @@
+# src/recommendation_cache.py
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class RecommendationCache:
+    """
+    Кэш рекомендаций: ограниченный размер, вытеснение LRU и срок жизни записей (TTL)
+    """
+
+    def __init__(self, max_size=10_000, ttl=300.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # ключ -> (время записи, значение)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(user_id, feature_vector, category_filter, top_n, explain=True):
+        """
+        Ключ: user_id + хэш вектора фичей + фильтр категории + top_n + нужны ли объяснения.
+        feature_vector — строка FeatureSchema.transform (float32, пропуски и нечисловые значения уже заполнены)
+        """
+        vector = np.ascontiguousarray(feature_vector, dtype=np.float32)
+        digest = hashlib.blake2b(vector.tobytes(), digest_size=16).hexdigest()
+        return (user_id, digest, category_filter, top_n, explain)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, value = entry
+            if self.clock() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Сброс всех записей (модели переобучены или перезагружены)"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Счетчики для подбора размера кэша"""
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
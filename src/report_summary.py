@@ -0,0 +1,202 @@
+# src/report_summary.py
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .results import RecommendationBatch
+
+# Корзины гистограмм отчета (как в графиках RecommenderVisualizer)
+SCORE_BINS = 30
+DIVERSITY_BINS = 20
+HIGH_QUALITY_SCORE = 0.3
+
+# Сегменты пользователей: корзины активности, не больше точек на диаграмме рассеяния и выбросов на «ящик»
+ACTIVITY_BINS = [0, 30, 80, 150, 1000]
+ACTIVITY_LABELS = ['Низкая', 'Средняя', 'Высокая', 'Очень высокая']
+SCATTER_POINTS = 5000
+MAX_FLIERS = 500
+
+
+class RecommendationSummary:
+    """
+    Все агрегаты отчета по выдаче, посчитанные за один проход по колонкам
+    (bincount по кодам пользователей, продуктов и категорий): счетчики продуктов и категорий,
+    число рекомендаций и разнообразие на пользователя, гистограммы и статистики скоров.
+    Графики и текстовый отчет читают только отсюда, поэтому их стоимость не зависит от числа пользователей
+    """
+
+    def __init__(self, n_users, catalog_size, product_counts, category_counts, category_mean_score,
+                 recs_per_user_counts, score_hist, score_edges, score_stats, diversity_hist, diversity_edges,
+                 mean_diversity):
+        self.n_users = n_users
+        self.catalog_size = catalog_size
+        self.product_counts = product_counts  # Series продукт -> число выдач, по убыванию
+        self.category_counts = category_counts  # Series категория -> число выдач, по убыванию
+        self.category_mean_score = category_mean_score  # Series категория -> средний скор (порядок появления)
+        self.recs_per_user_counts = recs_per_user_counts  # [i] — пользователей с i рекомендациями
+        self.score_hist = score_hist
+        self.score_edges = score_edges
+        self.score_stats = score_stats  # mean / median / min / max / high_quality_share
+        self.diversity_hist = diversity_hist
+        self.diversity_edges = diversity_edges
+        self.mean_diversity = mean_diversity
+
+    @property
+    def total_recs(self):
+        return int(self.product_counts.sum())
+
+    @property
+    def unique_products(self):
+        return int((self.product_counts > 0).sum())
+
+    @property
+    def mean_recs(self):
+        return self.total_recs / max(self.n_users, 1)
+
+    @classmethod
+    def from_recommendations(cls, recommendations, catalog_size, n_users=None):
+        """
+        Из RecommendationBatch, Arrow-таблицы или DataFrame (колонки user_id, product_id, category, score —
+        как RECOMMENDATION_SCHEMA) либо списка списков Recommendation.
+        n_users — сколько пользователей оценивалось (пользователи без рекомендаций в таблице не видны)
+        """
+        if isinstance(recommendations, RecommendationBatch):
+            counts = np.diff(recommendations.offsets)
+            return cls.from_columns(
+                np.repeat(np.arange(len(recommendations)), counts),
+                max(len(recommendations), n_users or 0),
+                recommendations.product_index, recommendations.products,
+                recommendations.product_categories[recommendations.product_index], recommendations.categories,
+                recommendations.score, catalog_size,
+            )
+
+        if isinstance(recommendations, pa.Table):
+            recommendations = recommendations.to_pandas()
+        if isinstance(recommendations, list):
+            recommendations = pd.DataFrame({
+                'user_id': np.repeat(np.arange(len(recommendations)), [len(recs) for recs in recommendations]),
+                'product_id': [rec.product_id for recs in recommendations for rec in recs],
+                'category': [rec.category for recs in recommendations for rec in recs],
+                'score': np.array([rec.score for recs in recommendations for rec in recs], dtype=np.float32),
+            })
+            n_users = max(n_users or 0, int(recommendations['user_id'].max()) + 1 if len(recommendations) else 0)
+
+        user_codes, users = pd.factorize(recommendations['user_id'], sort=False)
+        product_codes, products = pd.factorize(recommendations['product_id'], sort=False)
+        category_codes, categories = pd.factorize(recommendations['category'], sort=False)
+        return cls.from_columns(
+            user_codes, max(len(users), n_users or 0), product_codes, np.asarray(products),
+            category_codes, np.asarray(categories), recommendations['score'].to_numpy(), catalog_size,
+        )
+
+    @classmethod
+    def from_columns(cls, user_codes, n_users, product_codes, products, category_codes, categories, scores,
+                     catalog_size):
+        """Агрегаты по кодам строк выдачи (код — индекс в products / categories)"""
+        scores = np.asarray(scores, dtype=np.float64)
+        category_codes = np.asarray(category_codes, dtype=np.intp)
+
+        product_counts = pd.Series(
+            np.bincount(product_codes, minlength=len(products)), index=list(products)
+        ).sort_values(ascending=False, kind='stable')
+        category_totals = np.bincount(category_codes, minlength=len(categories))
+        category_counts = pd.Series(category_totals, index=list(categories)).sort_values(ascending=False, kind='stable')
+        category_mean_score = pd.Series(
+            np.bincount(category_codes, weights=scores, minlength=len(categories)) / np.maximum(category_totals, 1),
+            index=list(categories)
+        )
+
+        # Рекомендаций и различных категорий на пользователя
+        recs_per_user = np.bincount(user_codes, minlength=n_users)
+        user_categories = np.unique(np.asarray(user_codes, dtype=np.int64) * max(len(categories), 1) + category_codes)
+        categories_per_user = np.bincount(user_categories // max(len(categories), 1), minlength=n_users)
+        diversity = categories_per_user / np.maximum(recs_per_user, 1)
+        diversity_hist, diversity_edges = np.histogram(diversity, bins=DIVERSITY_BINS)
+
+        if len(scores):
+            score_hist, score_edges = np.histogram(scores, bins=SCORE_BINS)
+            score_stats = {
+                'mean': float(scores.mean()),
+                'median': float(np.median(scores)),
+                'min': float(scores.min()),
+                'max': float(scores.max()),
+                'high_quality_share': float((scores > HIGH_QUALITY_SCORE).mean()),
+            }
+        else:
+            score_hist, score_edges = np.zeros(SCORE_BINS, dtype=np.int64), np.linspace(0, 1, SCORE_BINS + 1)
+            score_stats = {'mean': 0.0, 'median': 0.0, 'min': 0.0, 'max': 0.0, 'high_quality_share': 0.0}
+
+        return cls(
+            n_users, catalog_size, product_counts, category_counts, category_mean_score,
+            np.bincount(recs_per_user), score_hist, score_edges, score_stats,
+            diversity_hist, diversity_edges, float(diversity.mean()) if n_users else 0.0,
+        )
+
+    def to_dict(self):
+        """Агрегаты как JSON-совместимый словарь (для экспорта и хэша входов графиков)"""
+        return {
+            'n_users': int(self.n_users),
+            'catalog_size': int(self.catalog_size),
+            'total_recs': self.total_recs,
+            'unique_products': self.unique_products,
+            'mean_recs': float(self.mean_recs),
+            'product_counts': {p: int(c) for p, c in self.product_counts.items() if c > 0},
+            'category_counts': {c: int(n) for c, n in self.category_counts.items() if n > 0},
+            'category_mean_score': {
+                c: float(v) for c, v in self.category_mean_score.items() if self.category_counts[c] > 0
+            },
+            'recs_per_user_counts': self.recs_per_user_counts.tolist(),
+            'score_hist': self.score_hist.tolist(),
+            'score_edges': self.score_edges.tolist(),
+            'score_stats': dict(self.score_stats),
+            'diversity_hist': self.diversity_hist.tolist(),
+            'diversity_edges': self.diversity_edges.tolist(),
+            'mean_diversity': float(self.mean_diversity),
+        }
+
+
+def _box_stats(values, label):
+    """Статистики «ящика с усами» (как считает boxplot) с прореженными выбросами — для ax.bxp"""
+    from matplotlib import cbook
+
+    values = pd.to_numeric(values, errors='coerce').dropna().to_numpy(dtype=float)
+    stats = cbook.boxplot_stats(values, labels=[label])[0]
+    fliers = np.sort(stats['fliers'])
+    if len(fliers) > MAX_FLIERS:
+        fliers = fliers[np.linspace(0, len(fliers) - 1, MAX_FLIERS).astype(int)]
+    stats = {key: float(value) for key, value in stats.items() if key not in ('fliers', 'label')}
+    stats.update(fliers=fliers.tolist(), label=label)
+    return stats
+
+
+def segment_summary(features_df, seed=0):
+    """
+    Агрегаты сегментов пользователей для графика: счетчики по активности, статистики «ящиков»
+    интересов и вовлеченности, не больше SCATTER_POINTS точек для диаграммы рассеяния
+    """
+    activity = pd.cut(features_df['market_events'], bins=ACTIVITY_BINS, labels=ACTIVITY_LABELS).value_counts()
+
+    points = features_df[(features_df['market_events'] < 200) & (features_df['offers_engagement'] < 20)]
+    if len(points) > SCATTER_POINTS:
+        rng = np.random.default_rng(seed)
+        points = points.iloc[np.sort(rng.choice(len(points), SCATTER_POINTS, replace=False))]
+
+    return {
+        'activity': {str(label): int(count) for label, count in activity.items()},
+        'interests': [
+            _box_stats(features_df['tech_interest_ratio'], 'Технологии'),
+            _box_stats(features_df['sports_interest_ratio'], 'Спорт'),
+            _box_stats(features_df['home_interest_ratio'], 'Недвижимость'),
+        ],
+        'engagement': [
+            _box_stats(features_df['engagement_ratio'], 'Маркетплейс'),
+            _box_stats(features_df['offers_engagement_ratio'], 'Офферы'),
+            _box_stats(features_df['retail_purchase_intent'], 'Покупки'),
+        ],
+        'scatter': {
+            'x': points['market_events'].astype(float).tolist(),
+            'y': points['offers_engagement'].astype(float).tolist(),
+            'c': points['engagement_ratio'].astype(float).tolist(),
+        },
+    }
@@ -0,0 +1,254 @@
+# src/results.py
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def recommendation_schema(id_type=None):
+    """
+    Arrow-схема выдачи: по строке на (пользователь, ранг); id_type — тип user_id входных данных
+    (по умолчанию int64)
+    """
+    if id_type is None:
+        id_type = pa.int64()
+    return pa.schema([
+        ('user_id', id_type),
+        ('rank', pa.int16()),
+        ('product_id', pa.string()),
+        ('category', pa.string()),
+        ('score', pa.float32()),
+        ('probability', pa.float32()),
+    ])
+
+
+def user_id_type(user_ids):
+    """
+    Тип колонки user_id в выдаче по входу (массиву id или Arrow-типу колонки):
+    знаковые целые — int64, беззнаковые — uint64 (отрицательные id не переполняются),
+    остальные (например, 'test_user_001') — строки
+    """
+    if isinstance(user_ids, pa.DataType):
+        if pa.types.is_unsigned_integer(user_ids):
+            return pa.uint64()
+        return pa.int64() if pa.types.is_integer(user_ids) else pa.string()
+    kind = np.asarray(user_ids).dtype.kind
+    if kind == 'u':
+        return pa.uint64()
+    return pa.int64() if kind == 'i' else pa.string()
+
+
+# Схема для числовых user_id (по умолчанию — номер строки)
+RECOMMENDATION_SCHEMA = recommendation_schema()
+
+
+class Recommendation:
+    """
+    Одна рекомендация: скор и вероятность — float32 как есть (без форматирования),
+    explanation — None, если объяснения не запрашивались.
+    Строки для показа — score_text / probability_text / to_dict(formatted=True)
+    """
+
+    __slots__ = ('product_id', 'category', 'score', 'probability', 'priority', 'explanation')
+
+    def __init__(self, product_id, category, score, probability, priority, explanation=None):
+        self.product_id = product_id
+        self.category = category
+        self.score = score
+        self.probability = probability
+        self.priority = priority
+        self.explanation = explanation
+
+    @property
+    def score_text(self):
+        return f"{self.score:.3f}"
+
+    @property
+    def probability_text(self):
+        return f"{self.probability:.1%}"
+
+    def copy(self):
+        return Recommendation(self.product_id, self.category, self.score, self.probability, self.priority,
+                              self.explanation)
+
+    def to_dict(self, formatted=False):
+        """Словарь для JSON/вывода; formatted=True — скор и вероятность строками (как в отчетах)"""
+        data = {
+            'product_id': self.product_id,
+            'category': self.category,
+            'score': self.score_text if formatted else float(self.score),
+            'probability': self.probability_text if formatted else float(self.probability),
+            'priority': self.priority,
+        }
+        if self.explanation is not None:
+            data['explanation'] = self.explanation
+        return data
+
+    def __eq__(self, other):
+        if not isinstance(other, Recommendation):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (f"Recommendation({self.product_id!r}, {self.category!r}, score={self.score:.4f}, "
+                f"probability={self.probability:.4f}, priority={self.priority})")
+
+
+class RecommendationBatch:
+    """
+    Колоночная выдача батча: строки (пользователь, ранг) подряд по пользователям, offsets — границы
+    пользователей (как CSR). Продукт — индекс в products, категория — код в categories;
+    скор и вероятность — float32. В Arrow/Parquet пишется без Python-объектов на строку.
+    Индексация и итерация дают списки Recommendation (для показа и поштучной обработки)
+    """
+
+    def __init__(self, products, product_categories, categories, priorities,
+                 offsets, product_index, score, probability, explanations=None):
+        self.products = np.asarray(products, dtype=object)
+        self.product_categories = np.asarray(product_categories, dtype=np.int16)  # код категории продукта
+        self.categories = np.asarray(categories, dtype=object)
+        self.priorities = np.asarray(priorities)
+        self.offsets = offsets
+        self.product_index = product_index
+        self.score = score
+        self.probability = probability
+        self.explanations = explanations  # None или тексты по строкам (общие memoized строки)
+
+    @classmethod
+    def from_top(cls, products, product_catalog, top, scores, proba, explain_fn=None):
+        """
+        Из матрицы скоров и индексов top-N (пользователи × top_n).
+        Пары со скором -inf (недопущенные/отсеянные) отбрасываются.
+        explain_fn(пользователь, индекс продукта) -> текст, если нужны объяснения
+        """
+        n_users = len(top)
+        rows = np.repeat(np.arange(n_users), top.shape[1])
+        cols = top.ravel()
+        row_scores = scores[rows, cols]
+        kept = row_scores != -np.inf
+        rows, cols = rows[kept], cols[kept]
+
+        offsets = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_users), out=offsets[1:])
+
+        category_of = [product_catalog[p]['category'] for p in products]
+        categories = list(dict.fromkeys(category_of))
+        explanations = None
+        if explain_fn is not None:
+            explanations = np.array([explain_fn(i, j) for i, j in zip(rows.tolist(), cols.tolist())], dtype=object)
+
+        return cls(
+            products,
+            [categories.index(c) for c in category_of],
+            categories,
+            [product_catalog[p]['priority'] for p in products],
+            offsets,
+            cols.astype(np.int16),
+            row_scores[kept].astype(np.float32),
+            proba[rows, cols].astype(np.float32),
+            explanations,
+        )
+
+    @classmethod
+    def concat(cls, batches):
+        """
+        Склейка батчей подряд (например, шардов одного пользовательского набора).
+        Все батчи должны быть посчитаны по одному списку продуктов
+        """
+        first = batches[0]
+        for batch in batches[1:]:
+            if list(batch.products) != list(first.products):
+                raise ValueError("Батчи посчитаны по разным спискам продуктов — склеить нельзя")
+
+        shifts = np.cumsum([0] + [batch.num_rows for batch in batches[:-1]])
+        offsets = np.concatenate([[0]] + [batch.offsets[1:] + shift for batch, shift in zip(batches, shifts)])
+        explanations = None
+        if all(batch.explanations is not None for batch in batches):
+            explanations = np.concatenate([batch.explanations for batch in batches])
+        return cls(
+            first.products, first.product_categories, first.categories, first.priorities,
+            offsets.astype(np.int64),
+            np.concatenate([batch.product_index for batch in batches]),
+            np.concatenate([batch.score for batch in batches]),
+            np.concatenate([batch.probability for batch in batches]),
+            explanations,
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def num_rows(self):
+        return int(self.offsets[-1])
+
+    @property
+    def ranks(self):
+        """Ранг строки внутри пользователя (с 1)"""
+        users = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        return (np.arange(self.num_rows) - self.offsets[users] + 1).astype(np.int16)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        recommendations = []
+        for row in range(start, end):
+            j = self.product_index[row]
+            recommendations.append(Recommendation(
+                self.products[j],
+                self.categories[self.product_categories[j]],
+                self.score[row],
+                self.probability[row],
+                self.priorities[j].item(),
+                self.explanations[row] if self.explanations is not None else None,
+            ))
+        return recommendations
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        """Сравнение как последовательности списков (с другим батчем или списком списков Recommendation)"""
+        if isinstance(other, RecommendationBatch):
+            other = other.to_lists()
+        if not isinstance(other, list):
+            return NotImplemented
+        return self.to_lists() == other
+
+    def to_lists(self):
+        """Список списков Recommendation — та же форма, что у recommend() по каждому пользователю"""
+        return list(self)
+
+    def to_arrow(self, user_ids=None):
+        """
+        Arrow-таблица по recommendation_schema. user_ids — идентификаторы пользователей
+        в порядке батча (по умолчанию — номер строки): целые пишутся как int64 (беззнаковые — uint64), остальные — строками.
+        Строковые колонки собираются из словарей (индексы продуктов/категорий), без Python-объектов на строку
+        """
+        users = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        if user_ids is None:
+            user_ids = np.arange(len(self))
+        user_ids = np.asarray(user_ids)
+        id_type = user_id_type(user_ids)
+        if pa.types.is_integer(id_type):
+            user_column = user_ids[users].astype(id_type.to_pandas_dtype())
+        else:
+            user_column = pa.array(user_ids.astype(str)[users], type=pa.string())
+        product_ids = pa.DictionaryArray.from_arrays(
+            pa.array(self.product_index, type=pa.int16()), pa.array(self.products.tolist(), type=pa.string())
+        )
+        categories = pa.DictionaryArray.from_arrays(
+            pa.array(self.product_categories[self.product_index], type=pa.int16()),
+            pa.array(self.categories.tolist(), type=pa.string())
+        )
+        return pa.table({
+            'user_id': user_column,
+            'rank': self.ranks,
+            'product_id': product_ids.dictionary_decode(),
+            'category': categories.dictionary_decode(),
+            'score': self.score,
+            'probability': self.probability,
+        }, schema=recommendation_schema(id_type))
+
+    def to_parquet(self, path, user_ids=None):
+        pq.write_table(self.to_arrow(user_ids), path)
@@ -0,0 +1,212 @@
+# src/score_store.py
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from .multi_product_recommender import MultiProductRecommender, top_n_indices
+from .results import Recommendation
+
+ARRAYS = ('users', 'hashes', 'proba', 'scores')
+
+
+def user_id_array(user_ids):
+    """
+    user_id для хранения: числовые — как есть, остальные — строки фиксированной ширины (dtype U),
+    чтобы массив открывался memory-mapped (массив Python-объектов так не загрузить)
+    """
+    user_ids = np.asarray(user_ids)
+    if user_ids.dtype.kind in 'iuf':
+        return user_ids
+    return user_ids.astype(str)
+
+
+class ScoreStore:
+    """
+    Предпосчитанные финальные скоры пользователи × продукты.
+    Онлайн-запрос — поиск строки, маска категории и top-k, без вызова моделей.
+    Файлы: <prefix>.users.npy, .hashes.npy, .proba.npy, .scores.npy (memory-mapped) и <prefix>.meta.json
+    """
+
+    def __init__(self, prefix='user_scores'):
+        self.prefix = prefix
+
+        with open(f'{prefix}.meta.json') as f:
+            self.meta = json.load(f)
+        self.products = self.meta['products']
+        self.categories = np.asarray(self.meta['categories'])
+        self.priorities = self.meta['priorities']
+
+        for name in ARRAYS:
+            setattr(self, name, np.load(f'{prefix}.{name}.npy', mmap_mode='r'))
+
+        # Отсортированные user_id для поиска строки
+        self._order = np.argsort(self.users, kind='stable')
+        self._sorted_users = self.users[self._order]
+
+    def rows_of(self, user_ids):
+        """Строки матрицы для user_ids и маска найденных"""
+        user_ids = np.asarray(user_ids)
+        if self._sorted_users.dtype.kind == 'U':
+            user_ids = user_ids.astype(str)
+        pos = np.searchsorted(self._sorted_users, user_ids)
+        pos = np.minimum(pos, len(self._sorted_users) - 1)
+        known = self._sorted_users[pos] == user_ids
+        return self._order[pos], known
+
+    def row_of(self, user_id):
+        rows, known = self.rows_of([user_id])
+        return int(rows[0]) if known[0] else None
+
+    def recommend(self, user_id, top_n=10, category_filter=None):
+        """
+        Рекомендации из матрицы (список Recommendation, как у MultiProductRecommender.recommend, без explanation)
+        """
+        row = self.row_of(user_id)
+        if row is None:
+            return []
+
+        columns = np.arange(len(self.products))
+        if category_filter:
+            columns = columns[self.categories == category_filter]
+
+        scores = np.asarray(self.scores[row, columns])[None, :]
+        top = top_n_indices(scores, top_n)[0]
+
+        recommendations = []
+        for j in columns[top]:
+            if self.scores[row, j] == -np.inf:
+                break  # продукт не допущен правилами каталога
+            recommendations.append(Recommendation(
+                self.products[j],
+                str(self.categories[j]),
+                self.scores[row, j],
+                self.proba[row, j],
+                self.priorities[j]
+            ))
+        return recommendations
+
+
+def models_fingerprint(recommender):
+    """
+    Отпечаток всего, от чего зависит финальный скор: модели и scaler, правила бустинга,
+    продукты каталога с приоритетами, запасные вероятности карантина и правила допуска.
+    При его смене предпосчитанные скоры устарели целиком
+    """
+    digest = hashlib.sha256()
+    for product, model in recommender.models.items():
+        digest.update(product.encode())
+        digest.update(bytes(model.get_booster().save_raw('ubj')))
+    digest.update(np.asarray(recommender.scaler.mean_).tobytes())
+    digest.update(np.asarray(recommender.scaler.scale_).tobytes())
+
+    products = list(recommender.models) + list(recommender.fallback_proba)
+    eligibility = recommender.eligibility
+    scoring = {
+        'boost_rules': recommender.boost_tables.to_dict(),
+        'catalog': [[p, recommender.product_catalog[p]] for p in products],
+        'fallback_proba': {p: float(v) for p, v in recommender.fallback_proba.items()},
+        'eligibility': None if eligibility is None else {
+            p: eligibility.bank_products.get(p, {}).get('requirements', {}) for p in products
+        },
+    }
+    digest.update(json.dumps(scoring, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def feature_hashes(recommender, features_df):
+    """Хэш вектора фичей каждого пользователя"""
+    X = recommender.feature_schema.transform(features_df)
+    return pd.util.hash_pandas_object(pd.DataFrame(X, copy=False), index=False).to_numpy()
+
+
+def build_scores(recommender, features_df, prefix='user_scores'):
+    """
+    Полный пересчет матрицы скоров по всем пользователям
+    """
+    print(f"🧮 Считаем скоры для {len(features_df):,} пользователей...")
+    products, proba, scores, _ = recommender._score_matrix(features_df)
+
+    arrays = {
+        'users': user_id_array(features_df['user_id']),
+        'hashes': feature_hashes(recommender, features_df),
+        'proba': proba,
+        'scores': scores,
+    }
+    _write(prefix, arrays, recommender, products)
+    print(f"💾 Скоры сохранены: {prefix}.*.npy ({len(products)} продуктов)")
+
+
+def refresh_scores(recommender, features_df, prefix='user_scores'):
+    """
+    Инкрементальное обновление: пересчитываем только пользователей, у которых изменились фичи
+    (и новых). Если модели изменились — полный пересчет
+    """
+    if not os.path.exists(f'{prefix}.meta.json'):
+        return build_scores(recommender, features_df, prefix)
+
+    store = ScoreStore(prefix)
+    if store.meta['models_fingerprint'] != models_fingerprint(recommender):
+        print("🔄 Модели или правила скоринга изменились — полный пересчет")
+        return build_scores(recommender, features_df, prefix)
+
+    user_ids = user_id_array(features_df['user_id'])
+    hashes = feature_hashes(recommender, features_df)
+
+    rows, known = store.rows_of(user_ids)
+    changed = ~known | (store.hashes[rows] != hashes)
+    unchanged_rows = rows[~changed]
+
+    proba = np.empty((len(features_df), len(store.products)), dtype=np.float32)
+    scores = np.empty_like(proba)
+    proba[~changed] = store.proba[unchanged_rows]
+    scores[~changed] = store.scores[unchanged_rows]
+
+    if changed.any():
+        _, proba[changed], scores[changed], _ = recommender._score_matrix(features_df[changed])
+
+    products = store.products
+    del store  # отпускаем memory-mapped файлы перед перезаписью
+
+    arrays = {'users': user_ids, 'hashes': hashes, 'proba': proba, 'scores': scores}
+    _write(prefix, arrays, recommender, products)
+    print(f"🔄 Пересчитано {changed.sum():,} из {len(features_df):,} пользователей")
+
+
+def _write(prefix, arrays, recommender, products):
+    """Запись с атомарной подменой каждого файла"""
+    for name in ARRAYS:
+        tmp_path = f'{prefix}.{name}.tmp.npy'
+        np.save(tmp_path, arrays[name])
+        os.replace(tmp_path, f'{prefix}.{name}.npy')
+
+    meta = {
+        'products': products,
+        'categories': [recommender.product_catalog[p]['category'] for p in products],
+        'priorities': [recommender.product_catalog[p]['priority'] for p in products],
+        'models_fingerprint': models_fingerprint(recommender),
+    }
+    tmp_path = f'{prefix}.meta.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, f'{prefix}.meta.json')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Предпосчитанные скоры рекомендаций')
+    parser.add_argument('command', choices=['build', 'refresh'])
+    parser.add_argument('--features', default='user_features_enhanced.pq')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--prefix', default='user_scores')
+    args = parser.parse_args()
+
+    recommender = MultiProductRecommender.load(args.models_dir)
+    features_df = pd.read_parquet(args.features)
+
+    if args.command == 'build':
+        build_scores(recommender, features_df, args.prefix)
+    else:
+        refresh_scores(recommender, features_df, args.prefix)
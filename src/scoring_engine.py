@@ -0,0 +1,153 @@
+# src/scoring_engine.py
+import json
+import numpy as np
+
+
+class FusedScoringEngine:
+    """
+    Единый движок скоринга: все деревья всех продуктов в одном наборе плоских массивов.
+    Один вызов predict_proba возвращает матрицу вероятностей пользователи × продукты
+    """
+
+    def __init__(self, products, model_dumps, chunk_size=4096):
+        self.products = list(products)
+        self.product_index = {p: j for j, p in enumerate(self.products)}
+        self.chunk_size = chunk_size
+        self.scaler_folded = False  # True — пороги в исходных единицах фичей, scaler.transform не нужен
+
+        left, right, feature, threshold, default_left, value = [], [], [], [], [], []
+        roots, tree_product, base_margin = [], [], []
+        offset = 0
+        max_depth = 0
+
+        for j, dump in enumerate(model_dumps):
+            learner = dump['learner']
+            if learner['objective']['name'] != 'binary:logistic':
+                raise ValueError(f"Неподдерживаемая цель {learner['objective']['name']} у {self.products[j]}")
+
+            base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+            base_margin.append(np.log(base_score / (1.0 - base_score)))
+
+            for tree in learner['gradient_booster']['model']['trees']:
+                if any(tree['split_type']):
+                    raise ValueError(f"Категориальные сплиты не поддерживаются ({self.products[j]})")
+
+                tree_left = np.asarray(tree['left_children'], dtype=np.int32)
+                tree_right = np.asarray(tree['right_children'], dtype=np.int32)
+                is_leaf = tree_left == -1
+                nodes = np.arange(len(tree_left), dtype=np.int32) + offset
+
+                # Листья зацикливаем на себя, чтобы все деревья проходились за max_depth шагов
+                left.append(np.where(is_leaf, nodes, tree_left + offset))
+                right.append(np.where(is_leaf, nodes, tree_right + offset))
+                feature.append(np.where(is_leaf, 0, tree['split_indices']).astype(np.int32))
+                conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+                threshold.append(np.where(is_leaf, np.float32(0), conditions))
+                value.append(np.where(is_leaf, conditions, np.float32(0)))
+                default_left.append(np.asarray(tree['default_left'], dtype=bool))
+
+                roots.append(offset)
+                tree_product.append(j)
+                max_depth = max(max_depth, _tree_depth(tree_left, tree_right))
+                offset += len(tree_left)
+
+        self.left = np.concatenate(left) if left else np.zeros(0, dtype=np.int32)
+        self.right = np.concatenate(right) if right else np.zeros(0, dtype=np.int32)
+        self.feature = np.concatenate(feature) if feature else np.zeros(0, dtype=np.int32)
+        self.threshold = np.concatenate(threshold) if threshold else np.zeros(0, dtype=np.float32)
+        self.value = np.concatenate(value) if value else np.zeros(0, dtype=np.float32)
+        self.default_left = np.concatenate(default_left) if default_left else np.zeros(0, dtype=bool)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.tree_product = np.asarray(tree_product, dtype=np.intp)
+        self.base_margin = np.asarray(base_margin, dtype=np.float32)
+        self.max_depth = max_depth
+
+        # Деревья одного продукта идут подряд — суммируем их через reduceat.
+        # Продукты без деревьев (0 раундов) в reduceat не передаем: их отступы повторялись бы
+        # или выходили за границу; у них остается только base_margin
+        self.product_tree_start = np.searchsorted(self.tree_product, np.arange(len(self.products)))
+        self.product_has_trees = np.bincount(self.tree_product, minlength=len(self.products)) > 0
+
+    @classmethod
+    def from_models(cls, models, scaler=None):
+        """Движок из словаря {продукт: XGBClassifier}; со scaler — сразу встраиваем его в пороги"""
+        dumps = [json.loads(model.get_booster().save_raw('json')) for model in models.values()]
+        engine = cls(models.keys(), dumps)
+        if scaler is not None:
+            engine.fold_scaler(scaler)
+        return engine
+
+    @classmethod
+    def from_dir(cls, models_dir, products):
+        """Движок из файлов models/model_<product>.json"""
+        dumps = []
+        for product in products:
+            with open(f'{models_dir}/model_{product}.json') as f:
+                dumps.append(json.load(f))
+        return cls(products, dumps)
+
+    def fold_scaler(self, scaler):
+        """
+        Встраиваем StandardScaler в пороги сплитов: (x - mean) / scale < t  <=>  x < t * scale + mean
+        (scale > 0 всегда). После этого движок принимает немасштабированные float32-фичи
+        """
+        if self.scaler_folded:
+            raise ValueError("Scaler уже встроен в движок")
+
+        n_features = int(self.feature.max()) + 1 if len(self.feature) else 0
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+
+        split = self.left != np.arange(len(self.left))  # листья зациклены на себя
+        feature = self.feature[split]
+        folded = self.threshold[split].astype(np.float64) * scale[feature] + mean[feature]
+        self.threshold[split] = folded.astype(np.float32)
+        self.scaler_folded = True
+        return self
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def predict_proba(self, X):
+        """
+        Вероятности положительного класса для всех продуктов: (n_users, n_products) float32
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+
+        proba = np.empty((len(X), len(self.products)), dtype=np.float32)
+        for start in range(0, len(X), self.chunk_size):
+            chunk = X[start:start + self.chunk_size]
+            proba[start:start + len(chunk)] = self._predict_chunk(chunk)
+
+        return proba
+
+    def _predict_chunk(self, X):
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), self.n_trees))
+
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[node]]
+            go_left = np.where(np.isnan(x), self.default_left[node], x < self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        margin = np.zeros((len(X), len(self.products)), dtype=np.float32)
+        if self.n_trees:
+            margin[:, self.product_has_trees] = np.add.reduceat(
+                self.value[node], self.product_tree_start[self.product_has_trees], axis=1)
+        margin += self.base_margin
+
+        return 1.0 / (1.0 + np.exp(-margin))
+
+
+def _tree_depth(left, right):
+    """Глубина дерева (число сплитов на самом длинном пути)"""
+    depth = np.zeros(len(left), dtype=np.int32)
+    for node in range(len(left)):
+        if left[node] != -1:
+            depth[left[node]] = depth[node] + 1
+            depth[right[node]] = depth[node] + 1
+    leaves = left == -1
+    return int(depth[leaves].max()) if leaves.any() else 0
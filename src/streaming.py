@@ -0,0 +1,176 @@
+# src/streaming.py
+import os
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import pyarrow.parquet as pq
+import xgboost as xgb
+from sklearn.preprocessing import StandardScaler
+
+from .feature_schema import FeatureSchema, scale_inplace
+from .results import recommendation_schema, user_id_type
+
+
+def iter_feature_chunks(path, chunk_size=100_000, columns=None):
+    """
+    Читаем Parquet по частям (батчи row group'ов) — в памяти одновременно только один чанк
+    """
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def top_n_table(recommender, features_df, top_n=10, category_filter=None, user_ids=None):
+    """
+    Top-N рекомендаций чанка в виде Arrow-таблицы: по top_n строк на пользователя, в порядке ранга
+    """
+    if user_ids is None:
+        user_ids = features_df['user_id'].to_numpy()
+    batch = recommender.recommend_batch(features_df, top_n, category_filter, explain=False)
+    return batch.to_arrow(user_ids)
+
+
+def score_parquet_stream(recommender, in_path, out_path, top_n=10, chunk_size=100_000, category_filter=None):
+    """
+    Потоковый скоринг: чанк фичей -> масштабирование -> модели -> top-N -> дозапись в Parquet.
+    Пиковая память определяется размером чанка, а не размером выборки
+    """
+    print(f"🌊 Потоковый скоринг {in_path} -> {out_path} (чанк {chunk_size:,})")
+    start = time.perf_counter()
+
+    # Тип user_id выдачи — как во входном файле (целые -> int64/uint64, строки -> string)
+    schema = recommendation_schema(user_id_type(pq.ParquetFile(in_path).schema_arrow.field('user_id').type))
+
+    total = 0
+    with pq.ParquetWriter(out_path, schema) as writer:
+        for chunk in iter_feature_chunks(in_path, chunk_size):
+            writer.write_table(top_n_table(recommender, chunk, top_n, category_filter))
+
+            total += len(chunk)
+            print(f"   Обработано {total:,} пользователей")
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Готово: {total:,} пользователей за {elapsed:.1f} с ({total / max(elapsed, 1e-9):,.0f} польз./с)")
+    return total
+
+
+class _ChunkIter(xgb.DataIter):
+    """Итератор XGBoost по сохраненным на диск чанкам (external memory)"""
+
+    def __init__(self, chunk_paths, product_idx, cache_prefix):
+        self.chunk_paths = chunk_paths
+        self.product_idx = product_idx
+        self._it = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._it == len(self.chunk_paths):
+            return False
+        x_path, y_path = self.chunk_paths[self._it]
+        X = np.load(x_path, mmap_mode='r')
+        y = np.load(y_path, mmap_mode='r')[:, self.product_idx]
+        input_data(data=np.asarray(X), label=np.asarray(y, dtype=np.float32))
+        self._it += 1
+        return True
+
+    def reset(self):
+        self._it = 0
+
+
+def train_out_of_core(recommender, path, chunk_size=100_000, work_dir=None):
+    """
+    Обучение без загрузки всей выборки в память:
+    1) проход по чанкам — partial_fit scaler и подсчет меток;
+    2) проход — масштабированные чанки и метки сохраняются на диск;
+    3) для каждого продукта — external-memory DMatrix поверх чанков и xgb.train.
+    Оценка на отложенной выборке в этом режиме не выполняется
+    """
+    print(f"🤖 ОБУЧАЕМ СИСТЕМУ ПОТОКОВО ({path}, чанк {chunk_size:,})...")
+    work_dir = work_dir or tempfile.mkdtemp(prefix='recommender_ooc_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        # 1. Scaler и статистика меток
+        # Scaler обучается заново: partial_fit поверх загруженного смешал бы статистику старой выборки
+        recommender.scaler = StandardScaler()
+        positive = np.zeros(len(recommender.all_products), dtype=np.int64)
+        n_rows = 0
+        for chunk in iter_feature_chunks(path, chunk_size):
+            if recommender.feature_schema is None:
+                recommender.feature_schema = FeatureSchema.fit(chunk)
+                recommender.feature_names = recommender.feature_schema.columns
+            recommender.scaler.partial_fit(recommender.feature_schema.transform(chunk))
+            positive += recommender.create_target_matrix(chunk, verbose=False).sum(axis=0, dtype=np.int64)
+            n_rows += len(chunk)
+
+        print(f"📋 {n_rows:,} пользователей, {len(recommender.feature_names)} признаков")
+
+        # 2. Масштабированные чанки на диск
+        chunk_paths = []
+        for i, chunk in enumerate(iter_feature_chunks(path, chunk_size)):
+            X = recommender.feature_schema.transform(chunk)
+            x_path = os.path.join(work_dir, f'X_{i}.npy')
+            y_path = os.path.join(work_dir, f'y_{i}.npy')
+            np.save(x_path, scale_inplace(X, recommender.scaler))
+            np.save(y_path, recommender.create_target_matrix(chunk, verbose=False))
+            chunk_paths.append((x_path, y_path))
+
+        # 3. Модели по продуктам
+        print("🚀 Обучаем модели (external memory)...")
+        for i, product in enumerate(recommender.all_products):
+            positive_examples = positive[i]
+            negative_examples = n_rows - positive_examples
+            if positive_examples < 2:
+                print(f"   ⏭️  Пропускаем {product}: недостаточно данных ({positive_examples}+ примеров)")
+                continue
+
+            params = {
+                'objective': 'binary:logistic',
+                'max_depth': 4,
+                'eta': 0.1,
+                'seed': 42,
+                'verbosity': 0,
+                'tree_method': 'hist',
+                'scale_pos_weight': negative_examples / (positive_examples + 1),
+            }
+            it = _ChunkIter(chunk_paths, i, cache_prefix=os.path.join(work_dir, f'cache_{product}'))
+            dtrain = xgb.ExtMemQuantileDMatrix(it) if hasattr(xgb, 'ExtMemQuantileDMatrix') else xgb.DMatrix(it)
+            booster = xgb.train(params, dtrain, num_boost_round=50)
+
+            model = xgb.XGBClassifier()
+            model.load_model(bytearray(booster.save_raw('ubj')))
+            recommender.models[product] = model
+            recommender.positive_rates[product] = float(positive_examples / n_rows)
+            print(f"   ✅ Обучили {product}: {positive_examples}+ примеров")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"✅ Обучено {len(recommender.models)} моделей из {len(recommender.all_products)}")
+    if recommender.engine is not None:
+        recommender.use_fused_engine()
+    recommender._invalidate_cache()
+    # Отпечатков меток в потоковом режиме нет — следующее дообучение затронет все продукты
+    recommender.label_fingerprints = {}
+    if recommender.models:
+        recommender._save_models()
+    return recommender
+
+
+if __name__ == "__main__":
+    import argparse
+    from .multi_product_recommender import MultiProductRecommender
+
+    parser = argparse.ArgumentParser(description='Потоковый скоринг Parquet-файла с фичами')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--category')
+    args = parser.parse_args()
+
+    recommender = MultiProductRecommender.load(args.models_dir)
+    score_parquet_stream(recommender, args.input, args.output, top_n=args.top_n,
+                         chunk_size=args.chunk_size, category_filter=args.category)
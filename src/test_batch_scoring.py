@@ -0,0 +1,884 @@
+import os
+import shutil
+import json
+import asyncio
+import importlib
+import numpy as np
+import pytest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xgboost as xgb
+import sys
+
+# Добавляем путь к src
+sys.path.append('.')
+
+from src.multi_product_recommender import MultiProductRecommender
+from src.scoring_engine import FusedScoringEngine
+from src.model_store import PACK_FILE, MissingModelsError, PackedModels, pack_models_dir
+from src.recommendation_cache import RecommendationCache
+from src.score_store import ScoreStore, build_scores, refresh_scores
+from src.streaming import score_parquet_stream, train_out_of_core
+from src.feature_schema import FeatureSchema, scale_inplace
+from src.instrumentation import InMemorySink, PrometheusSink, JsonLogSink
+from src.model_health import validate_models
+from src.boost_rules import USER_TYPES, BoostTables
+from src.evaluation import evaluate_recommender, stratified_sample
+from src.report_summary import RecommendationSummary
+from src.results import RecommendationBatch
+
+
+def _load():
+    recommender = MultiProductRecommender.load('models')
+    features_df = pd.read_parquet('user_features_enhanced.pq').iloc[:200]
+    return recommender, features_df
+
+
+def test_recommend_batch_matches_recommend():
+    """recommend_batch дает то же, что recommend для каждого пользователя"""
+    recommender, features_df = _load()
+
+    batch = recommender.recommend_batch(features_df, top_n=5)
+    single = [recommender.recommend(user, top_n=5) for user in features_df.to_dict('records')]
+
+    assert batch == single
+
+    # Без моделей — пустая выдача того же типа, по пустому списку на пользователя
+    empty = MultiProductRecommender().recommend_batch(features_df.iloc[:3])
+    assert isinstance(empty, RecommendationBatch) and list(empty) == [[], [], []]
+    assert empty.to_arrow().num_rows == 0
+
+
+def test_recommend_batch_category_filter():
+    """Фильтр по категории и top_n больше числа продуктов"""
+    recommender, features_df = _load()
+
+    for category in ['savings', 'cards', 'investments']:
+        batch = recommender.recommend_batch(features_df, top_n=3, category_filter=category)
+        single = [recommender.recommend(user, top_n=3, category_filter=category)
+                  for user in features_df.to_dict('records')]
+        assert batch == single
+
+    batch = recommender.recommend_batch(features_df, top_n=100)
+    assert all(len(recs) == len(recommender.models) for recs in batch)
+
+
+def test_fused_engine_matches_models():
+    """Единый движок дает те же вероятности, что predict_proba каждой модели"""
+    recommender, features_df = _load()
+    X_scaled = recommender.scaler.transform(features_df[recommender.feature_names])
+
+    engine = FusedScoringEngine.from_dir('models', list(recommender.models))
+    proba = engine.predict_proba(X_scaled)
+    expected = np.column_stack([m.predict_proba(X_scaled)[:, 1] for m in recommender.models.values()])
+
+    assert proba.shape == expected.shape
+    np.testing.assert_allclose(proba, expected, atol=1e-6)
+
+    recommender.use_fused_engine()
+    recs = recommender.recommend(features_df.iloc[0].to_dict(), top_n=5)
+    assert len(recs) == 5
+
+
+def test_fused_engine_empty_products():
+    """Продукт без деревьев (0 раундов) и пустой словарь моделей не ломают reduceat"""
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 3)).astype(np.float32)
+    y = (X[:, 0] > 0.3).astype(int)
+    models = {
+        'empty_first': xgb.XGBClassifier(n_estimators=0).fit(X, y),
+        'trained': xgb.XGBClassifier(n_estimators=5, max_depth=3).fit(X, y),
+        'empty_last': xgb.XGBClassifier(n_estimators=0).fit(X, 1 - y),
+    }
+
+    # Пустой бустер XGBoost отдает base_score как есть; у движка продукт без деревьев — это base_margin
+    base_score = [float(json.loads(models[p].get_booster().save_raw('json'))
+                        ['learner']['learner_model_param']['base_score'].strip('[]')) for p in ('empty_first', 'empty_last')]
+    proba = FusedScoringEngine.from_models(models).predict_proba(X)
+    np.testing.assert_allclose(proba[:, 1], models['trained'].predict_proba(X)[:, 1], atol=1e-6)
+    np.testing.assert_allclose(proba[:, [0, 2]], np.broadcast_to(base_score, (len(X), 2)), atol=1e-6)
+
+    only_empty = FusedScoringEngine.from_models({p: models[p] for p in ('empty_first', 'empty_last')})
+    np.testing.assert_allclose(only_empty.predict_proba(X), proba[:, [0, 2]], atol=1e-6)
+
+    assert FusedScoringEngine.from_models({}).predict_proba(X).shape == (len(X), 0)
+
+
+def test_parallel_training_matches_sequential(tmp_path, monkeypatch):
+    """Обучение в n_workers потоках дает те же бустеры, что последовательное; потоки XGBoost делятся между воркерами"""
+    features_df = pd.read_parquet('user_features_enhanced.pq').iloc[:400]
+    n_jobs_used = []
+    fit_product_model = MultiProductRecommender._fit_product_model
+
+    def spy(self, X_train, y, scale_pos_weight, n_jobs=None, *args):
+        n_jobs_used.append(n_jobs)
+        return fit_product_model(self, X_train, y, scale_pos_weight, n_jobs, *args)
+
+    monkeypatch.setattr(MultiProductRecommender, '_fit_product_model', spy)
+    trained = {}
+    for n_workers in (1, 4):
+        recommender = MultiProductRecommender()
+        recommender.models_dir = str(tmp_path / f'models_{n_workers}')
+        n_jobs_used.clear()
+        trained[n_workers] = recommender.train(features_df, n_workers=n_workers)
+        expected_n_jobs = None if n_workers == 1 else max(1, (os.cpu_count() or 1) // n_workers)
+        assert n_jobs_used and set(n_jobs_used) == {expected_n_jobs}
+
+    sequential, parallel = trained[1], trained[4]
+    assert list(parallel.models) == list(sequential.models)
+    for product, model in sequential.models.items():
+        assert parallel.models[product].get_booster().save_raw('ubj') == model.get_booster().save_raw('ubj')
+
+
+def test_scaler_folding_matches_pipeline():
+    """Масштабирование на месте совпадает со scaler.transform, движок со встроенным scaler — с моделями"""
+    recommender, features_df = _load()
+    X = recommender.feature_schema.transform(features_df)
+    X_scaled = recommender.scaler.transform(X)
+
+    np.testing.assert_array_equal(scale_inplace(X.copy(), recommender.scaler), X_scaled)
+
+    engine = FusedScoringEngine.from_models(recommender.models, recommender.scaler)
+    expected = np.column_stack([m.predict_proba(X_scaled)[:, 1] for m in recommender.models.values()])
+    np.testing.assert_allclose(engine.predict_proba(X), expected, atol=1e-6)
+
+
+def _threshold_users(n=3000, seed=0):
+    """Пользователи со значениями вокруг порогов правил (включая равенство порогу и NaN)"""
+    rng = np.random.default_rng(seed)
+    counts = [0, 20, 30, 50, 60, 80, 100, 120, 150, 200, 250]
+    ratios = [0.0, 0.08, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, np.nan]
+    df = pd.DataFrame({
+        'market_events': rng.choice(counts, n) + rng.choice([-1, 0, 1], n),
+        'engagement_ratio': rng.choice(ratios, n),
+        'offers_engagement': rng.choice([0, 10, 11, 15, 16, 20], n),
+        'tech_interest_ratio': rng.choice(ratios, n),
+        'home_interest_ratio': rng.choice(ratios, n),
+        'sports_interest_ratio': rng.choice(ratios, n),
+        'diversity_ratio': rng.choice(ratios, n),
+    })
+    # retail_events нет — правила должны считать его нулем
+    return df
+
+
+def test_target_matrix_matches_row_wise():
+    """create_target_matrix совпадает с построчной create_smart_targets"""
+    recommender = MultiProductRecommender()
+
+    for features_df in [pd.read_parquet('user_features_enhanced.pq'), _threshold_users()]:
+        targets = recommender.create_smart_targets(features_df)
+        expected = np.array([[p in set(t) for p in recommender.all_products] for t in targets])
+
+        y = recommender.create_target_matrix(features_df)
+        assert y.dtype == np.uint8
+        np.testing.assert_array_equal(y.astype(bool), expected)
+
+        types = recommender._detect_user_types(features_df)
+        expected_types = [recommender._detect_user_type(row) for _, row in features_df.iterrows()]
+        assert list(types) == expected_types
+
+
+def test_packed_models_roundtrip(tmp_path):
+    """Упакованный файл дает те же рекомендации, а пропавшая модель — громкую ошибку"""
+    models_dir = tmp_path / 'models'
+    shutil.copytree('models', models_dir, ignore=shutil.ignore_patterns(PACK_FILE))
+    features_df = pd.read_parquet('user_features_enhanced.pq').iloc[:100]
+
+    from_json = MultiProductRecommender.load(str(models_dir)).recommend_batch(features_df)
+    pack_models_dir(str(models_dir))
+    loaded = MultiProductRecommender.load(str(models_dir))
+    assert not loaded.models._loaded  # проверка при загрузке не разбирает бустеры
+    from_pack = loaded.recommend_batch(features_df)
+    assert from_pack == from_json
+
+    # Испорченный блок бустера в упакованном файле — модель в карантине
+    damaged = loaded.models.header['trained_models'][-1]
+    packed = loaded.models
+    loaded.close()
+    assert packed._mmap.closed and packed._file.closed
+    with PackedModels(str(models_dir / PACK_FILE)) as packed:
+        assert packed[damaged].get_booster().num_boosted_rounds() > 0
+    assert packed._file.closed
+    del loaded
+    with open(models_dir / PACK_FILE, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    loaded = MultiProductRecommender.load(str(models_dir))
+    assert list(loaded.health.quarantined) == [damaged]
+    assert damaged not in loaded.models and damaged in loaded.fallback_proba
+    del loaded
+
+    # JSON-модель переписана после упаковки — устаревший упакованный файл не используется
+    product, other = [p.name[len('model_'):-len('.json')] for p in sorted(models_dir.glob('model_*.json'))[:2]]
+    shutil.copy(models_dir / f'model_{other}.json', models_dir / f'model_{product}.json')
+    loaded = MultiProductRecommender.load(str(models_dir))
+    assert loaded.models[product].get_booster().save_raw('ubj') == loaded.models[other].get_booster().save_raw('ubj')
+
+    os.remove(models_dir / PACK_FILE)
+    os.remove(models_dir / f'model_{product}.json')
+    with pytest.raises(MissingModelsError) as error:
+        MultiProductRecommender.load(str(models_dir))
+    assert error.value.missing == [product]
+
+
+def test_recommendation_cache():
+    """LRU-вытеснение, TTL и сброс кэша при смене моделей"""
+    now = [0.0]
+    cache = RecommendationCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)  # вытесняет 'b' — к нему дольше всего не обращались
+    assert cache.get('b') is None
+    now[0] = 11
+    assert cache.get('a') is None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['expirations'] == 1
+
+    recommender, features_df = _load()
+    recommender.enable_cache()
+    user = features_df.iloc[0].to_dict()
+    first = recommender.recommend(user, top_n=5)
+    first[0].score = -1.0  # изменение выдачи вызывающим кодом не портит кэш
+    hit = recommender.recommend(user, top_n=5)
+    assert hit == recommender.recommend(user, top_n=5) and hit[0].score != -1.0
+    assert hit[0] is not recommender.recommend(user, top_n=5)[0]
+    assert recommender.cache.stats()['hits'] == 3
+
+    # Нечисловое значение фичи: ключ строится из строки схемы (значение -> пропуск -> заполнение 0)
+    odd = dict(user, market_likes='n/a')
+    assert recommender.recommend(odd, top_n=5) == recommender.recommend(dict(user, market_likes=0), top_n=5)
+
+    recommender.use_fused_engine()
+    assert len(recommender.cache) == 0
+
+
+def test_score_store_matches_recommend(tmp_path):
+    """Ответы из предпосчитанной матрицы совпадают с recommend; refresh пересчитывает изменившихся"""
+    recommender, features_df = _load()
+    prefix = str(tmp_path / 'user_scores')
+    build_scores(recommender, features_df, prefix)
+
+    store = ScoreStore(prefix)
+    for user in features_df.iloc[:20].to_dict('records'):
+        for category in [None, 'cards', 'investments']:
+            expected = recommender.recommend(user, top_n=5, category_filter=category, explain=False)
+            assert store.recommend(user['user_id'], top_n=5, category_filter=category) == expected
+
+    changed_df = features_df.copy()
+    changed_df.loc[changed_df.index[:10], 'market_events'] += 200
+    refresh_scores(recommender, changed_df, prefix)
+
+    full_prefix = str(tmp_path / 'full')
+    build_scores(recommender, changed_df, full_prefix)
+    refreshed, full = ScoreStore(prefix), ScoreStore(full_prefix)
+    np.testing.assert_array_equal(refreshed.scores, full.scores)
+    del refreshed, full
+
+    # Правило бустинга изменилось, фичи — нет: refresh пересчитывает всех
+    recommender.boost_tables = BoostTables(behavior_boosts=[('cards', 'engagement_ratio', 0.0, 3.0)])
+    refresh_scores(recommender, changed_df, prefix)
+    store = ScoreStore(prefix)
+    for user in changed_df.iloc[:20].to_dict('records'):
+        assert store.recommend(user['user_id'], top_n=5) == recommender.recommend(user, top_n=5, explain=False)
+
+
+def test_score_store_string_user_ids(tmp_path):
+    """Строковые user_id (test_features.pq) хранятся memory-mapped и находятся поиском"""
+    recommender, _ = _load()
+    features_df = pd.read_parquet('test_features.pq')
+    prefix = str(tmp_path / 'user_scores')
+    build_scores(recommender, features_df.iloc[:60], prefix)
+
+    store = ScoreStore(prefix)
+    assert isinstance(store.users, np.memmap) and store.users.dtype.kind == 'U'
+    for user in features_df.iloc[:10].to_dict('records'):
+        assert store.recommend(user['user_id'], top_n=5) == recommender.recommend(user, top_n=5, explain=False)
+    assert store.recommend('no_such_user') == []
+    del store
+
+    # Новые пользователи с более длинными id — пересчитываются только они
+    refresh_scores(recommender, features_df, prefix)
+    store = ScoreStore(prefix)
+    user = features_df.iloc[-1].to_dict()
+    assert store.recommend(user['user_id'], top_n=5) == recommender.recommend(user, top_n=5, explain=False)
+
+
+def test_stream_scoring_matches_batch(tmp_path):
+    """Потоковый скоринг по чанкам дает те же top-N, что recommend_batch"""
+    recommender, features_df = _load()
+    in_path, out_path = tmp_path / 'features.pq', tmp_path / 'scores.pq'
+    features_df.to_parquet(in_path)
+
+    score_parquet_stream(recommender, in_path, out_path, top_n=5, chunk_size=64)
+    streamed = pd.read_parquet(out_path)
+
+    batch = recommender.recommend_batch(features_df, top_n=5)
+    assert streamed['product_id'].tolist() == [rec.product_id for recs in batch for rec in recs]
+    assert streamed['score'].tolist() == [rec.score for recs in batch for rec in recs]
+    assert pq.read_table(out_path).equals(batch.to_arrow(features_df['user_id']))
+
+
+def test_stream_scoring_string_user_ids(tmp_path):
+    """Строковые user_id (test_features.pq) попадают в выдачу как есть, без приведения к uint64"""
+    recommender, _ = _load()
+    features_df = pd.read_parquet('test_features.pq')
+    out_path = tmp_path / 'scores.pq'
+
+    score_parquet_stream(recommender, 'test_features.pq', out_path, top_n=5, chunk_size=32)
+    streamed = pq.read_table(out_path)
+
+    assert streamed.schema.field('user_id').type == pa.string()
+    assert streamed.equals(recommender.recommend_batch(features_df, top_n=5).to_arrow(features_df['user_id']))
+    first = features_df.iloc[0].to_dict()
+    expected = recommender.recommend(first, top_n=5, explain=False)
+    rows = streamed.to_pandas()
+    assert rows.loc[rows['user_id'] == first['user_id'], 'product_id'].tolist() == [rec.product_id for rec in expected]
+
+
+def test_out_of_core_training_refits_scaler(tmp_path):
+    """Потоковое обучение: scaler по новой выборке (не поверх загруженного), доли положительных записаны"""
+    features_df = pd.read_parquet('user_features_enhanced.pq').iloc[:400]
+    in_path = tmp_path / 'features.pq'
+    features_df.to_parquet(in_path)
+    models_dir = tmp_path / 'models'
+    shutil.copytree('models', models_dir)
+
+    recommender = MultiProductRecommender.load(str(models_dir))
+    recommender.positive_rates = {}
+    train_out_of_core(recommender, in_path, chunk_size=128, work_dir=str(tmp_path / 'work'))
+
+    X = recommender.feature_schema.transform(features_df)
+    assert recommender.scaler.n_samples_seen_ == len(features_df)
+    np.testing.assert_allclose(recommender.scaler.mean_, X.astype(np.float64).mean(axis=0), rtol=1e-5, atol=1e-8)
+    labels = recommender.create_target_matrix(features_df, verbose=False)
+    assert set(recommender.positive_rates) <= set(recommender.models)
+    for product, rate in recommender.positive_rates.items():
+        assert rate == pytest.approx(labels[:, recommender.all_products.index(product)].mean())
+
+
+def test_feature_schema_inputs_match():
+    """DataFrame, Arrow-таблица, список словарей и словарь дают одну и ту же float32-матрицу"""
+    recommender, features_df = _load()
+    schema = recommender.feature_schema
+
+    expected = features_df.reindex(columns=schema.columns).apply(pd.to_numeric, errors='coerce').fillna(0)
+    X = schema.transform(features_df)
+    assert X.dtype == np.float32 and X.flags['C_CONTIGUOUS']
+    np.testing.assert_array_equal(X, expected.to_numpy(dtype=np.float32))
+
+    np.testing.assert_array_equal(schema.transform(pa.Table.from_pandas(features_df)), X)
+    records = features_df.to_dict('records')
+    np.testing.assert_array_equal(schema.transform(records), X)
+    np.testing.assert_array_equal(schema.transform(records[0]), X[:1])
+
+    # Пропущенная колонка и нечисловое значение -> значение заполнения
+    user = dict(records[0])
+    user[schema.columns[1]] = 'n/a'
+    del user[schema.columns[0]]
+    row = schema.transform(user)[0]
+    assert row[0] == 0 and row[1] == 0
+
+    assert FeatureSchema.from_dict(schema.to_dict()).fingerprint() == schema.fingerprint()
+
+
+def test_micro_batcher_matches_recommend():
+    """Микробатчер собирает одновременные запросы в батчи и отвечает так же, как recommend"""
+    service = importlib.import_module('src.09_recommendation_service')
+    recommender, features_df = _load()
+    users = features_df.iloc[:40].to_dict('records')
+
+    async def run():
+        batcher = service.MicroBatcher(recommender, max_batch_size=16, max_wait_ms=20, max_queue=100)
+        batcher.start()
+        try:
+            results = await asyncio.gather(*[batcher.submit(user, top_n=5) for user in users])
+        finally:
+            await batcher.stop()
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [recommender.recommend(user, top_n=5) for user in users]
+    assert stats['batches'] < len(users) and stats['avg_batch_size'] > 1
+
+    async def overflow():
+        batcher = service.MicroBatcher(recommender, max_queue=1)  # без воркера очередь не разбирается
+        first = asyncio.ensure_future(batcher.submit(users[0], timeout=0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(service.QueueFullError):
+            await batcher.submit(users[1])
+        with pytest.raises(asyncio.TimeoutError):
+            await first
+        await batcher.stop()
+
+    asyncio.run(overflow())
+
+
+def test_service_heterogeneous_users_and_bad_requests():
+    """Запросы с разным набором фичей считаются как recommend; кривые Content-Length и top_n — 400"""
+    service = importlib.import_module('src.09_recommendation_service')
+    recommender, features_df = _load()
+    users = features_df.iloc[:12].to_dict('records')
+    # У части пользователей нет фичей, от которых зависят тип и поведение
+    for user in users[::3]:
+        for name in ('market_events', 'engagement_ratio', 'home_interest_ratio'):
+            user.pop(name)
+
+    async def request(port, raw):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(raw)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        writer.close()
+        return status
+
+    async def run():
+        server = service.RecommendationService(recommender, max_wait_ms=20)
+        port = await server.start(port=0)
+        try:
+            results = await asyncio.gather(*[server.batcher.submit(user, top_n=5) for user in users])
+            body = json.dumps({'user': users[0], 'top_n': 0}).encode()
+            statuses = [
+                await request(port, b'POST /recommend HTTP/1.1\r\nContent-Length: abc\r\n\r\n'),
+                await request(port, b'POST /recommend HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body),
+            ]
+        finally:
+            await server.stop()
+        return results, statuses
+
+    results, statuses = asyncio.run(run())
+    assert results == [recommender.recommend(user, top_n=5) for user in users]
+    assert statuses == [400, 400]
+
+
+def test_bulk_scoring_resumes_from_checkpoint(tmp_path):
+    """Массовый скоринг после сбоя продолжает с чекпоинта и дает тот же файл, что полный прогон"""
+    bulk = importlib.import_module('src.11_bulk_scoring')
+    _, features_df = _load()
+    in_path = str(tmp_path / 'users.jsonl')
+    features_df.to_json(in_path, orient='records', lines=True)
+
+    full_path = str(tmp_path / 'full.jsonl')
+    assert bulk.bulk_score(in_path, full_path, top_n=3, batch_size=64, workers=1) == len(features_df)
+    with open(full_path, encoding='utf-8') as f:
+        full = f.read()
+
+    # "Сбой": записаны 2 пачки по чекпоинту и кусок третьей сверх него
+    resumed_path = str(tmp_path / 'resumed.jsonl')
+    bulk.bulk_score(in_path, resumed_path, top_n=3, batch_size=64, workers=1)
+    lines = full.splitlines(keepends=True)
+    head = ''.join(lines[:128]).encode('utf-8')
+    with open(resumed_path, 'wb') as f:
+        f.write(head + lines[128][:20].encode('utf-8'))
+    checkpoint_path = resumed_path + '.checkpoint.json'
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    checkpoint.update(records_done=128, batches_done=2, output_bytes=len(head), complete=False)
+    with open(checkpoint_path, 'w') as f:
+        json.dump(checkpoint, f)
+
+    bulk.bulk_score(in_path, resumed_path, top_n=3, batch_size=64, workers=1)
+    with open(resumed_path, encoding='utf-8') as f:
+        assert f.read() == full
+
+    first = json.loads(lines[0])
+    assert first['user_id'] == features_df['user_id'].iloc[0] and len(first['recommendations']) == 3
+
+
+def test_bulk_scoring_keeps_user_ids_and_empty_users(tmp_path):
+    """Строка JSONL на каждого входного пользователя: исходные строковые id, пустые выдачи не теряются"""
+    bulk = importlib.import_module('src.11_bulk_scoring')
+    recommender, _ = _load()
+    features_df = pd.read_parquet('test_features.pq')
+    in_path = str(tmp_path / 'users.jsonl')
+    features_df.to_json(in_path, orient='records', lines=True)
+
+    out_path = str(tmp_path / 'scores.jsonl')
+    bulk.bulk_score(in_path, out_path, top_n=3, batch_size=32, workers=1)
+    with open(out_path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['user_id'] for line in lines] == features_df['user_id'].tolist()
+    expected = recommender.recommend(features_df.iloc[0].to_dict(), top_n=3, explain=False)
+    assert [rec['product_id'] for rec in lines[0]['recommendations']] == [rec.product_id for rec in expected]
+
+    # Категория без продуктов: у всех пользователей пустые выдачи, строк столько же
+    empty_path = str(tmp_path / 'empty.jsonl')
+    bulk.bulk_score(in_path, empty_path, top_n=3, category_filter='no_such_category', batch_size=32, workers=1)
+    with open(empty_path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['user_id'] for line in lines] == features_df['user_id'].tolist()
+    assert all(line['recommendations'] == [] for line in lines)
+
+    # Колонки user_id нет — ключ записи — ее номер во входе
+    records = features_df.drop(columns='user_id').iloc[:5]
+    np.testing.assert_array_equal(bulk._user_ids(records, 10), np.arange(10, 15))
+
+    # У записи нет части фичей (тип и поведение пользователя) — как recommend, где их нет в словаре
+    users = features_df.iloc[:4].to_dict('records')
+    for name in ('market_events', 'engagement_ratio', 'home_interest_ratio'):
+        users[1].pop(name)
+    partial_path = str(tmp_path / 'partial.jsonl')
+    with open(partial_path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(user) + '\n' for user in users)
+    bulk.bulk_score(partial_path, str(tmp_path / 'partial_scores.jsonl'), top_n=5, workers=1)
+    with open(tmp_path / 'partial_scores.jsonl', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    for user, line in zip(users, lines):
+        expected = recommender.recommend(user, top_n=5, explain=False)
+        assert [rec['product_id'] for rec in line['recommendations']] == [rec.product_id for rec in expected]
+
+
+def test_service_isolates_failed_requests():
+    """Ошибка скоринга одного запроса не валит соседей по батчу: им — ответ, ему — 500; нечисловая фича — 400"""
+    service = importlib.import_module('src.09_recommendation_service')
+    recommender, features_df = _load()
+    users = features_df.iloc[:6].to_dict('records')
+    users[2]['user_id'] = 'bad'
+
+    class Flaky:
+        feature_names = recommender.feature_names
+
+        def recommend_batch(self, batch_df, *args):
+            if (batch_df['user_id'] == 'bad').any():
+                raise ValueError('bad user')
+            return recommender.recommend_batch(batch_df, *args)
+
+    async def request(port, payload):
+        body = json.dumps(payload).encode()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST /recommend HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        writer.close()
+        return status
+
+    async def run():
+        server = service.RecommendationService(Flaky(), max_wait_ms=20)
+        port = await server.start(port=0)
+        try:
+            results = await asyncio.gather(*[server.batcher.submit(user, top_n=5) for user in users],
+                                           return_exceptions=True)
+            statuses = await asyncio.gather(
+                request(port, {'user': users[0], 'top_n': 5}),
+                request(port, {'user': users[2], 'top_n': 5}),
+                request(port, {'user': dict(users[1], market_events='many'), 'top_n': 5}),
+            )
+        finally:
+            await server.stop()
+        return results, statuses
+
+    results, statuses = asyncio.run(run())
+    assert isinstance(results[2], ValueError)
+    assert [r for i, r in enumerate(results) if i != 2] == [
+        recommender.recommend(user, top_n=5) for i, user in enumerate(users) if i != 2
+    ]
+    assert statuses == [200, 500, 400]
+
+
+def test_benchmark_baseline_comparison():
+    """Синтетика повторяет схему test_features.csv, сравнение с базовой линией ловит только заметный рост"""
+    benchmark = importlib.import_module('src.08_benchmark')
+    users_df = benchmark.make_schema_users(50, seed=1)
+    template = pd.read_csv('test_features.csv')
+    assert len(users_df) == 50 and set(users_df.columns) == set(template.columns) - {'user_profile'}
+    assert users_df.equals(benchmark.make_schema_users(50, seed=1))
+
+    baseline = {'results': {'fast': {'p50_ms': 0.2}, 'slow': {'p50_ms': 10.0}, 'stable': {'p50_ms': 10.0}}}
+    current = {'results': {'fast': {'p50_ms': 0.5}, 'slow': {'p50_ms': 20.0}, 'stable': {'p50_ms': 11.0}, 'new': {'p50_ms': 1.0}}}
+    regressions = benchmark.compare_to_baseline(current, baseline, tolerance=0.5, min_delta_ms=1.0)
+    assert [r['case'] for r in regressions] == ['slow']
+
+
+def test_instrumentation_records_stages(tmp_path):
+    """Замеры этапов, гистограммы моделей и счетчики попадают во все приемники, ответы не меняются"""
+    recommender, features_df = _load()
+    user = features_df.iloc[0].to_dict()
+    expected = recommender.recommend(user, top_n=5, category_filter='cards')
+
+    memory, prometheus = InMemorySink(), PrometheusSink()
+    log_path = tmp_path / 'metrics.jsonl'
+    recommender.enable_instrumentation([memory, prometheus, JsonLogSink(str(log_path))])
+    assert recommender.recommend(user, top_n=5, category_filter='cards') == expected
+    recommender.metrics.sinks[2].stream.close()
+
+    snapshot = memory.snapshot()
+    assert {'recommend.prepare', 'recommend.score', 'recommend.sort', 'recommend.format'} <= set(snapshot['stages'])
+    cards = [p for p in recommender.models if recommender.product_catalog[p]['category'] == 'cards']
+    assert set(snapshot['models']) == set(cards)
+    assert snapshot['events']['recommend.models_skipped'] == len(recommender.models) - len(cards)
+
+    text = prometheus.render()
+    assert 'recommender_stage_seconds_count{stage="recommend.score"} 1' in text
+    assert f'recommender_events_total{{event="recommend.models_skipped"}} {len(recommender.models) - len(cards)}' in text
+    with open(log_path) as f:
+        assert len(f.readlines()) == len(snapshot['stages']) + len(cards) + len(recommender.models) - len(cards)
+
+
+def test_broken_model_quarantined_with_fallback(tmp_path):
+    """Модель с чужим числом признаков и отсутствующая модель уходят в карантин, ранжирование остается полным"""
+    recommender, features_df = _load()
+    models_dir = tmp_path / 'models'
+    shutil.copytree('models', models_dir, ignore=shutil.ignore_patterns(PACK_FILE))
+
+    broken, removed = list(recommender.models)[:2]
+    wrong = xgb.XGBClassifier(n_estimators=2, max_depth=2).fit(np.random.rand(20, 3), np.arange(20) % 2)
+    wrong.save_model(models_dir / f'model_{broken}.json')
+    os.remove(models_dir / f'model_{removed}.json')
+
+    loaded = MultiProductRecommender.load(str(models_dir), strict=False)
+    assert set(loaded.health.quarantined) == {broken, removed}
+    assert set(loaded.models) == set(recommender.models) - {broken, removed}
+    assert loaded.fallback_proba[broken] == np.float32(loaded.positive_rates.get(broken, 0.05))
+
+    recs = loaded.recommend(features_df.iloc[0].to_dict(), top_n=len(recommender.models))
+    assert {rec.product_id for rec in recs} == set(recommender.models)
+    assert loaded.recommend_batch(features_df.iloc[:20], top_n=5) == [
+        loaded.recommend(user, top_n=5) for user in features_df.iloc[:20].to_dict('records')
+    ]
+
+    health = validate_models(recommender.models, recommender.feature_names, recommender.product_catalog)
+    assert not health.quarantined
+
+
+def test_eligibility_mask_and_pruning():
+    """Недопущенные пары не доходят до моделей, отсечение по верхней границе не меняет top-N"""
+    recommender, features_df = _load()
+    full = recommender.recommend_batch(features_df, top_n=5)
+
+    recommender.enable_eligibility(prune=False)
+    products, _, masked_scores, _ = recommender._score_matrix(features_df)
+    eligible = recommender.eligibility.mask(features_df, products)
+    assert np.array_equal(np.isfinite(masked_scores), eligible)
+    masked = recommender.recommend_batch(features_df, top_n=5)
+    assert masked != full
+
+    recommender.enable_eligibility(prune=True)
+    pruned = recommender.recommend_batch(features_df, top_n=5)
+    assert pruned == masked
+    assert pruned == [recommender.recommend(user, top_n=5) for user in features_df.to_dict('records')]
+
+    stats = recommender.eligibility.report()
+    assert stats['pairs'] == len(features_df) * len(recommender.models)
+    assert stats['ineligible'] == (~eligible).sum() and stats['pruned'] > 0
+
+
+def test_boost_tables_from_data():
+    """Правила бустинга из данных: матрицы совпадают с правилами, измененная таблица меняет скоры"""
+    recommender, features_df = _load()
+    tables = BoostTables.from_dict(json.loads(json.dumps(recommender.boost_tables.to_dict())))
+
+    type_matrix = tables.type_matrix(['cards', 'loans', 'other'])
+    assert type_matrix.dtype == np.float32 and type_matrix.shape == (len(USER_TYPES), 3)
+    assert type_matrix[USER_TYPES.index('digital'), 0] == np.float32(1.8)
+    assert (type_matrix[USER_TYPES.index('casual')] == 1).all()
+
+    behavior = tables.behavior_matrix(features_df, ['premium', 'cards'])
+    single = np.vstack([tables.behavior_matrix(user, ['premium', 'cards']) for user in features_df.to_dict('records')])
+    assert np.array_equal(behavior, single)
+
+    recommender.boost_tables = BoostTables(type_boosts={'senior': {'cards': 100.0}}, behavior_boosts=[])
+    recs = recommender.recommend_batch(features_df, top_n=1)
+    senior = recommender._detect_user_types(features_df) == 'senior'
+    assert senior.any()
+    assert all(recs[i][0].category == 'cards' for i in np.flatnonzero(senior))
+
+
+def test_explanations_lazy_and_memoized():
+    """explain=False убирает только объяснения; шаблоны memoized, explain() дает тот же текст"""
+    recommender, features_df = _load()
+
+    full = recommender.recommend_batch(features_df, top_n=5)
+    bare = recommender.recommend_batch(features_df, top_n=5, explain=False)
+    assert full.explanations is not None and bare.explanations is None
+    np.testing.assert_array_equal(bare.score, full.score)
+    assert [rec.product_id for recs in bare for rec in recs] == [rec.product_id for recs in full for rec in recs]
+    # 200 пользователей × 5 продуктов — единицы уникальных текстов
+    assert 0 < len(recommender.explanations) < 50
+
+    user = features_df.iloc[0].to_dict()
+    single = recommender.recommend(user, top_n=5, explain=False)
+    assert single[0].explanation is None and 'explanation' not in single[0].to_dict()
+    assert [recommender.explain(user, rec.product_id) for rec in single] == [rec.explanation for rec in full[0]]
+
+
+def test_incremental_training_refits_changed_products(tmp_path):
+    """Дообучение: без изменений ничего не пишется; изменившиеся продукты продолжают свой бустер"""
+    recommender, _ = _load()
+    features_df = pd.read_parquet('user_features_enhanced.pq')
+    models_dir = tmp_path / 'models'
+    shutil.copytree('models', models_dir)
+
+    loaded = MultiProductRecommender.load(str(models_dir))
+    assert loaded.label_fingerprints  # отпечатки сохранены при обучении
+    mtimes = {p.name: p.stat().st_mtime_ns for p in models_dir.iterdir()}
+    loaded.train(features_df, incremental=True)
+    assert {p.name: p.stat().st_mtime_ns for p in models_dir.iterdir()} == mtimes
+
+    # Изменилась одна фича (разнообразие интересов) — меняются метки только части продуктов
+    changed_df = features_df.assign(diversity_ratio=features_df['diversity_ratio'] * 1.5)
+    rounds_before = {p: m.get_booster().num_boosted_rounds() for p, m in loaded.models.items()}
+    old_fingerprints = dict(loaded.label_fingerprints)
+    loaded.train(changed_df, incremental=True, extra_rounds=5)
+
+    changed = {p for p in old_fingerprints if loaded.label_fingerprints[p] != old_fingerprints[p]}
+    assert changed and changed != set(old_fingerprints)
+    for product, model in loaded.models.items():
+        expected = rounds_before[product] + (5 if product in changed else 0)
+        assert model.get_booster().num_boosted_rounds() == expected
+    rewritten = {p.name for p in models_dir.iterdir() if p.name.startswith('model_') and p.stat().st_mtime_ns != mtimes[p.name]}
+    assert rewritten == {f'model_{p}.json' for p in changed}
+
+    reloaded = MultiProductRecommender.load(str(models_dir))
+    assert reloaded.label_fingerprints == loaded.label_fingerprints
+    np.testing.assert_array_equal(reloaded.scaler.mean_, recommender.scaler.mean_)
+
+
+def test_evaluation_metrics_match_loop():
+    """Векторные метрики выдачи совпадают с поштучным подсчетом по recommend_batch"""
+    from sklearn.metrics import hamming_loss, jaccard_score
+    recommender, features_df = _load()
+    result = evaluate_recommender(recommender, features_df, k=[5], n_bootstrap=20, n_workers=4)
+
+    labels = recommender.create_target_matrix(features_df, verbose=False)
+    batch = recommender.recommend_batch(features_df, top_n=5, explain=False)
+    precision, recall, ndcg, ap, served = [], [], [], [], set()
+    for user_labels, recommendations in zip(labels, batch):
+        relevant = {p for p, label in zip(recommender.all_products, user_labels) if label}
+        hits = [rec.product_id in relevant for rec in recommendations]
+        served.update(rec.product_id for rec in recommendations)
+        precision.append(sum(hits) / 5)
+        if relevant:
+            recall.append(sum(hits) / len(relevant))
+            ideal = sum(1 / np.log2(i + 2) for i in range(min(len(relevant), 5)))
+            ndcg.append(sum(1 / np.log2(i + 2) for i, hit in enumerate(hits) if hit) / ideal)
+            ap.append(sum(sum(hits[:i + 1]) / (i + 1) for i, hit in enumerate(hits) if hit) / min(len(relevant), 5))
+
+    metrics = result['metrics'][5]
+    assert metrics['precision'] == pytest.approx(np.mean(precision))
+    assert metrics['recall'] == pytest.approx(np.mean(recall))
+    assert metrics['ndcg'] == pytest.approx(np.mean(ndcg))
+    assert metrics['map'] == pytest.approx(np.mean(ap))
+    assert metrics['coverage'] == pytest.approx(len(served) / len(recommender.all_products))
+
+    X = scale_inplace(recommender.feature_schema.transform(features_df), recommender.scaler)
+    predicted = np.zeros_like(labels)
+    for i, product in enumerate(recommender.all_products):
+        if product in recommender.models:
+            predicted[:, i] = recommender.models[product].predict(X)
+    assert result['hamming_loss'] == pytest.approx(hamming_loss(labels, predicted))
+    assert result['jaccard'] == pytest.approx(jaccard_score(labels, predicted, average='samples', zero_division=1))
+
+    low, high = result['confidence_intervals'][5]['precision']
+    assert low <= metrics['precision'] <= high
+
+    # Стратифицированная подвыборка: пропорции типов сохраняются
+    codes = recommender._user_type_codes(features_df)
+    idx = stratified_sample(codes, 50)
+    assert len(set(codes[idx])) == len(set(codes))
+    assert len(idx) == pytest.approx(50, abs=len(set(codes)))
+
+
+def test_report_summary_matches_per_user_loop():
+    """Сводка отчета из колоночной выдачи совпадает с поштучным подсчетом по спискам рекомендаций"""
+    from collections import Counter
+    recommender, features_df = _load()
+    batch = recommender.recommend_batch(features_df, top_n=7, explain=False)
+    lists = batch.to_lists()
+    catalog_size = len(recommender.product_catalog)
+
+    summary = RecommendationSummary.from_recommendations(batch, catalog_size)
+    product_counts = Counter(rec.product_id for recs in lists for rec in recs)
+    scores = np.array([rec.score for recs in lists for rec in recs], dtype=np.float64)
+    diversity = [len({rec.category for rec in recs}) / max(1, len(recs)) for recs in lists]
+
+    assert summary.n_users == len(features_df)
+    assert summary.total_recs == len(scores)
+    assert summary.unique_products == len(product_counts)
+    assert summary.product_counts[summary.product_counts > 0].to_dict() == dict(product_counts)
+    assert summary.score_stats['median'] == pytest.approx(np.median(scores))
+    assert summary.score_stats['high_quality_share'] == pytest.approx((scores > 0.3).mean())
+    assert summary.mean_diversity == pytest.approx(np.mean(diversity))
+    assert summary.score_hist.tolist() == np.histogram(scores, bins=30)[0].tolist()
+    for category in summary.category_counts[summary.category_counts > 0].index:
+        category_scores = [rec.score for recs in lists for rec in recs if rec.category == category]
+        assert summary.category_mean_score[category] == pytest.approx(np.mean(category_scores))
+
+    # Arrow-таблица и списки дают ту же сводку
+    for source in (batch.to_arrow(features_df['user_id']), lists):
+        other = RecommendationSummary.from_recommendations(source, catalog_size)
+        assert other.product_counts[other.product_counts > 0].to_dict() == dict(product_counts)
+        assert other.mean_diversity == pytest.approx(summary.mean_diversity)
+        assert other.recs_per_user_counts.tolist() == summary.recs_per_user_counts.tolist()
+
+
+def test_recommend_batch_min_score_and_concat():
+    """min_score отсекает скоры не выше порога; склейка шардов совпадает с одним батчем"""
+    recommender, features_df = _load()
+    full = recommender.recommend_batch(features_df, top_n=7, explain=False)
+    threshold = float(np.median(full.score))
+
+    filtered = recommender.recommend_batch(features_df, top_n=7, explain=False, min_score=threshold)
+    assert filtered == [[rec for rec in recs if rec.score > threshold] for recs in full]
+
+    shards = [recommender.recommend_batch(features_df.iloc[start:start + 70], top_n=7, explain=False, min_score=threshold)
+              for start in range(0, len(features_df), 70)]
+    merged = RecommendationBatch.concat(shards)
+    assert len(merged) == len(features_df)
+    assert merged == filtered
+
+    # Целые id — int64 без переполнения отрицательных, беззнаковые — uint64
+    table = full.to_arrow(-np.arange(len(features_df)))
+    assert table.schema.field('user_id').type == pa.int64() and table['user_id'][-1].as_py() == 1 - len(features_df)
+    assert full.to_arrow(np.arange(len(features_df), dtype=np.uint32)).schema.field('user_id').type == pa.uint64()
+
+
+def test_visualizer_renders_changed_plots_only(tmp_path):
+    """Отчет рисуется в output_dir; неизменившиеся графики пропускаются, агрегаты выгружаются в JSON/CSV"""
+    recommender, features_df = _load()
+    visual_module = importlib.import_module('src.07_visualization_report')
+    visualizer = visual_module.RecommenderVisualizer(features_df, 'models', str(tmp_path), dpi=20)
+    visualizer.summarize(recommender.recommend_batch(features_df, top_n=7, explain=False))
+
+    assert set(visualizer.render_report(workers=2)) == set(visual_module.PLOTS)
+    assert all((tmp_path / f'{name}.png').exists() for name in visual_module.PLOTS)
+    assert visualizer.render_report() == {}
+
+    # Другая выдача: меняются агрегаты выдачи, сегменты пользователей — нет
+    visualizer.summarize(recommender.recommend_batch(features_df, top_n=3, explain=False))
+    assert set(visualizer.render_report()) == {'product_coverage', 'recommendation_quality'}
+
+    json_path, = visualizer.export_aggregates('json')
+    with open(json_path, encoding='utf-8') as f:
+        aggregates = json.load(f)
+    assert aggregates['recommendations']['total_recs'] == visualizer.summary.total_recs
+    csv_paths = visualizer.export_aggregates('csv')
+    product_counts = pd.read_csv(tmp_path / 'product_counts.csv')
+    assert product_counts['count'].sum() == visualizer.summary.total_recs
+    assert len(csv_paths) == 7
+
+
+def test_demo_batch_scoring_and_coverage_curves():
+    """Пакетный скоринг демо совпадает с recommend; кривые покрытия — с перебором по порогам"""
+    demo_module = importlib.import_module('src.06_interactive_demo')
+    demo = demo_module.RecommenderDemo()
+    users = demo.sample_users.iloc[:150]
+
+    batch = demo.recommend_batch(users, top_n=7, min_score=0.05)
+    assert batch == [demo.recommend(user, top_n=7, min_score=0.05) for user in users.to_dict('records')]
+
+    personas = [demo.create_user_persona(name) for name in ('пенсионер', 'инвестор')]
+    assert demo.recommend_batch(personas, top_n=5) == [demo.recommend(p, top_n=5) for p in personas]
+
+    products, _, scores = demo.score_matrix(users)
+    curves = demo.coverage_curves(scores, (1, 3, 7), (0.05, 0.5))
+    for min_score in (0.05, 0.5):
+        for top_n in (1, 3, 7):
+            covered = {rec.product_id for recs in demo.recommend_batch(users, top_n, min_score) for rec in recs}
+            assert curves.loc[min_score, top_n] == len(covered)
+
+    all_recommended, _ = demo.analyze_coverage()
+    full = demo.recommend_batch(demo.sample_users, top_n=7, min_score=0.05)
+    assert all_recommended == {rec.product_id for recs in full for rec in recs}
@@ -54,7 +54,7 @@ def test_multi_product_recommender():
         if recs:
             print("   📋 Топ-5 рекомендаций:")
             for j, rec in enumerate(recs, 1):
-                print(f"      {j}. {rec['product_id']} ({rec['probability']}) - {rec['category']}")
+                print(f"      {j}. {rec.product_id} ({rec.probability_text}) - {rec.category}")
         else:
             print("   ❌ Нет рекомендаций")
     
@@ -66,7 +66,7 @@ def test_multi_product_recommender():
     for category in categories:
         recommendations = recommender.recommend(test_user, top_n=3, category_filter=category)
         if recommendations:
-            products = [r['product_id'] for r in recommendations]
+            products = [r.product_id for r in recommendations]
             print(f"   {category}: {products}")
         else:
             print(f"   {category}: нет рекомендаций")